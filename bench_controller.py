@@ -0,0 +1,352 @@
+"""
+bench_controller.py: control plane throughput of dynamic_controller.py without
+Mininet
+
+Drives DynamicController with fake datapaths: connection objects that count
+what the controller sends them, and PacketIns replayed from a seeded workload
+built on the hosts of the topology (utils.py of final-topo by default). The
+hosts of SWITCH_PORTS keep their addresses, switches and ports; bigger
+topologies add synthetic hosts round-robin over the switches. Traffic between
+switches crosses the router on ROUTER_PORT, so the remote switch sees the
+router MAC. Measures, as the number of switches and hosts grows:
+
+    PacketIns handled per second by _handle_PacketIn
+    the latency of the reconfigurations the IDS commands trigger:
+    targeted_switch_flow with its staged failover flows and without (the
+    batch over the learned flows), switch_flow and simple_switch_flow, each
+    from the tables left by the PacketIns
+
+The controller is built with proactive=False, the proactive flows would keep
+the declared hosts away from the controller. POX is used directly when it
+can be imported from POX_DIR (~/pox by default), the messages are then packed
+as a real connection would. Without it, minimal stand-ins of the POX modules
+dynamic_controller.py imports are installed: the timings then leave out the
+construction and packing of the OpenFlow messages.
+
+Run with: python bench_controller.py [packet_ins] [topology]
+"""
+
+import logging
+import os
+import random
+import sys
+import time
+import types
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+POX_DIR = os.environ.get('POX_DIR', os.path.expanduser('~/pox'))
+
+# (switches, hosts) of every run, the first one is final-topo
+SIZES = ((3, 13), (8, 64), (32, 256), (128, 1024))
+REPEATS = 20
+SEED = 1
+ARP_SHARE = 0.05                        # broadcast ARP requests among the PacketIns
+ENIP_PORT = 44818
+
+ROUTER_MAC = '02:00:00:00:00:01'
+BROADCAST_MAC = 'ff:ff:ff:ff:ff:ff'
+
+
+def fake_pox():
+    """ Installs the parts of POX dynamic_controller.py uses as plain
+    attribute bags """
+
+    class EthAddr(str):
+        @property
+        def is_multicast(self):
+            return bool(int(self[:2], 16) & 1)
+
+        def isBridgeFiltered(self):
+            return self.startswith('01:80:c2:00:00:0')
+
+    class Frame(object):
+        """ Parsed packet of a PacketIn, with its IP or ARP addresses """
+        IP_TYPE = 0x800
+        ARP_TYPE = 0x806
+        LLDP_TYPE = 0x88cc
+
+        def __init__(self, src, dst, type, srcip, dstip, protocol=None, dstport=None):
+            self.src = EthAddr(src)
+            self.dst = EthAddr(dst)
+            self.type = type
+            self.srcip = srcip
+            self.dstip = dstip
+            self.protocol = protocol
+            self.dstport = dstport
+
+    class Message(object):
+        xids = [0]
+
+        def __init__(self, **fields):
+            self.actions = []
+            self.flags = 0
+            self.priority = of.OFP_DEFAULT_PRIORITY
+            self.match = None
+            self.buffer_id = None
+            self.idle_timeout = 0
+            self.hard_timeout = 0
+            self.data = None
+            self.__dict__.update(fields)
+            Message.xids[0] += 1
+            self.xid = Message.xids[0]
+
+    class ofp_match(object):
+        FIELDS = ('in_port', 'dl_src', 'dl_dst', 'dl_vlan', 'dl_vlan_pcp', 'dl_type', 'nw_tos',
+                  'nw_proto', 'nw_src', 'nw_dst', 'tp_src', 'tp_dst')
+
+        def __init__(self, **fields):
+            for name in self.FIELDS:
+                setattr(self, name, fields.get(name))
+
+        @classmethod
+        def from_packet(cls, packet, in_port=None):
+            return cls(in_port=in_port, dl_src=packet.src, dl_dst=packet.dst, dl_type=packet.type,
+                       nw_src=packet.srcip, nw_dst=packet.dstip, nw_proto=packet.protocol,
+                       tp_dst=packet.dstport)
+
+    class ofp_action_output(object):
+        def __init__(self, port):
+            self.port = port
+
+    class Core(object):
+        def getLogger(self, name='dynamic_controller'):
+            return logging.getLogger(name)
+
+    names = ('pox', 'pox.core', 'pox.openflow', 'pox.openflow.libopenflow_01', 'pox.openflow.of_json',
+             'pox.lib', 'pox.lib.packet', 'pox.lib.packet.ethernet', 'pox.lib.recoco', 'pox.lib.util',
+             'pox.lib.addresses', 'pox.lib.revent')
+    for name in names:
+        sys.modules[name] = types.ModuleType(name)
+    for name in names:
+        if '.' in name:
+            parent, child = name.rsplit('.', 1)
+            setattr(sys.modules[parent], child, sys.modules[name])
+
+    of = sys.modules['pox.openflow.libopenflow_01']
+    of.OFP_DEFAULT_PRIORITY = 0x8000
+    of.OFP_FLOW_PERMANENT = 0
+    of.OFPFC_ADD = 0
+    of.OFPFC_DELETE = 3
+    of.OFPFC_DELETE_STRICT = 4
+    of.OFPFF_SEND_FLOW_REM = 1
+    of.OFPP_FLOOD = 0xfffb
+    of.ofp_match = ofp_match
+    of.ofp_action_output = ofp_action_output
+    for name in ('ofp_flow_mod', 'ofp_packet_out', 'ofp_packet_in', 'ofp_barrier_request',
+                 'ofp_stats_request', 'ofp_flow_stats_request', 'ofp_port_stats_request'):
+        setattr(of, name, type(name, (Message,), {}))
+
+    sys.modules['pox.core'].core = Core()
+    sys.modules['pox.openflow.of_json'].__all__ = []
+    sys.modules['pox.lib.packet.ethernet'].ethernet = Frame
+    sys.modules['pox.lib.recoco'].Timer = None
+    sys.modules['pox.lib.util'].dpid_to_str = lambda dpid: '-'.join(
+        '%02x' % ((dpid >> (8 * i)) & 0xff) for i in reversed(range(6)))
+    sys.modules['pox.lib.util'].str_to_bool = lambda value: str(value).lower() in ('1', 'true', 'yes', 'on')
+    addresses = sys.modules['pox.lib.addresses']
+    addresses.IPAddr = str
+    addresses.IPAddr6 = str
+    addresses.EthAddr = EthAddr
+    revent = sys.modules['pox.lib.revent']
+    revent.Event = revent.EventMixin = revent.EventHalt = object
+
+    def packet(src, dst, srcip, dstip, arp):
+        if arp:
+            return Frame(src, dst, Frame.ARP_TYPE, srcip, dstip)
+        return Frame(src, dst, Frame.IP_TYPE, srcip, dstip, 6, ENIP_PORT)
+    return packet
+
+
+def real_pox():
+    """ Imports POX from POX_DIR, returns None when it is not there """
+    sys.path.insert(0, POX_DIR)
+    try:
+        import pox.core
+    except ImportError:
+        sys.path.remove(POX_DIR)
+        return None
+    if pox.core.core is None:
+        pox.core.initialize()
+
+    from pox.lib.addresses import EthAddr, IPAddr
+    from pox.lib.packet import arp, ethernet, ipv4, tcp
+
+    def packet(src, dst, srcip, dstip, is_arp):
+        frame = ethernet(src=EthAddr(src), dst=EthAddr(dst))
+        if is_arp:
+            frame.type = ethernet.ARP_TYPE
+            frame.payload = arp(opcode=arp.REQUEST, hwsrc=EthAddr(src), protosrc=IPAddr(srcip),
+                                protodst=IPAddr(dstip))
+        else:
+            frame.type = ethernet.IP_TYPE
+            frame.payload = ipv4(protocol=ipv4.TCP_PROTOCOL, srcip=IPAddr(srcip), dstip=IPAddr(dstip))
+            frame.payload.payload = tcp(srcport=50000, dstport=ENIP_PORT)
+        # Parsed back from the wire, as PacketIn.parsed is
+        return ethernet(frame.pack())
+    return packet
+
+
+class FakeConnection(object):
+    """ Datapath that counts the messages sent to it """
+
+    def __init__(self, dpid):
+        self.dpid = dpid
+        self.messages = 0
+        self.bytes = 0
+
+    def send(self, msg):
+        self.messages += 1
+        pack = getattr(msg, 'pack', None)
+        if pack is not None:
+            self.bytes += len(pack())
+
+    def addListeners(self, listener):
+        pass
+
+
+class FakePacketIn(object):
+    """ The attributes of a POX PacketIn event _handle_PacketIn reads """
+
+    def __init__(self, connection, port, parsed, ofp):
+        self.connection = connection
+        self.dpid = connection.dpid
+        self.port = port
+        self.parsed = parsed
+        self.ofp = ofp
+
+
+def mac_of(ip):
+    return '00:00:%02x:%02x:%02x:%02x' % tuple(int(octet) for octet in ip.split('.'))
+
+
+def hosts_of(utils, switches, count):
+    """ (name, ip, mac, dpid, port) of count hosts over switches, the declared
+    ones first """
+    hosts = []
+    next_port = dict((dpid, utils.ROUTER_PORT + 1) for dpid in range(1, switches + 1))
+    for name, (dpid, port) in sorted(utils.SWITCH_PORTS.items(), key=lambda item: item[1]):
+        if dpid <= switches and len(hosts) < count:
+            hosts.append((name, utils.IP[name], mac_of(utils.IP[name]), dpid, port))
+            next_port[dpid] = max(next_port[dpid], port + 1)
+
+    index = 0
+    while len(hosts) < count:
+        dpid = index % switches + 1
+        ip = '10.%d.%d.%d' % (dpid, index // 250, index % 250 + 1)
+        hosts.append(('host%d' % index, ip, mac_of(ip), dpid, next_port[dpid]))
+        next_port[dpid] += 1
+        index += 1
+    return hosts
+
+
+def workload(of, packet, connections, hosts, count, router_port, seed=SEED):
+    """ count PacketIns between random pairs of hosts """
+    rng = random.Random(seed)
+    cache = {}
+
+    def packet_in(dpid, port, src, dst, srcip, dstip, arp=False):
+        key = (src, dst, srcip, dstip, arp)
+        if key not in cache:
+            parsed = packet(src, dst, srcip, dstip, arp)
+            data = parsed.pack() if hasattr(parsed, 'pack') else None
+            cache[key] = (parsed, of.ofp_packet_in(in_port=port, buffer_id=None, data=data))
+        parsed, ofp = cache[key]
+        return FakePacketIn(connections[dpid], port, parsed, ofp)
+
+    events = []
+    while len(events) < count:
+        src, dst = rng.sample(hosts, 2)
+        name, srcip, src_mac, src_dpid, src_port = src
+        name, dstip, dst_mac, dst_dpid, dst_port = dst
+        if rng.random() < ARP_SHARE:
+            events.append(packet_in(src_dpid, src_port, src_mac, BROADCAST_MAC, srcip, dstip, True))
+        elif src_dpid == dst_dpid:
+            events.append(packet_in(src_dpid, src_port, src_mac, dst_mac, srcip, dstip))
+        else:
+            events.append(packet_in(src_dpid, src_port, src_mac, ROUTER_MAC, srcip, dstip))
+            events.append(packet_in(dst_dpid, router_port, ROUTER_MAC, dst_mac, srcip, dstip))
+    return events[:count]
+
+
+def load(topology):
+    """ Imports dynamic_controller against POX or its stand-ins, returns the
+    module, its utils and the packet builder """
+    sys.path.insert(0, os.path.join(ROOT, topology))
+    sys.path.insert(0, ROOT)
+    packet = real_pox()
+    fake = packet is None
+    if fake:
+        packet = fake_pox()
+
+    import dynamic_controller
+    import utils
+
+    class IdleSocket(dynamic_controller.ControllerSocket):
+        """ Never listens for the IDSs """
+        def start(self):
+            self.sock.close()
+    dynamic_controller.ControllerSocket = IdleSocket
+    return dynamic_controller, utils, packet, fake
+
+
+def timed_reconfiguration(controller, snapshot, func, *args):
+    """ Latency of func, from the tables the PacketIns left """
+    installed, staged = snapshot
+    controller.installed = dict((dpid, dict(flows)) for dpid, flows in installed.items())
+    controller.staged = dict((dpid, set(sensors)) for dpid, sensors in staged.items())
+    controller.pending_barriers.clear()
+    controller.quarantined = {}
+    controller.attack_detected = False
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+
+def run(dc, utils, packet, switches, count, packet_ins):
+    of = dc.of
+    controller = dc.DynamicController(reroute='targeted', proactive=False)
+    connections = dict((dpid, FakeConnection(dpid)) for dpid in range(1, switches + 1))
+    for dpid in sorted(connections):
+        controller.add_connection_object(connections[dpid])
+
+    hosts = hosts_of(utils, switches, count)
+    events = workload(of, packet, connections, hosts, packet_ins, utils.ROUTER_PORT)
+    handle = controller._handle_PacketIn
+    start = time.time()
+    for event in events:
+        handle(event)
+    elapsed = time.time() - start
+
+    totals = dict((name, sum(counters[name] for counters in controller.counters.values()))
+                  for name in dc.SWITCH_COUNTERS)
+    installed = sum(len(flows) for flows in controller.installed.values())
+
+    snapshot = (controller.installed, controller.staged)
+    latencies = []
+    for func, args, tables in (
+            (controller.targeted_switch_flow, ('lit101', 'ids101'), snapshot),
+            (controller.targeted_switch_flow, ('lit101', 'ids101'), (snapshot[0], {})),
+            (controller.switch_flow, ('lit101', 'ids101', 10, of.OFP_FLOW_PERMANENT, True), snapshot),
+            (controller.simple_switch_flow, (), snapshot)):
+        runs = sorted(timed_reconfiguration(controller, tables, func, *args) for i in range(REPEATS))
+        latencies.append(runs[len(runs) // 2])
+
+    print "%8d %6d %12.0f %10.2f %7d %8d %9d %11.1f %11.1f %11.1f %11.1f" % (
+        switches, len(hosts), len(events) / elapsed, 1e6 * elapsed / len(events), totals['flood'],
+        totals['flow_mod'], installed, 1e6 * latencies[0], 1e6 * latencies[1], 1e6 * latencies[2],
+        1e6 * latencies[3])
+
+
+if __name__ == '__main__':
+    packet_ins = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    topology = sys.argv[2] if len(sys.argv) > 2 else 'final-topo'
+
+    logging.basicConfig(level=logging.WARNING)
+    dc, utils, packet, fake = load(topology)
+    print "%d PacketIns per run, %s, median of %d reconfigurations (us)" % (
+        packet_ins, 'POX stand-ins' if fake else 'POX from ' + POX_DIR, REPEATS)
+    print "%8s %6s %12s %10s %7s %8s %9s %11s %11s %11s %11s" % (
+        'switches', 'hosts', 'packet_in/s', 'us/pkt_in', 'flood', 'flow_mod', 'installed',
+        'targeted', 'unstaged', 'switch_flow', 'simple')
+    for switches, count in SIZES:
+        run(dc, utils, packet, switches, count, packet_ins)
@@ -22,26 +22,128 @@ from pox.lib.util import str_to_bool
 from pox.openflow.of_json import *
 #from oslo.config import cfg
 
-from threading import Thread
+from threading import Thread, Lock, current_thread
+from collections import Counter, deque
 
 
+import bisect
 import json
+import math
+import BaseHTTPServer
+import os
 import select
 import socket
 
 
 #from controller_utils import *
 from utils import *
+import utils
+import codec
+from channel import FrameError, read_frames
 
 log = core.getLogger()
 
+# Priority of the flows installed when a source is rerouted, above the
+# learned ones (10000)
+REROUTE_PRIORITY = 30000
+# Priority of the pre-staged failover flows, below the learned ones
+STANDBY_PRIORITY = 5000
+# Priority of the flows installed from the topology, above the learned ones
+PROACTIVE_PRIORITY = 20000
+# Priority of the pre-staged failover flows when the proactive flows are
+# installed, above the proactive flow of each source towards its PLC
+STANDBY_PROACTIVE_PRIORITY = PROACTIVE_PRIORITY + 2
+# Priority of the flows quarantining a compromised source, above every other
+QUARANTINE_PRIORITY = 40000
+# Default (idle, hard) timeouts of the quarantine flows, 0 keeps them until
+# the controller deletes them
+QUARANTINE_TIMEOUTS = (0, 0)
+
+# Seconds between the prints of the per switch counters
+COUNTERS_PERIOD = 10
+SWITCH_COUNTERS = ('packet_in', 'flood', 'flow_mod', 'drop')
+
+# Alert to applied latencies: file rewritten after every reconfiguration,
+# number of reconfigurations kept and histogram bucket bounds (seconds)
+CONTROL_TIME_PATH = 'control_time.json'
+CONTROL_TIME_WINDOW = 1000
+CONTROL_TIME_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+
+# Counter polling detector: smoothing of the baselines, polls before
+# flagging, rate spike thresholds and packet rate of an active flow
+DETECTOR_ALPHA = 0.1
+DETECTOR_WARMUP = 10
+DETECTOR_SPIKE_SIGMAS = 6.0
+DETECTOR_SPIKE_FACTOR = 2.0
+DETECTOR_ACTIVE_RATE = 0.5
+
+# Local port of the HTTP metrics endpoint
+METRICS_PORT = 8008
+
+# Sensor to PLC paths given failover flows at ConnectionUp, as
+# (sensor, backup source, PLC) names of utils.IP and DPCTL_PORTS
+PROTECTED_PATHS = (
+    ('lit101', 'ids101', 'plc101'),
+)
+
+
+def flow_key(match, priority):
+    """ Identity of an installed flow entry in the flow table of a switch """
+    return (match.in_port, match.dl_type, str(match.nw_src), str(match.nw_dst), priority)
+
+def percentile(ordered, fraction):
+    """ Nearest rank percentile of a sorted list """
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(math.ceil(fraction * len(ordered))) - 1)]
+
+
+class LatencyWindow(object):
+    """ Last latencies of a series, summarized as percentiles and a
+    histogram """
+
+    def __init__(self, size=CONTROL_TIME_WINDOW):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+        # Since the start, for the metrics endpoint
+        self.sum = 0.0
+        self.buckets = [0] * (len(CONTROL_TIME_BUCKETS) + 1)
+
+    def add(self, latency):
+        self.samples.append(latency)
+        self.count += 1
+        self.sum += latency
+        self.buckets[bisect.bisect_left(CONTROL_TIME_BUCKETS, latency)] += 1
+
+    def summary(self):
+        ordered = sorted(self.samples)
+        bounds = CONTROL_TIME_BUCKETS + (None,)
+        histogram = [0] * len(bounds)
+        for latency in ordered:
+            histogram[bisect.bisect_left(CONTROL_TIME_BUCKETS, latency)] += 1
+        return {
+            'count': self.count,
+            'window': len(ordered),
+            'last': self.samples[-1] if ordered else None,
+            'min': ordered[0] if ordered else None,
+            'max': ordered[-1] if ordered else None,
+            'p50': percentile(ordered, 0.50),
+            'p95': percentile(ordered, 0.95),
+            'p99': percentile(ordered, 0.99),
+            'histogram': [{'le': bound, 'count': count} for bound, count in zip(bounds, histogram)],
+        }
+
+
 class ControllerSocket(Thread):
-    """ Class that receives water level from the water_tank.py  """
+    """ Accepts the IDSs, reads the framed commands of their persistent
+    connections and queues them on the dispatcher """
 
     def __init__(self, report_object):
         Thread.__init__(self)
         self.report_object = report_object    
+        self.dispatcher = Dispatcher(report_object.received_message)
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)     # Create a socket object
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 
     def run(self):
         print 'DEBUG listening on port', int(PORTS['controller_ids_port'])
@@ -51,43 +153,309 @@ class ControllerSocket(Thread):
         while True:
             try:
                 client, addr = self.sock.accept()
-                data = client.recv(14336)                                                # Get data from the client
-                #print 'Message from', addr                                              # Print a message confirming
-                if data:
-                    data_treatment = HandleMessage(self.report_object, data)    # Call the thread to work with the data received
-                    data_treatment.setDaemon(True)                                  # Set the thread as a demond
-                    data_treatment.start()                                                  # Start the thread
+                # One reader per connection, the IDSs keep theirs open
+                reader = Thread(target=self.read_source, args=(client, addr[0]))
+                reader.setDaemon(True)
+                reader.start()
             except KeyboardInterrupt:
                 print "\nCtrl+C was hitten, stopping server"
-                client.close()
                 break
 
+    def read_source(self, client, source):
+        try:
+            for payload in read_frames(client):
+                self.dispatcher.put(payload)
+        except socket.error:
+            pass
+        except FrameError, e:
+            log.error("Closing the connection of %s: %s", source, e)
+        finally:
+            client.close()
+
     def close_connection(self):
         #self.socket_flag = False
         self.sock.shutdown(socket.SHUT_RDWR)
         self.sock.close()
 
-class HandleMessage(Thread):
 
-    """ Class that process the message and calls appropiate handling method """
-    def __init__(self, report_object, received):
-        Thread.__init__(self)
-        self.received = received
-        self.report_object = report_object
+class Dispatcher(object):
+    """ Hands the messages read from the IDSs to the POX thread, which owns
+    the flow tables and the connections, with core.callLater: they are
+    handled one at a time, in the order they arrived. Each reader counts
+    the messages it queued and the POX thread the ones it handled, so stats
+    sums the counters without taking a lock """
+
+    def __init__(self, handler):
+        self.handler = handler
+        # Messages queued, {reader thread: count}, each reader only writes
+        # its own
+        self.queued = {}
+
+        # Written only by the POX thread. Latency is the time from the
+        # reception of a message to the start of its handling
+        self.dispatched = 0
+        self.max_depth = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def put(self, payload):
+        reader = current_thread().ident
+        self.queued[reader] = self.queued.get(reader, 0) + 1
+        core.callLater(self.handle, payload, time.time())
+
+    def handle(self, payload, received):
+        latency = time.time() - received
+        self.max_depth = max(self.max_depth, self.depth())
+        self.dispatched += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        try:
+            self.handler(payload, received)
+        except Exception:
+            log.exception("Error handling a message")
+
+    def depth(self):
+        """ Messages queued and not handled yet """
+        return sum(self.queued.values()) - self.dispatched
+
+    def stats(self):
+        """ Counters since the start """
+        dispatched = self.dispatched
+        total_latency = self.total_latency
+        return {
+            'depth': self.depth(),
+            'max_depth': self.max_depth,
+            'dispatched': dispatched,
+            'total_latency': total_latency,
+            'avg_latency': total_latency / dispatched if dispatched else 0.0,
+            'max_latency': self.max_latency,
+        }
+
+class RateBaseline(object):
+    """ Exponentially weighted mean and variance of the packet and byte rates
+    of a counter pair, constant state whatever the number of polls """
+
+    def __init__(self):
+        self.counts = None              # (packets, bytes) of the last poll
+        self.time = None
+        self.mean = [0.0, 0.0]
+        self.var = [0.0, 0.0]
+        self.samples = 0
+        self.silent = False
+        self.expires = False            # entry with a hard timeout, its removal is no silence
+
+    def update(self, counts, now):
+        """ (packets/s, bytes/s) since the previous poll, None on the first
+        one or when the counters went back (the entry was reinstalled) """
+        previous, last = self.counts, self.time
+        self.counts, self.time = counts, now
+        if previous is None or counts[0] < previous[0] or now <= last:
+            return None
+        return tuple((count - before) / (now - last) for count, before in zip(counts, previous))
+
+    def spike(self, rates):
+        """ True when a rate is far above its baseline """
+        if self.samples < DETECTOR_WARMUP:
+            return False
+        return any(rate > DETECTOR_SPIKE_FACTOR * mean and rate > mean + DETECTOR_SPIKE_SIGMAS * math.sqrt(var)
+                   for rate, mean, var in zip(rates, self.mean, self.var))
+
+    def active(self):
+        return self.samples >= DETECTOR_WARMUP and self.mean[0] >= DETECTOR_ACTIVE_RATE
+
+    def learn(self, rates):
+        if self.samples == 0:
+            self.mean = list(rates)
+            self.samples = 1
+            return
+        for i, rate in enumerate(rates):
+            diff = rate - self.mean[i]
+            self.mean[i] += DETECTOR_ALPHA * diff
+            self.var[i] = (1.0 - DETECTOR_ALPHA) * (self.var[i] + DETECTOR_ALPHA * diff * diff)
+        self.samples += 1
+
+
+class StatsDetector(object):
+    """ First line detector on the flow and port counters of the switches.
+    Flags, once per episode:
+        silent      a flow towards a protected host that carried traffic stops
+        spike       a flow or port rate far above its baseline
+        new_talker  traffic towards a protected host from a source that is
+                    not in utils.IP, or through the catch-all flow of the
+                    undeclared ones on the switch of the protected host
+    protected maps the protected hosts to their dpid, None when unknown: a
+    flow without nw_src only catches the undeclared sources there, elsewhere
+    it carries all the routed traffic. Spikes are not learned into the
+    baselines. """
+
+    def __init__(self, protected):
+        self.protected = set(IPAddr(IP[host]) for host in protected)
+        self.protected_switches = dict((IPAddr(IP[host]), dpid) for host, dpid in protected.items())
+        self.known = set(IP.values())
+        self.flows = {}                 # (dpid, flow_key) -> RateBaseline
+        self.ports = {}                 # (dpid, port_no) -> RateBaseline
+        self.talkers = set()            # flow identities already flagged
+        self.anomalies = Counter()
+
+    def poll(self, connections):
+        for connection in connections:
+            connection.send(of.ofp_stats_request(body=of.ofp_flow_stats_request()))
+            connection.send(of.ofp_stats_request(body=of.ofp_port_stats_request()))
+
+    def flow_stats(self, dpid, stats, now):
+        seen = set()
+        for flow in stats:
+            key = (dpid, flow_key(flow.match, flow.priority))
+            seen.add(key)
+            baseline = self.flows.get(key)
+            if baseline is None:
+                baseline = self.flows[key] = RateBaseline()
+            baseline.expires = flow.hard_timeout != 0
+            rates = baseline.update((flow.packet_count, flow.byte_count), now)
+            if rates is None:
+                continue
+
+            towards_protected = flow.match.nw_dst in self.protected
+            if flow.match.nw_src is None:
+                undeclared = self.protected_switches.get(flow.match.nw_dst) == dpid
+            else:
+                undeclared = str(flow.match.nw_src) not in self.known
+            if towards_protected and rates[0] > 0 and undeclared and key not in self.talkers:
+                self.talkers.add(key)
+                self.flag('new_talker', dpid, "%s -> %s" % (flow.match.nw_src or 'undeclared', flow.match.nw_dst))
+
+            if towards_protected and rates[0] == 0:
+                self.check_silent(key, baseline)
+                continue
+            baseline.silent = False
+
+            if baseline.spike(rates):
+                self.flag('spike', dpid, "flow %s -> %s at %.1f pkt/s, baseline %.1f" % (
+                    flow.match.nw_src, flow.match.nw_dst, rates[0], baseline.mean[0]))
+            else:
+                baseline.learn(rates)
+
+        # Permanent flows gone from the table were deleted, silent as well
+        for key in [key for key in self.flows if key[0] == dpid and key not in seen]:
+            if key[1][3] in [str(host) for host in self.protected] and not self.flows[key].expires:
+                self.check_silent(key, self.flows[key])
+            del self.flows[key]
+
+    def check_silent(self, key, baseline):
+        if baseline.active() and not baseline.silent:
+            baseline.silent = True
+            self.flag('silent', key[0], "%s -> %s stopped, baseline %.1f pkt/s" % (
+                key[1][2], key[1][3], baseline.mean[0]))
+
+    def port_stats(self, dpid, stats, now):
+        for port in stats:
+            key = (dpid, port.port_no)
+            baseline = self.ports.get(key)
+            if baseline is None:
+                baseline = self.ports[key] = RateBaseline()
+            rates = baseline.update((port.rx_packets + port.tx_packets, port.rx_bytes + port.tx_bytes), now)
+            if rates is None:
+                continue
+            if baseline.spike(rates):
+                self.flag('spike', dpid, "port %d at %.1f pkt/s, baseline %.1f" % (
+                    port.port_no, rates[0], baseline.mean[0]))
+            else:
+                baseline.learn(rates)
+
+    def flag(self, kind, dpid, description):
+        self.anomalies[kind] += 1
+        log.warning("Anomaly %s on %s: %s" % (kind, dpid_to_str(dpid), description))
+        print "Anomaly %s on %s: %s" % (kind, dpid_to_str(dpid), description)
+
+
+class MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Serves the metrics of server.controller in the Prometheus text format """
+
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.controller.metrics()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(controller, port=METRICS_PORT):
+    """ Starts the metrics endpoint on localhost in a daemon thread """
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', port), MetricsHandler)
+    server.controller = controller
+    thread = Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    return server
+
+
+def histogram_lines(name, window, labels=''):
+    """ Prometheus histogram of a LatencyWindow, plus its window quantiles """
+    lines = []
+    cumulative = 0
+    for bound, count in zip(CONTROL_TIME_BUCKETS + ('+Inf',), window.buckets):
+        cumulative += count
+        lines.append('%s_bucket{%sle="%s"} %d' % (name, labels, bound, cumulative))
+    total_labels = '{%s}' % labels.rstrip(',') if labels else ''
+    lines.append('%s_sum%s %f' % (name, total_labels, window.sum))
+    lines.append('%s_count%s %d' % (name, total_labels, window.count))
+    ordered = sorted(window.samples)
+    for quantile in (0.5, 0.95, 0.99):
+        value = percentile(ordered, quantile)
+        if value is not None:
+            lines.append('%s_window{%squantile="%s"} %f' % (name, labels, quantile, value))
+    return lines
 
-    def run(self):
-        self.report_object.received_message(self.received)
 
 class DynamicController(object):
 
-    def __init__(self):
+    def __init__(self, reroute='targeted', proactive=True, detect=False,
+                 quarantine_timeouts=QUARANTINE_TIMEOUTS, honeypot=None):
 
         #self.connection = connection
 	self.connections = []
         self.transparent = False
-
-        # Our table
+        self.reroute = reroute
+        # Host attachments of the topology, without them every flow is learned
+        self.switch_ports = getattr(utils, 'SWITCH_PORTS', None) if proactive else None
+        self.detector = StatsDetector(dict(
+            (plc, getattr(utils, 'SWITCH_PORTS', {}).get(plc, (None,))[0])
+            for sensor, backup, plc in PROTECTED_PATHS)) if detect else None
+        # Quarantined sources, {IPAddr: host name}, their (idle, hard)
+        # timeouts and the host of SWITCH_PORTS their IP traffic is sent to
+        self.quarantined = {}
+        self.quarantine_timeouts = quarantine_timeouts
+        self.honeypot = honeypot
+
+        # Flows installed by the controller, {dpid: {flow_key: ofp_flow_mod}}
+        self.installed = {}
+        # Sensors with pre-staged failover flows, {dpid: set of sensor names}
+        self.staged = {}
+        # Barriers sent by the flow switches and not confirmed yet, {xid:
+        # (dpid, start of the reconfiguration)}
+        self.pending_barriers = {}
+        self.barrier_lock = Lock()
+        # Alert to applied latencies, of the whole reconfiguration and per switch
+        self.control_times = LatencyWindow()
+        self.switch_control_times = {}
+
+        # Our tables, {dpid: {mac: port}}
         self.macToPort = {}
+        # PacketIns and the messages they caused since the start, {dpid:
+        # Counter}. Only the event loop writes them and their keys exist from
+        # the start, so the metrics endpoint reads them without locking
+        self.counters = {}
+        # Counters at the last print and PacketIns/s since, {dpid: ...}
+        self.printed_counters = {}
+        self.packet_in_rates = {}
+        self.printed_time = time.time()
 
         # We just use this to know when to log a helpful message
         self.hold_down_expired = 0
@@ -102,46 +470,285 @@ class DynamicController(object):
 
     def add_connection_object(self, connection):
 	self.connections.append(connection)
+        self.installed[connection.dpid] = {}
 	connection.addListeners(self)
+        self.install_static(connection)
+
+    def install_static(self, connection):
+        """ Installs the flows the controller keeps on a switch whatever it
+        learns: the staged failover, the proactive and the quarantine ones """
+        self.stage_failover(connection)
+        if self.switch_ports:
+            self.install_proactive(connection)
+        for host in self.quarantined.values():
+            self.quarantine(connection, host)
+
+    def install_proactive(self, connection):
+        """ Installs permanent flows towards every host of SWITCH_PORTS: to
+        its port on its own switch, to the router on the others. ARP is
+        flooded, the switches only join the hosts of one subnet and the
+        router. Packets of unknown hosts still reach _handle_PacketIn """
+        for host, (dpid, port) in self.switch_ports.items():
+            if host not in IP:
+                continue
+            msg = of.ofp_flow_mod()
+            msg.match = of.ofp_match(dl_type=0x800, nw_dst=IPAddr(IP[host]))
+            msg.priority = PROACTIVE_PRIORITY
+            out_port = port if dpid == connection.dpid else ROUTER_PORT
+            msg.actions.append(of.ofp_action_output(port=out_port))
+            self.install(connection, msg)
+
+        # One flow per source towards the protected PLCs on their switch,
+        # their counters tell the talkers apart
+        for plc in set(plc for sensor, backup, plc in PROTECTED_PATHS):
+            if plc not in IP or self.switch_ports.get(plc, (None,))[0] != connection.dpid:
+                continue
+            for host in self.switch_ports:
+                if host == plc or host not in IP:
+                    continue
+                msg = of.ofp_flow_mod()
+                msg.match = of.ofp_match(dl_type=0x800, nw_src=IPAddr(IP[host]), nw_dst=IPAddr(IP[plc]))
+                if flow_key(msg.match, STANDBY_PROACTIVE_PRIORITY) in self.installed.get(connection.dpid, {}):
+                    # A backup source, forwarded by its staged failover flow
+                    continue
+                msg.priority = PROACTIVE_PRIORITY + 1
+                msg.actions.append(of.ofp_action_output(port=self.switch_ports[plc][1]))
+                self.install(connection, msg)
+
+        msg = of.ofp_flow_mod()
+        msg.match = of.ofp_match(dl_type=0x806)
+        msg.priority = PROACTIVE_PRIORITY
+        msg.actions.append(of.ofp_action_output(port=of.OFPP_FLOOD))
+        self.install(connection, msg)
+        log.debug("Installed proactive flows on %s" % dpid_to_str(connection.dpid))
+
+    def stage_failover(self, connection):
+        """ Pre-installs the forwarding of every backup source to its PLC, so
+        a switchover only has to drop the sensor. It goes below the learned
+        flows, or above the proactive ones when they are installed, as they
+        would shadow it. Call it before install_proactive """
+        staged = self.staged.setdefault(connection.dpid, set())
+        for sensor, backup, plc in PROTECTED_PATHS:
+            if sensor not in IP or backup not in IP:
+                continue
+            out_port = self.port_towards(connection.dpid, plc)
+            if out_port is None:
+                continue
+            msg = of.ofp_flow_mod()
+            msg.match = of.ofp_match(dl_type=0x800, nw_src=IPAddr(IP[backup]), nw_dst=IPAddr(IP[plc]))
+            msg.priority = STANDBY_PROACTIVE_PRIORITY if self.switch_ports else STANDBY_PRIORITY
+            msg.actions.append(of.ofp_action_output(port=out_port))
+            self.install(connection, msg)
+            staged.add(sensor)
+
+    def port_towards(self, dpid, host):
+        """ Output port towards host on switch dpid: its port on its own
+        switch and the router on the others after SWITCH_PORTS, else its
+        DPCTL_PORTS port. None when neither has it """
+        attachment = getattr(utils, 'SWITCH_PORTS', {}).get(host)
+        if attachment is not None:
+            return attachment[1] if attachment[0] == dpid else ROUTER_PORT
+        if host in DPCTL_PORTS:
+            return int(DPCTL_PORTS[host])
+        return None
+
+    def install(self, connection, msg):
+        """ Sends a flow_mod adding a flow and remembers it until the switch
+        reports its removal. Only flows with a timeout ask for that report,
+        the permanent ones only go away when the controller deletes them """
+        if msg.idle_timeout or msg.hard_timeout:
+            msg.flags |= of.OFPFF_SEND_FLOW_REM
+        connection.send(msg)
+        self.installed.setdefault(connection.dpid, {})[flow_key(msg.match, msg.priority)] = msg
+
+    def installed_flows(self, dpid, nw_src, nw_dst):
+        """ Installed flows of a switch from nw_src to nw_dst """
+        return [msg for msg in self.installed.get(dpid, {}).values()
+                if msg.match.nw_src == nw_src and msg.match.nw_dst == nw_dst]
+
+    def _handle_FlowRemoved(self, event):
+        if event.ofp.reason == of.OFPRR_DELETE:
+            # The controller forgets the flows it deletes, the same key may
+            # already be installed again
+            return
+        flows = self.installed.get(event.connection.dpid, {})
+        flows.pop(flow_key(event.ofp.match, event.ofp.priority), None)
+        if event.ofp.priority == QUARANTINE_PRIORITY:
+            # The source is released when the last of its quarantine flows,
+            # two per switch, timed out
+            nw_src = event.ofp.match.nw_src
+            if self.quarantine_switches(nw_src):
+                return
+            host = self.quarantined.pop(nw_src, None)
+            if host is not None:
+                log.info("Quarantine of %s expired" % host)
+
+    def quarantine_switches(self, nw_src):
+        """ Switches where a quarantine flow of nw_src is still installed """
+        return [dpid for dpid, flows in self.installed.items()
+                if any(key[2] == str(nw_src) and key[4] == QUARANTINE_PRIORITY for key in flows)]
+
+    def send_barrier(self, connection, started):
+        """ Barrier after the flow_mods of a switch for the reconfiguration
+        started at time started, its control time is taken when every switch
+        has confirmed its barrier """
+        barrier = of.ofp_barrier_request()
+        with self.barrier_lock:
+            self.pending_barriers[barrier.xid] = (connection.dpid, started)
+        connection.send(barrier)
+
+    def remove_connection(self, connection):
+        """ Forgets a switch that disconnected, with its pending barriers
+        which will never be confirmed """
+        if connection in self.connections:
+            self.connections.remove(connection)
+        with self.barrier_lock:
+            for xid in [xid for xid, (dpid, started) in self.pending_barriers.items() if dpid == connection.dpid]:
+                del self.pending_barriers[xid]
+
+    def _handle_BarrierIn(self, event):
+        applied = time.time()
+        with self.barrier_lock:
+            pending = self.pending_barriers.pop(event.xid, None)
+            if pending is None:
+                return
+            dpid, started = pending
+            self.switch_control_times.setdefault(dpid, LatencyWindow()).add(applied - started)
+            if any(other == started for _, other in self.pending_barriers.values()):
+                return
+
+            self.start_control_time = started
+            self.stop_control_time = applied
+            self.control_time = self.stop_control_time - self.start_control_time
+            self.control_times.add(self.control_time)
+            self.write_control_times()
+        print "Control Time: ", self.control_time
+
+    def write_control_times(self, path=CONTROL_TIME_PATH):
+        """ Writes the latency summaries as JSON, replacing the file at once
+        so readers never see it half written """
+        report = {
+            'time': time.time(),
+            'control_time': self.control_times.summary(),
+            'switches': dict((dpid_to_str(dpid), window.summary())
+                             for dpid, window in self.switch_control_times.items()),
+        }
+        with open(path + '.tmp', 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        os.rename(path + '.tmp', path)
 
     def close_connection(self):
         self.controller_socket.close_connection()
 
-    def received_message(self, message):
-        """ Handles the message received"""
+    def received_message(self, message, received=None):
+        """ Handles the message received at time received, on the POX thread
+        (see Dispatcher) """
         print "DEBUG: in recieved_message"
-	self.start_control_time = time.time()
-        message_dict = eval(json.loads(message))
-        print "Message received: " + str(message_dict)
-        if message_dict['Type'] == "Command":
-            self.process_command(message_dict)
+        message = codec.decode(message)
+        print "Message received: " + str(message)
+        if message.type == codec.COMMAND:
+            self.process_command(message, received or time.time())
 
-    def process_command(self, message):    
+    def process_command(self, message, started):
 
         # Switch to simulator
-        if message['Variable'] == 'Switch_flow':
+        if message.value == 'Switch_flow':
             #self.switch_flow('lit101','ids101',10,of.OFP_FLOW_PERMANENT, True)
-            self.simple_switch_flow()
 	    self.compromised_sensor = True
+            self.quarantined[IPAddr(IP['lit101'])] = 'lit101'
+            if self.reroute == 'targeted':
+                self.targeted_switch_flow('lit101', 'ids101', started)
+            else:
+                self.simple_switch_flow(started)
 
-        if message['Variable'] == 'Switch_plc':
-            self.simple_switch_flow()
+        if message.value == 'Switch_plc':
+            self.simple_switch_flow(started)
 	    #self.compromised_plc = True
 		
 
-    def simple_switch_flow(self):
+    def simple_switch_flow(self, started=None):
         # Simple switch just deletes all flow entries, triggering packet_in events.
         # In packet in, we simply don't create an entry for the attacker
         # Yes, this could be done in a thousand better ways :D
+        # The staged, proactive and quarantine flows are installed again
+        # before the barrier
+        started = started or time.time()
         self.attack_detected = True       
         msg = of.ofp_flow_mod(command=of.OFPFC_DELETE)
         msg.priority = 65535
         for connection in self.connections:
 	    connection.send(msg)                
+            self.installed[connection.dpid] = {}
+            self.staged[connection.dpid] = set()
+            self.install_static(connection)
+            self.send_barrier(connection, started)
+
+    def quarantine(self, connection, host):
+        """ Discards everything host sends on the switch, in the datapath. With
+        a honeypot, its IP traffic goes to the honeypot port instead on the
+        switch of the honeypot """
+        nw_src = IPAddr(IP[host])
+        self.quarantined[nw_src] = host
+        idle_timeout, hard_timeout = self.quarantine_timeouts
+        honeypot = getattr(utils, 'SWITCH_PORTS', {}).get(self.honeypot)
+
+        for dl_type in (0x800, 0x806):
+            msg = of.ofp_flow_mod()
+            msg.match = of.ofp_match(dl_type=dl_type, nw_src=nw_src)
+            msg.priority = QUARANTINE_PRIORITY
+            msg.idle_timeout = idle_timeout
+            msg.hard_timeout = hard_timeout
+            if dl_type == 0x800 and honeypot and honeypot[0] == connection.dpid:
+                msg.actions.append(of.ofp_action_output(port=honeypot[1]))
+            self.install(connection, msg)
+        log.debug("Quarantined %s on %s" % (host, dpid_to_str(connection.dpid)))
+
+    def targeted_switch_flow(self, old_host, new_host, started=None):
+        """ Reroutes only the flows from old_host to plc101. Switches with
+        pre-staged failover flows just get the drop of old_host, above the
+        learned flows. On the others that carried old_host, its flows are
+        deleted and the drop and the forwarding of new_host to plc101
+        installed in the same batch. The drop is the quarantine of old_host.
+        started is the time the command was received """
+        started = started or time.time()
+        self.attack_detected = True
+        nw_src = IPAddr(IP[old_host])
+        nw_dst = IPAddr(IP['plc101'])
+
+        unstaged = []
+        for connection in self.connections:
+            if old_host in self.staged.get(connection.dpid, ()):
+                self.quarantine(connection, old_host)
+                self.send_barrier(connection, started)
+                log.debug("Switched over %s on %s" % (old_host, dpid_to_str(connection.dpid)))
+            else:
+                unstaged.append((connection, self.installed_flows(connection.dpid, nw_src, nw_dst)))
+
+        batches = [(connection, flows) for connection, flows in unstaged if flows]
+        if not batches and len(unstaged) == len(self.connections):
+            # Nothing staged nor learned for old_host, reroute on every switch
+            batches = unstaged
 
-	self.stop_control_time = time.time()
-	self.control_time = self.stop_control_time - self.start_control_time
-	print "Control Time: ", self.control_time
+        for connection, flows in batches:
+            # Output port of plc101 on this switch, as learned for old_host
+            out_port = self.port_towards(connection.dpid, 'plc101')
+            for flow in flows:
+                msg = of.ofp_flow_mod(command=of.OFPFC_DELETE_STRICT, match=flow.match, priority=flow.priority)
+                connection.send(msg)
+                self.installed[connection.dpid].pop(flow_key(flow.match, flow.priority), None)
+                if flow.actions:
+                    out_port = flow.actions[0].port
+
+            self.quarantine(connection, old_host)
+
+            msg = of.ofp_flow_mod()
+            msg.match = of.ofp_match(dl_type=0x800, nw_src=IPAddr(IP[new_host]), nw_dst=nw_dst)
+            msg.priority = REROUTE_PRIORITY
+            msg.actions.append(of.ofp_action_output(port=out_port))
+            self.install(connection, msg)
+
+            self.send_barrier(connection, started)
+            log.debug("Rerouted %d flows of %s on %s" % (len(flows), old_host, dpid_to_str(connection.dpid)))
 
 
     def switch_flow(self, old_host, new_host, idle_timeout, hard_timeout, drop):
@@ -175,30 +782,29 @@ class DynamicController(object):
 
         """
         packet = event.parsed
+        connection = event.connection
+        counters = self.counters.get(event.dpid)
+        if counters is None:
+            counters = self.counters[event.dpid] = Counter(dict.fromkeys(SWITCH_COUNTERS, 0))
+        counters['packet_in'] += 1
         log.debug("Incoming packet from port: %i", event.port)
-        #print "From connection: ", str(event.dpid)
 
         in_port = event.port
-	if (self.attack_detected):
-
-                a_msg = of.ofp_flow_mod()
-                a_msg.match = of.ofp_match.from_packet(packet, event.port)
-		nw_src = a_msg.match.nw_src
-		print "Nw src: ", nw_src
-
-	        if (in_port == 4) and (nw_src == "192.168.1.10") and (self.compromised_sensor):
-			log.debug("Dropping packets from malicious sensor!")
-		        return
-
-	        #if (in_port == 4) and (nw_src == "192.168.3.30") and (self.compromised_plc):
-                #log.debug("Dropping packets from malicious PLC!")
-                #return
-
+        if self.quarantined:
+            # Sent before the quarantine reached this switch, or the switch
+            # lost it: install it once, the next packets stay in the datapath
+            nw_src = of.ofp_match.from_packet(packet, event.port).nw_src
+            host = self.quarantined.get(nw_src)
+            if host is not None:
+                if flow_key(of.ofp_match(dl_type=0x800, nw_src=nw_src), QUARANTINE_PRIORITY) \
+                        not in self.installed.get(event.dpid, {}):
+                    self.quarantine(connection, host)
+                counters['drop'] += 1
+                return
 
         def flood(message=None):
             """
-            create a packet_out with flood rule
-            waiting _flood_delay sec before sending the instruction to the switch
+            create a packet_out with flood rule on the switch of the packet
 
             :message: optional log.debug message
 
@@ -210,12 +816,13 @@ class DynamicController(object):
             msg.data = event.ofp
             msg.in_port = event.port
             log.debug(message)
-	    for connection in self.connections:
-            	connection.send(msg)
-
+            connection.send(msg)
+            counters['flood'] += 1
 
         def drop(duration=None):
-            """TODO: Docstring for drop.
+            """
+            drops the packet, with duration (idle_timeout, hard_timeout) also
+            installs a flow dropping the following ones
 
             """
             if duration is not None:
@@ -228,20 +835,19 @@ class DynamicController(object):
                 msg.buffer_id = event.ofp.buffer_id
                 msg.in_port = event.port
                 log.debug("Warning dropping!")
-		for connection in self.connections:
-            		connection.send(msg)
-                #self.connection.send(msg)
+                connection.send(msg)
+                counters['flow_mod'] += 1
             elif event.ofp.buffer_id is not None:
                 msg = of.ofp_packet_out()
                 msg.buffer_id = event.ofp.buffer_id
                 msg.in_port = event.port
                 log.debug("Warning dropping!")
-		for connection in self.connections:
-            		connection.send(msg)
-  	        #self.connection.send(msg)
+                connection.send(msg)
+            counters['drop'] += 1
 
-
-        self.macToPort[packet.src] = event.port
+        # One table per switch, ports are only meaningful on their datapath
+        mac_to_port = self.macToPort.setdefault(event.dpid, {})
+        mac_to_port[packet.src] = event.port
 
         if not self.transparent:
             if packet.type == packet.LLDP_TYPE or packet.dst.isBridgeFiltered():
@@ -251,10 +857,10 @@ class DynamicController(object):
         if packet.dst.is_multicast:
             flood()
         else:
-            if packet.dst not in self.macToPort:
+            if packet.dst not in mac_to_port:
                 flood("Port from %s unknown -- flooding" % (packet.dst))
             else:
-                port = self.macToPort[packet.dst]
+                port = mac_to_port[packet.dst]
                 if port == event.port:
                     log.warning("Same port for packet from %s -> %s on %s.%s.  Drop."
                             % (packet.src, packet.dst, dpid_to_str(event.dpid), port))
@@ -278,29 +884,120 @@ class DynamicController(object):
                 action = of.ofp_action_output(port=port)
                 msg.actions.append(action)
                 msg.data = event.ofp
-		for connection in self.connections:
-            		connection.send(msg)
-                #self.connection.send(msg)
+                self.install(connection, msg)
+                counters['flow_mod'] += 1
+
+    def metrics(self):
+        """ Prometheus text of the controller state, read without locking """
+        lines = [
+            '# TYPE dynctl_packet_in_total counter',
+            '# TYPE dynctl_flood_total counter',
+            '# TYPE dynctl_flow_mod_total counter',
+            '# TYPE dynctl_drop_total counter',
+        ]
+        for dpid, counters in self.counters.items():
+            counters = counters.copy()
+            for name in SWITCH_COUNTERS:
+                lines.append('dynctl_%s_total{dpid="%s"} %d' % (name, dpid_to_str(dpid), counters[name]))
+        lines.append('# TYPE dynctl_packet_in_rate gauge')
+        for dpid, rate in self.packet_in_rates.items():
+            lines.append('dynctl_packet_in_rate{dpid="%s"} %f' % (dpid_to_str(dpid), rate))
+        lines.append('# TYPE dynctl_mac_table_size gauge')
+        for dpid, table in self.macToPort.items():
+            lines.append('dynctl_mac_table_size{dpid="%s"} %d' % (dpid_to_str(dpid), len(table)))
+        lines.append('# TYPE dynctl_installed_flows gauge')
+        for dpid, flows in self.installed.items():
+            lines.append('dynctl_installed_flows{dpid="%s"} %d' % (dpid_to_str(dpid), len(flows)))
+
+        stats = self.controller_socket.dispatcher.stats()
+        lines.extend([
+            '# TYPE dynctl_dispatch_queue_depth gauge',
+            'dynctl_dispatch_queue_depth %d' % stats['depth'],
+            'dynctl_dispatch_queue_depth_max %d' % stats['max_depth'],
+            '# TYPE dynctl_dispatch_total counter',
+            'dynctl_dispatch_total %d' % stats['dispatched'],
+            'dynctl_dispatch_latency_seconds_sum %f' % stats['total_latency'],
+            'dynctl_dispatch_latency_seconds_max %f' % stats['max_latency'],
+            '# TYPE dynctl_control_time_seconds histogram',
+        ])
+        lines.extend(histogram_lines('dynctl_control_time_seconds', self.control_times))
+        lines.append('# TYPE dynctl_switch_control_time_seconds histogram')
+        for dpid, window in self.switch_control_times.items():
+            lines.extend(histogram_lines('dynctl_switch_control_time_seconds', window,
+                                         'dpid="%s",' % dpid_to_str(dpid)))
+        if self.detector:
+            lines.append('# TYPE dynctl_anomalies_total counter')
+            for kind, count in self.detector.anomalies.items():
+                lines.append('dynctl_anomalies_total{kind="%s"} %d' % (kind, count))
+        return '\n'.join(lines) + '\n'
+
+    def poll_stats(self):
+        self.detector.poll(self.connections)
+
+    def _handle_FlowStatsReceived(self, event):
+        if self.detector:
+            self.detector.flow_stats(event.connection.dpid, event.stats, time.time())
+
+    def _handle_PortStatsReceived(self, event):
+        if self.detector:
+            self.detector.port_stats(event.connection.dpid, event.stats, time.time())
+
+    def print_counters(self):
+        """ Control plane load since the last call, per switch """
+        now = time.time()
+        elapsed = now - self.printed_time
+        self.printed_time = now
+        for dpid, counters in sorted(self.counters.items()):
+            counters = counters.copy()
+            delta = counters - self.printed_counters.get(dpid, Counter())
+            self.printed_counters[dpid] = counters
+            self.packet_in_rates[dpid] = delta['packet_in'] / elapsed if elapsed > 0 else 0.0
+            print "Switch %s: %d packet_in, %d flood, %d flow_mod, %d drop" % (
+                dpid_to_str(dpid), delta['packet_in'], delta['flood'], delta['flow_mod'], delta['drop'])
+
+        stats = self.controller_socket.dispatcher.stats()
+        print "Dispatch: %d messages, queue depth %d (max %d), latency avg %.6f max %.6f" % (
+            stats['dispatched'], stats['depth'], stats['max_depth'], stats['avg_latency'], stats['max_latency'])
 
 class CentralComponent(object):
 
-    def __init__(self):    
+    def __init__(self, reroute, proactive, stats_period, metrics_port, quarantine_timeouts, honeypot):    
         core.openflow.addListeners(self)
         #self.dynamic = DynamicController(event.connection)
-	self.dynamic = DynamicController()
+        self.dynamic = DynamicController(reroute, proactive, stats_period > 0, quarantine_timeouts, honeypot)
+        if metrics_port:
+            serve_metrics(self.dynamic, metrics_port)
+        Timer(COUNTERS_PERIOD, self.dynamic.print_counters, recurring=True)
+        if stats_period > 0:
+            Timer(stats_period, self.dynamic.poll_stats, recurring=True)
 
     def _handle_ConnectionUp(self, event):
         log.debug("Connection %s" % (event.connection))
 	self.dynamic.add_connection_object(event.connection)
 
     def _handle_ConnectionDown(self,event):
+        self.dynamic.remove_connection(event.connection)
         self.dynamic.close_connection()
 
-def launch ():
+def launch (reroute='targeted', proactive=True, stats_period=0, metrics_port=METRICS_PORT,
+            quarantine_idle=QUARANTINE_TIMEOUTS[0], quarantine_hard=QUARANTINE_TIMEOUTS[1], honeypot=None):
   """
   Starts an L2 learning switch.
+
+  reroute: 'targeted' moves only the flows of the compromised source when the
+  IDS reports it, 'flush' deletes every flow of every switch.
+  proactive: install permanent flows for the hosts of utils.SWITCH_PORTS at
+  ConnectionUp, learning only the others.
+  stats_period: seconds between polls of the flow and port counters of the
+  switches for the anomaly detector, 0 disables it.
+  metrics_port: port of the HTTP metrics endpoint on localhost, 0 disables it.
+  quarantine_idle, quarantine_hard: idle and hard timeouts in seconds of the
+  flows quarantining a compromised source, 0 keeps them.
+  honeypot: host of utils.SWITCH_PORTS receiving the IP traffic of the
+  quarantined sources on its switch, they are dropped elsewhere.
   """  
-  core.registerNew(CentralComponent)
+  core.registerNew(CentralComponent, reroute, str_to_bool(proactive), float(stats_period), int(metrics_port),
+                   (int(quarantine_idle), int(quarantine_hard)), honeypot)
 
 
   #core.openflow.addListenerByName("ConnectionUp", _init_datapath, priority=2, once=False)
@@ -1,4 +1,5 @@
-from minicps.devices import PLC
+from enip_session import SessionPLC
+from tag_store import StoreDevice
 from utils import *
 
 import time
@@ -7,9 +8,11 @@ import threading
 
 SENSOR_ADDR = IP['lit101']
 
+MV101 = ('MV101', 1)
 LIT101 = ('LIT101', 1)
+P101 = ('P101', 1)
 
-class Lit101(PLC):
+class Lit101(StoreDevice, SessionPLC):
 	def pre_loop(self, sleep=0.1):
 		print 'DEBUG: sensor enters pre_loop'
 		time.sleep(sleep)
@@ -36,7 +39,8 @@ class Lit101(PLC):
 			
 			print "Counter: ", count
 
-			self.send(LIT101, self.level, SENSOR_ADDR)
+			# The whole loop 1 tick in one request, Ids101 reads it back with receive_group
+			self.send_many([(MV101, self.get(MV101)), (LIT101, self.level), (P101, self.get(P101))], SENSOR_ADDR)
 			time.sleep(PLC_PERIOD_SEC)
 			count = count + 1
 
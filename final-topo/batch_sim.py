@@ -0,0 +1,138 @@
+"""
+batch_sim.py: headless closed-loop simulation of many final-topo plants at once
+
+Steps N independent instances of the plant of physical_process.RawWaterTank
+(tank 1, pH loop and tank 2) as NumPy arrays, controlled with the threshold
+logic of PLC101 (MV101 from LIT101, P101 from LIT301), PLC201 (P201 from PH201)
+and PLC301 (P301 from LIT301). Controls are refreshed from the levels of the
+previous tick every control_every ticks, from control_start on (the PLCs of a
+live run take a few ticks to come up), and hold their value between the L and
+H thresholds, as the PLCs do.
+
+Every run can start from its own levels and have a bias added to the LIT101
+reading seen by PLC101, to study sensor attacks. Traces are written one level
+per line with five decimals, like tank_1.txt, ph.txt and tank_2.txt.
+
+Run with: python batch_sim.py [runs] [ticks] [output directory]
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+from utils import *
+
+TANK_1_INFLOW = PUMP_FLOWRATE_IN * PP_PERIOD_HOURS / TANK_SECTION
+TANK_1_OUTFLOW = PUMP_FLOWRATE_OUT * PP_PERIOD_HOURS / TANK_SECTION
+TANK_2_OUTFLOW = PUMP_FLOWRATE_OUT_2 * PP_PERIOD_HOURS / TANK_SECTION
+PH_UP = PH_PUMP_FLOWRATE_IN * PH_PERIOD_HOURS
+PH_DOWN = PH_PUMP_FLOWRATE_OUT * PH_PERIOD_HOURS
+
+# Initial state of RawWaterTank.pre_loop
+INIT_LIT101 = 0.4
+INIT_PH201 = 0.7
+INIT_LIT301 = 0.4
+INIT_MV101 = 1
+INIT_P101 = 0
+INIT_P201 = 0
+INIT_P301 = 1
+
+TRACE_FILES = (
+    ('lit101', 'tank_1.txt'),
+    ('ph201', 'ph.txt'),
+    ('lit301', 'tank_2.txt'),
+)
+
+
+def threshold_control(command, level, thresholds, high_value, low_value):
+    """ Vectorized PLC rule: high_value at or above H, low_value at or below L,
+    the current command in between """
+    command = np.where(level >= thresholds['H'], high_value, command)
+    return np.where(level <= thresholds['L'], low_value, command)
+
+
+class BatchPlant(object):
+    """ N plants stepped together, one array entry per plant """
+
+    def __init__(self, runs, lit101=INIT_LIT101, ph201=INIT_PH201, lit301=INIT_LIT301,
+                 lit101_bias=0.0, control_every=1, control_start=0):
+        self.runs = runs
+        self.lit101 = np.empty(runs)
+        self.ph201 = np.empty(runs)
+        self.lit301 = np.empty(runs)
+        self.lit101[:] = lit101
+        self.ph201[:] = ph201
+        self.lit301[:] = lit301
+
+        self.lit101_bias = np.zeros(runs)
+        self.lit101_bias[:] = lit101_bias
+        self.control_every = control_every
+        self.control_start = control_start
+
+        self.mv101 = np.full(runs, INIT_MV101, dtype=np.int8)
+        self.p101 = np.full(runs, INIT_P101, dtype=np.int8)
+        self.p201 = np.full(runs, INIT_P201, dtype=np.int8)
+        self.p301 = np.full(runs, INIT_P301, dtype=np.int8)
+        self.fit201 = np.zeros(runs)
+        self.tick = 0
+
+    def control(self):
+        """ PLC101, PLC201 and PLC301 on the current levels """
+        self.mv101 = threshold_control(self.mv101, self.lit101 + self.lit101_bias, LIT_101_M, 0, 1)
+        self.p101 = threshold_control(self.p101, self.lit301, LIT_301_M, 0, 1)
+        self.p201 = threshold_control(self.p201, self.ph201, PH_201_M, 0, 1)
+        self.p301 = threshold_control(self.p301, self.lit301, LIT_301_M, 1, 0)
+
+    def step(self):
+        """ One RawWaterTank.main_loop tick for every plant """
+        if self.tick >= self.control_start and self.tick % self.control_every == 0:
+            self.control()
+
+        self.lit101 += TANK_1_INFLOW * self.mv101 - TANK_1_OUTFLOW * self.p101
+        np.maximum(self.lit101, 0.0, out=self.lit101)
+        self.fit201 = PUMP_FLOWRATE_OUT * PP_PERIOD_HOURS * self.p101
+
+        self.ph201 += np.where(self.p201 == 1, PH_UP, -PH_DOWN)
+
+        self.lit301 += TANK_1_OUTFLOW * self.p101 - TANK_2_OUTFLOW * self.p301
+        np.maximum(self.lit301, 0.0, out=self.lit301)
+        self.tick += 1
+
+    def run(self, ticks):
+        """ Returns the lit101, ph201 and lit301 traces, shaped (ticks, runs) """
+        traces = dict((name, np.empty((ticks, self.runs))) for name, filename in TRACE_FILES)
+        for tick in range(ticks):
+            self.step()
+            for name, filename in TRACE_FILES:
+                traces[name][tick] = getattr(self, name)
+        return traces
+
+
+def write_traces(traces, directory):
+    """ Writes run_<i>/tank_1.txt, ph.txt and tank_2.txt for every run """
+    runs = traces[TRACE_FILES[0][0]].shape[1]
+    for run in range(runs):
+        run_directory = os.path.join(directory, 'run_%d' % run)
+        if not os.path.isdir(run_directory):
+            os.makedirs(run_directory)
+        for name, filename in TRACE_FILES:
+            np.savetxt(os.path.join(run_directory, filename), traces[name][:, run], fmt='%.5f')
+
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    ticks = int(sys.argv[2]) if len(sys.argv) > 2 else PP_SAMPLES
+    directory = sys.argv[3] if len(sys.argv) > 3 else None
+
+    plant = BatchPlant(runs)
+    start = time.time()
+    traces = plant.run(ticks)
+    elapsed = time.time() - start
+
+    simulated = runs * ticks * PP_PERIOD_SEC
+    print "%d runs x %d ticks in %.3f s, %.0f plant-seconds per second" % (runs, ticks, elapsed, simulated / elapsed)
+
+    if directory is not None:
+        write_traces(traces, directory)
@@ -0,0 +1,57 @@
+"""
+bench_codec.py: encode/decode throughput of the binary codec against the
+former json.dumps(str(dict)) + eval(json.loads()) message format
+
+Run with: python bench_codec.py [iterations]
+"""
+
+import json
+import sys
+import timeit
+
+import codec
+
+LIT101 = ('LIT101', 1)
+MV101 = ('MV101', 1)
+
+
+def legacy_encode(msg_type, variable):
+    msg_dict = dict.fromkeys(['Type', 'Variable'])
+    msg_dict['Type'] = msg_type
+    msg_dict['Variable'] = variable
+    return json.dumps(str(msg_dict))
+
+
+def legacy_decode(data):
+    return eval(json.loads(data))
+
+
+def run(label, func, iterations):
+    elapsed = min(timeit.repeat(func, number=iterations, repeat=3))
+    print "%-28s %10.0f msg/s  %8.3f us/msg" % (label, iterations / elapsed, 1e6 * elapsed / iterations)
+    return elapsed
+
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    legacy_report = legacy_encode("Report", 0.61234)
+    legacy_command = legacy_encode("Command", "Switch_flow")
+    binary_report = codec.encode(codec.REPORT, LIT101, 0.61234)
+    binary_command = codec.encode(codec.COMMAND, None, "Switch_flow")
+
+    print "Message size: legacy %d bytes, binary %d bytes" % (len(legacy_report), len(binary_report))
+    print
+
+    results = [
+        ('encode report', lambda: legacy_encode("Report", 0.61234), lambda: codec.encode(codec.REPORT, LIT101, 0.61234)),
+        ('encode command', lambda: legacy_encode("Command", "Switch_flow"), lambda: codec.encode(codec.COMMAND, None, "Switch_flow")),
+        ('decode report', lambda: legacy_decode(legacy_report), lambda: codec.decode(binary_report)),
+        ('decode command', lambda: legacy_decode(legacy_command), lambda: codec.decode(binary_command)),
+    ]
+
+    for name, legacy, binary in results:
+        legacy_time = run('legacy ' + name, legacy, iterations)
+        binary_time = run('binary ' + name, binary, iterations)
+        print "%-28s %10.1fx" % ('speedup', legacy_time / binary_time)
+        print
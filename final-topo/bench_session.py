@@ -0,0 +1,74 @@
+"""
+bench_session.py: time per tick of reading N tags of one peer with N Read
+Tag requests against one Multiple Service Packet (SessionClient.read_tags)
+
+Starts a cpppo ENIP server holding every LOOP_*_TAGS tag on localhost, or
+uses the server given as host[:port]. Run with:
+
+    python bench_session.py [ticks] [host[:port]]
+"""
+
+import socket
+import subprocess
+import sys
+import time
+
+from enip_session import SessionClient, SessionProtocol
+from utils import LOOP_1_TAGS, LOOP_2_TAGS, LOOP_3_TAGS
+
+BENCH_PORT = 44819
+TAGS = LOOP_1_TAGS + LOOP_2_TAGS + LOOP_3_TAGS
+TAG_NAMES = ['%s:%d' % (tag[0], tag[1]) for tag in TAGS]
+
+
+def start_server(port):
+    """ Starts a cpppo server on localhost and waits until it accepts connections """
+    tags = ['%s:%d=%s' % tag for tag in TAGS]
+    server = subprocess.Popen([sys.executable, '-m', 'cpppo.server.enip',
+                               '--address', '127.0.0.1:%d' % port] + tags)
+    deadline = time.time() + 10.0
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return server
+        except socket.error:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError('cpppo server did not start')
+
+
+def per_tick(func, ticks):
+    start = time.time()
+    for i in range(ticks):
+        func()
+    return (time.time() - start) / ticks
+
+
+def run(client, count, ticks):
+    names = TAG_NAMES[:count]
+    separate = per_tick(lambda: [client.read_tag(name) for name in names], ticks)
+    batched = per_tick(lambda: client.read_tags(names), ticks)
+    print "%2d tags %10.3f ms/tick separate %10.3f ms/tick batched %6.2fx" % (
+        count, separate * 1e3, batched * 1e3, separate / batched)
+
+
+if __name__ == '__main__':
+    ticks = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    server = None
+    if len(sys.argv) > 2:
+        address = SessionProtocol._split_address(sys.argv[2])
+    else:
+        address = ('127.0.0.1', BENCH_PORT)
+        server = start_server(BENCH_PORT)
+
+    try:
+        client = SessionClient(*address)
+        print "%s:%d, %d ticks" % (address[0], address[1], ticks)
+        for count in (1, 2, 3, len(TAGS)):
+            run(client, count, ticks)
+        client.close()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
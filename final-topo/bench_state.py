@@ -0,0 +1,107 @@
+"""
+bench_state.py: reads and writes per second the state backends sustain with
+many device processes accessing them concurrently
+
+Every process reads a random tag in a loop and, every WRITE_EVERY operations,
+writes the whole tick of the physical process (four tags; one set_many on the
+backends that batch it). Run with:
+
+    python bench_state.py [processes] [seconds]
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from multiprocessing import Process, Queue
+
+from minicps.states import SQLiteState
+
+import codec
+from tag_store import ShmState, TunedSQLiteState
+from utils import NAME, SCHEMA, SCHEMA_INIT
+
+WRITE_EVERY = 5
+TAGS = [tag for tag in codec.TAGS if tag is not None]
+TICK = [('FIT201', 2), ('LIT101', 1), ('PH201', 2), ('LIT301', 3)]
+
+
+def setup(backend, directory):
+    """ Creates the store, returns the state dict and extra state arguments """
+    path = os.path.join(directory, 'bench.sqlite')
+    state = {'name': NAME, 'path': path}
+    if backend == 'sqlite-tuned':
+        TunedSQLiteState._create(path, NAME)
+        TunedSQLiteState._init(path, NAME, SCHEMA_INIT, SCHEMA)
+        return state, ()
+    SQLiteState._create(path, SCHEMA)
+    SQLiteState._init(path, SCHEMA_INIT)
+    if backend == 'shm':
+        shm_path = os.path.join(directory, 'bench.shm')
+        ShmState._create(shm_path)
+        ShmState._init(shm_path, path, NAME)
+        return state, (shm_path,)
+    return state, ()
+
+
+def open_state(backend, state, args):
+    if backend == 'sqlite-tuned':
+        return TunedSQLiteState(state)
+    elif backend == 'shm':
+        return ShmState(state, *args)
+    return SQLiteState(state)
+
+
+def worker(backend, state, args, start, deadline, results):
+    store = open_state(backend, state, args)
+    rand = random.Random(os.getpid())
+    time.sleep(max(0.0, start - time.time()))
+    reads = writes = 0
+    while time.time() < deadline:
+        for i in range(WRITE_EVERY):
+            store._get(rand.choice(TAGS))
+        reads += WRITE_EVERY
+
+        tick = [(tag, rand.random()) for tag in TICK]
+        if hasattr(store, '_set_many'):
+            store._set_many(tick)
+        else:
+            for tag, value in tick:
+                store._set(tag, value)
+        writes += len(tick)
+    results.put((reads, writes))
+
+
+def run(backend, processes, seconds):
+    directory = tempfile.mkdtemp()
+    try:
+        state, args = setup(backend, directory)
+        results = Queue()
+        # Leave the processes time to start before the measured interval
+        start = time.time() + 1.0
+        deadline = start + seconds
+        workers = [Process(target=worker, args=(backend, state, args, start, deadline, results))
+                   for i in range(processes)]
+        for process in workers:
+            process.start()
+        totals = [results.get() for process in workers]
+        for process in workers:
+            process.join()
+    finally:
+        shutil.rmtree(directory)
+
+    reads = sum(total[0] for total in totals)
+    writes = sum(total[1] for total in totals)
+    print "%-14s %10.0f reads/s %10.0f writes/s" % (backend, reads / float(seconds), writes / float(seconds))
+
+
+if __name__ == '__main__':
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+
+    print "%d processes, %.1f seconds" % (processes, seconds)
+    for backend in ('sqlite', 'sqlite-tuned', 'shm'):
+        run(backend, processes, seconds)
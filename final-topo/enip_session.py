@@ -0,0 +1,400 @@
+"""
+enip_session.py: EtherNet/IP client sessions kept open for the whole run
+
+MiniCPS' EnipProtocol spawns a cpppo client process for every send and
+receive. SessionProtocol keeps the cpppo server of the device but serves
+send/receive through one registered session per peer: RegisterSession once,
+then Read Tag/Write Tag requests in SendRRData on the same TCP socket. The
+round trip time of every request is recorded.
+
+Several tags, e.g. a whole LOOP_*_TAGS group, can be read or written in one
+round trip with a CIP Multiple Service Packet (receive_many, send_many,
+receive_group).
+
+The packets are built and parsed with struct only, so the devices do not need
+scapy or the Python 3 nids/enipcip package.
+
+Devices opt in by inheriting from SessionPLC instead of PLC.
+"""
+
+import atexit
+import socket
+import struct
+import time
+
+from threading import Lock
+
+from minicps.devices import PLC
+from minicps.protocols import EnipProtocol
+
+import codec
+
+ENIP_PORT = 44818
+
+REGISTER_SESSION = 0x65
+SEND_RR_DATA = 0x6f
+
+MULTIPLE_SERVICE = 0x0a
+UNCONNECTED_SEND = 0x52
+READ_TAG = 0x4c
+WRITE_TAG = 0x4d
+
+NULL_ADDRESS = 0x0000
+UNCONNECTED_MESSAGE = 0x00b2
+
+ENIP_HEADER = struct.Struct('<HHII8sI')     # command, length, session, status, context, options
+REGISTER_DATA = struct.Struct('<HH')        # protocol version, options
+RR_HEADER = struct.Struct('<IHH')           # interface handle, timeout, item count
+ITEM_HEADER = struct.Struct('<HH')          # type id, length
+CIP_HEADER = struct.Struct('<BB')           # service, path size in words
+CM_HEADER = struct.Struct('<BBH')           # priority/tick time, timeout ticks, message size
+CIP_REPLY = struct.Struct('<BBBB')          # service, reserved, status, additional status words
+TYPE_CODE = struct.Struct('<H')
+WRITE_HEADER = struct.Struct('<HH')         # type code, element count
+ELEMENT_COUNT = struct.Struct('<H')
+SERVICE_COUNT = struct.Struct('<H')         # Multiple Service Packet count
+
+READ_ONE = ELEMENT_COUNT.pack(1)
+EMBEDDED_SERVICE_ERROR = 0x1e
+
+# CIP elementary data types
+CIP_TYPES = {
+    0xc1: struct.Struct('<B'),              # BOOL
+    0xc2: struct.Struct('<b'),              # SINT
+    0xc3: struct.Struct('<h'),              # INT
+    0xc4: struct.Struct('<i'),              # DINT
+    0xca: struct.Struct('<f'),              # REAL
+}
+CIP_REAL = 0xca
+CIP_INT = 0xc3
+
+SYMBOLIC_SEGMENT = 0x91
+CONNECTION_MANAGER = b'\x20\x06\x25\x00\x01\x00'    # class 6, instance 1
+MESSAGE_ROUTER = b'\x20\x02\x24\x01'                # class 2, instance 1
+ROUTE_PATH = b'\x01\x00\x01\x00'                    # one word, reserved, port 1, link 0
+
+
+class SessionError(Exception):
+    """ Raised when a session request cannot be completed """
+    pass
+
+
+def encapsulation(command, session, data):
+    """ Returns an encapsulation message, header included """
+    return ENIP_HEADER.pack(command, len(data), session, 0, b'\0' * 8, 0) + data
+
+
+def cip_request(service, path, data=b''):
+    return CIP_HEADER.pack(service, len(path) // 2) + path + data
+
+
+def symbolic_path(tag_name):
+    """ Returns the ANSI extended symbolic segment of tag_name, padded to a word """
+    path = struct.pack('BB', SYMBOLIC_SEGMENT, len(tag_name)) + tag_name
+    if len(path) & 1:
+        path += b'\0'
+    return path
+
+
+def unconnected_send(message):
+    """ Wraps a CIP request into an Unconnected Send to the Connection Manager """
+    padding = b'\0' if len(message) & 1 else b''
+    data = CM_HEADER.pack(0x05, 157, len(message)) + message + padding + ROUTE_PATH
+    return cip_request(UNCONNECTED_SEND, CONNECTION_MANAGER, data)
+
+
+def multiple_service(messages):
+    """ Packs CIP requests into one Multiple Service Packet to the Message Router """
+    offset = SERVICE_COUNT.size * (len(messages) + 1)
+    offsets = []
+    for message in messages:
+        offsets.append(offset)
+        offset += len(message)
+    header = struct.pack('<%dH' % (len(messages) + 1), len(messages), *offsets)
+    return cip_request(MULTIPLE_SERVICE, MESSAGE_ROUTER, header + b''.join(messages))
+
+
+def send_rr_data(session, cip):
+    """ Returns a SendRRData message carrying cip as an unconnected message """
+    data = RR_HEADER.pack(0, 0, 2) + ITEM_HEADER.pack(NULL_ADDRESS, 0) + \
+        ITEM_HEADER.pack(UNCONNECTED_MESSAGE, len(cip)) + cip
+    return encapsulation(SEND_RR_DATA, session, data)
+
+
+class SessionClient(object):
+    """ Keeps a registered session with a peer and reads/writes tags by name """
+
+    def __init__(self, plc_addr, plc_port=ENIP_PORT):
+        try:
+            self.sock = socket.create_connection((plc_addr, plc_port))
+        except socket.error as error:
+            raise SessionError('cannot connect to %s:%d: %s' % (plc_addr, plc_port, error))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.lock = Lock()
+
+        self.requests = 0
+        self.last_rtt = 0.0
+        self.min_rtt = None
+        self.max_rtt = 0.0
+        self.total_rtt = 0.0
+
+        self.session_id = 0
+        try:
+            self.sock.sendall(encapsulation(REGISTER_SESSION, 0, REGISTER_DATA.pack(1, 0)))
+            self.session_id = ENIP_HEADER.unpack_from(self.recv_encapsulation())[2]
+        except (socket.error, SessionError) as error:
+            self.close()
+            raise SessionError('cannot register a session with %s:%d: %s' % (plc_addr, plc_port, error))
+
+    def recv_exact(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise socket.error('connection closed by peer')
+            data += chunk
+        return data
+
+    def recv_encapsulation(self):
+        """ Reads exactly one encapsulation message, header included """
+        header = self.recv_exact(ENIP_HEADER.size)
+        command, length, session, status = ENIP_HEADER.unpack(header)[:4]
+        data = self.recv_exact(length)
+        if status != 0:
+            raise SessionError('encapsulation status 0x%x for command 0x%02x' % (status, command))
+        return header + data
+
+    def recv_cip_reply(self):
+        """ Returns (status, data) of the CIP reply carried by a SendRRData """
+        data = self.recv_encapsulation()
+        offset = ENIP_HEADER.size + RR_HEADER.size
+        count = RR_HEADER.unpack_from(data, ENIP_HEADER.size)[2]
+        for item in range(count):
+            type_id, length = ITEM_HEADER.unpack_from(data, offset)
+            offset += ITEM_HEADER.size
+            if type_id == UNCONNECTED_MESSAGE:
+                service, reserved, status, extra = CIP_REPLY.unpack_from(data, offset)
+                start = offset + CIP_REPLY.size + 2 * extra
+                return status, data[start:offset + length]
+            offset += length
+        raise SessionError('no CIP reply in SendRRData')
+
+    def round_trip(self, cip):
+        """ Sends cip in a SendRRData and returns (status, data) of the reply.
+        The lock keeps the requests of several threads from interleaving. """
+        with self.lock:
+            start = time.time()
+            self.sock.sendall(send_rr_data(self.session_id, cip))
+            status, reply = self.recv_cip_reply()
+            self.account(time.time() - start)
+        return status, reply
+
+    @staticmethod
+    def tag_request(service, tag_name, data):
+        return cip_request(service, symbolic_path(tag_name), data)
+
+    @staticmethod
+    def write_data(type_code, value):
+        return WRITE_HEADER.pack(type_code, 1) + CIP_TYPES[type_code].pack(value)
+
+    @staticmethod
+    def read_value(tag_name, reply):
+        type_code = TYPE_CODE.unpack_from(reply)[0]
+        if type_code not in CIP_TYPES:
+            raise SessionError('unknown CIP type 0x%02x for %s' % (type_code, tag_name))
+        return CIP_TYPES[type_code].unpack_from(reply, TYPE_CODE.size)[0]
+
+    def request(self, service, tag_name, data):
+        status, reply = self.round_trip(unconnected_send(self.tag_request(service, tag_name, data)))
+        if status != 0:
+            raise SessionError('CIP status 0x%02x for %s' % (status, tag_name))
+        return reply
+
+    def request_many(self, requests):
+        """ Sends (service, tag_name, data) requests in one Multiple Service
+        Packet and returns the data of every reply, in order """
+        status, reply = self.round_trip(multiple_service([self.tag_request(*request) for request in requests]))
+        if status not in (0, EMBEDDED_SERVICE_ERROR):
+            raise SessionError('CIP status 0x%02x for Multiple Service Packet' % status)
+
+        count = SERVICE_COUNT.unpack_from(reply)[0]
+        if count != len(requests):
+            raise SessionError('%d replies for %d requests' % (count, len(requests)))
+        offsets = struct.unpack_from('<%dH' % count, reply, SERVICE_COUNT.size)
+        ends = offsets[1:] + (len(reply),)
+        results = []
+        for request, begin, end in zip(requests, offsets, ends):
+            service, reserved, status, extra = CIP_REPLY.unpack_from(reply, begin)
+            if status != 0:
+                raise SessionError('CIP status 0x%02x for %s' % (status, request[1]))
+            results.append(reply[begin + CIP_REPLY.size + 2 * extra:end])
+        return results
+
+    def read_tag(self, tag_name):
+        return self.read_value(tag_name, self.request(READ_TAG, tag_name, READ_ONE))
+
+    def write_tag(self, tag_name, type_code, value):
+        self.request(WRITE_TAG, tag_name, self.write_data(type_code, value))
+
+    def read_tags(self, tag_names):
+        """ Reads every tag in a single round trip """
+        replies = self.request_many([(READ_TAG, tag_name, READ_ONE) for tag_name in tag_names])
+        return [self.read_value(tag_name, reply) for tag_name, reply in zip(tag_names, replies)]
+
+    def write_tags(self, writes):
+        """ Writes every (tag_name, type_code, value) in a single round trip """
+        self.request_many([(WRITE_TAG, tag_name, self.write_data(type_code, value))
+                           for tag_name, type_code, value in writes])
+
+    def account(self, rtt):
+        self.requests += 1
+        self.last_rtt = rtt
+        self.total_rtt += rtt
+        if self.min_rtt is None or rtt < self.min_rtt:
+            self.min_rtt = rtt
+        if rtt > self.max_rtt:
+            self.max_rtt = rtt
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'last_rtt': self.last_rtt,
+            'min_rtt': self.min_rtt or 0.0,
+            'max_rtt': self.max_rtt,
+            'avg_rtt': self.total_rtt / self.requests if self.requests else 0.0,
+        }
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except socket.error:
+                pass
+        self.sock = None
+
+
+class SessionProtocol(EnipProtocol):
+    """ EnipProtocol whose client side reuses one session per peer """
+
+    def __init__(self, protocol):
+        EnipProtocol.__init__(self, protocol)
+        self._clients = {}
+        self._clients_lock = Lock()
+        self._reconnects = {}
+        atexit.register(self.print_stats)
+
+    @staticmethod
+    def _split_address(address):
+        if ':' in address:
+            ipaddr, port = address.split(':')
+            return ipaddr, int(port)
+        return address, ENIP_PORT
+
+    def _client(self, address):
+        key = self._split_address(address)
+        with self._clients_lock:
+            client = self._clients.get(key)
+            if client is None or client.sock is None:
+                client = SessionClient(*key)
+                self._clients[key] = client
+                self._reconnects[key] = self._reconnects.get(key, -1) + 1
+            return client
+
+    def _drop(self, address):
+        key = self._split_address(address)
+        with self._clients_lock:
+            client = self._clients.pop(key, None)
+        if client is not None:
+            client.close()
+
+    @staticmethod
+    def _type_code(what, value):
+        kind = codec.TAG_KINDS[codec.TAG_IDS[what[:2]]] if what[:2] in codec.TAG_IDS else None
+        if kind == codec.REAL or (kind is None and isinstance(value, float)):
+            return CIP_REAL
+        return CIP_INT
+
+    @classmethod
+    def _typed_write(cls, what, value):
+        type_code = cls._type_code(what, value)
+        if type_code == CIP_INT:
+            value = int(value)
+        return EnipProtocol._tuple_to_cpppo_tag(what), type_code, value
+
+    def _send(self, what, value, address='localhost:44818', **kwargs):
+        """ Writes a tag of another host through its session """
+        try:
+            self._client(address).write_tag(*self._typed_write(what, value))
+        except (socket.error, SessionError) as error:
+            print 'ERROR enip _send: ', error
+            self._drop(address)
+
+    def _receive(self, what, address='localhost:44818', **kwargs):
+        """ Reads a tag of another host through its session. There is no
+        value to return on an error, so the session is dropped and a
+        SessionError is raised to the caller. """
+        tag_name = EnipProtocol._tuple_to_cpppo_tag(what)
+        try:
+            return self._client(address).read_tag(tag_name)
+        except (socket.error, SessionError) as error:
+            print 'ERROR enip _receive: ', error
+            self._drop(address)
+            raise SessionError('cannot read %s from %s: %s' % (tag_name, address, error))
+
+    def _send_many(self, writes, address='localhost:44818', **kwargs):
+        """ Writes every (what, value) of writes in one request """
+        try:
+            self._client(address).write_tags([self._typed_write(what, value) for what, value in writes])
+        except (socket.error, SessionError) as error:
+            print 'ERROR enip _send_many: ', error
+            self._drop(address)
+
+    def _receive_many(self, whats, address='localhost:44818', **kwargs):
+        """ Reads every tag of whats in one request, returns the values in
+        order. Raises SessionError like _receive. """
+        tag_names = [EnipProtocol._tuple_to_cpppo_tag(what) for what in whats]
+        try:
+            return self._client(address).read_tags(tag_names)
+        except (socket.error, SessionError) as error:
+            print 'ERROR enip _receive_many: ', error
+            self._drop(address)
+            raise SessionError('cannot read %s from %s: %s' % (', '.join(tag_names), address, error))
+
+    def stats(self):
+        with self._clients_lock:
+            clients = self._clients.items()
+        stats = {}
+        for key, client in clients:
+            stats['%s:%d' % key] = client.stats()
+            stats['%s:%d' % key]['reconnects'] = self._reconnects.get(key, 0)
+        return stats
+
+    def print_stats(self):
+        for peer, counters in sorted(self.stats().items()):
+            print "Session %s requests %d reconnects %d rtt avg %.6f min %.6f max %.6f" % (
+                peer, counters['requests'], counters['reconnects'],
+                counters['avg_rtt'], counters['min_rtt'], counters['max_rtt'])
+
+
+class SessionPLC(PLC):
+    """ PLC using SessionProtocol for its enip client side """
+
+    def _init_protocol(self):
+        if self.protocol is not None and self.protocol['name'] == 'enip':
+            self._protocol = SessionProtocol(self.protocol)
+        else:
+            PLC._init_protocol(self)
+
+    def send_many(self, writes, address):
+        """ Writes a list of (what, value) to address in one round trip """
+        return self._protocol._send_many(writes, address)
+
+    def receive_many(self, whats, address):
+        """ Reads a list of tags from address in one round trip """
+        return self._protocol._receive_many(whats, address)
+
+    def receive_group(self, group, address):
+        """ Reads a whole LOOP_*_TAGS group from address in one round trip
+        and returns {(name, pid): value} """
+        whats = [(tag[0], tag[1]) for tag in group]
+        return dict(zip(whats, self.receive_many(whats, address)))
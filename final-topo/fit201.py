@@ -1,4 +1,5 @@
-from minicps.devices import PLC
+from enip_session import SessionPLC
+from tag_store import StoreDevice
 from utils import *
 
 import time
@@ -7,7 +8,7 @@ SENSOR_ADDR = IP['fit201']
 
 FIT201 = ('FIT201', 2)
 
-class Fit201(PLC):
+class Fit201(StoreDevice, SessionPLC):
 	def pre_loop(self, sleep=0.1):
 		print 'DEBUG: sensor enters pre_loop'
 		time.sleep(sleep)
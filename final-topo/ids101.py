@@ -1,4 +1,5 @@
-from minicps.devices import PLC
+from enip_session import SessionError, SessionPLC
+from tag_store import StoreDevice
 from utils import *
 
 from threading import Thread
@@ -6,8 +7,9 @@ from threading import Thread
 import sys
 import time
 import socket
-import json
 import select
+import channel
+import codec
 
 SENSOR_ADDR = IP['lit101']
 PLC101_ADDR = IP['plc101']
@@ -19,25 +21,12 @@ P101 = ('P101', 1)
 LIT101 = ('LIT101', 1)
 
 
-class Ids101(PLC):
+class Ids101(StoreDevice, SessionPLC):
 
 	def switch_sensor(self, controller_ip, controller_port):
 		print "Connecting to ONOS"
-	        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-	        sock.connect((controller_ip, int(controller_port)))
-	        msg_dict = dict.fromkeys(['Type', 'Variable'])
-	        msg_dict['Type'] = "Command"
-	        msg_dict['Variable'] = "Switch_flow"
-	        message = json.dumps(str(msg_dict))
-	        try:
-	            ready_to_read, ready_to_write, in_error = select.select([sock, ], [sock, ], [], 5)
-	        except socket.error, exc:
-	            print "Socket error"
-		    print exc
-	            return
-	        if(ready_to_write > 0):
-	            sock.send(message)
-	        sock.close()
+		if not channel.send_message(controller_ip, controller_port, "Switch_flow", None, codec.COMMAND):
+			print "Socket error"
 
 	def calculate_controls(self, variable):
  	    print "calculate action control"
@@ -88,17 +77,18 @@ class Ids101(PLC):
 		while(count <= PP_SAMPLES):	
 
 
-	                mv101 = int(self.get(MV101))
-   	                p101 = int(self.get(P101))
-
                 	if self.intrusion == False:
 
 			    print "No attack detected"
 		
 			    try:
-				    self.received_level = float(self.receive(LIT101, SENSOR_ADDR))
-			    except:
+                                    loop = self.receive_group(LOOP_1_TAGS, SENSOR_ADDR)
+			    except SessionError:
+                                    time.sleep(self.wait_time)
 				    continue
+                            mv101 = int(loop[MV101])
+                            p101 = int(loop[P101])
+                            self.received_level = float(loop[LIT101])
 
 			    #  x(t+1)                =        x(t)          +              u(t)            +  L (      y(t)           -     x(t)            )   
 			    self.new_estimated_level = self.estimated_level + inflow*mv101 - outflow*p101  + 1.0*(self.received_level - self.estimated_level)
@@ -119,12 +109,14 @@ class Ids101(PLC):
 			    self.estimated_level = self.new_estimated_level
 
 		        else:
+                            mv101 = int(self.get(MV101))
+                            p101 = int(self.get(P101))
 			    self.new_estimated_level = self.estimated_level + inflow*mv101 - outflow*p101
 
                             print "DEBUG estimated : %.5f" % (self.estimated_level)
                             print "DEBUG received : %.5f" % (self.received_level)
 
-			    self.send_message(IP['plc101'], 4234, self.new_estimated_level)
+			    self.send_message(IP['plc101'], 4234, self.new_estimated_level, LIT101)
 			    self.estimated_level = self.new_estimated_level
 		            #self.received_level = float(self.receive(LIT301, LIT301_ADDR))
 			    self.wait_time = PLC_PERIOD_SEC
@@ -133,23 +125,9 @@ class Ids101(PLC):
 	                count += 1		
 	                time.sleep(self.wait_time)			
 
-    	def send_message(self, ipaddr, port, message):
-	        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-	        sock.connect((ipaddr, port))
-
-	        msg_dict = dict.fromkeys(['Type', 'Variable'])
-	        msg_dict['Type'] = "Report"
-	        msg_dict['Variable'] = message
-	        message = json.dumps(str(msg_dict))
-
-	        try:
-	            ready_to_read, ready_to_write, in_error = select.select([sock, ], [sock, ], [], 5)
-	        except:
-	            print "Socket error"
-	            return
-	        if(ready_to_write > 0):
-	            sock.send(message)
-	        sock.close()
+	def send_message(self, ipaddr, port, message, tag):
+		if not channel.send_message(ipaddr, port, message, tag):
+			print "Socket error"
 
 if __name__ == '__main__':
 	ids101 = Ids101(name='ids101',state=STATE,protocol=IDS101_PROTOCOL,memory=GENERIC_DATA,disk=GENERIC_DATA)
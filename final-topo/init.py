@@ -1,6 +1,15 @@
 from minicps.states import SQLiteState
-from utils import PATH, SCHEMA, SCHEMA_INIT
+from utils import PATH, NAME, SCHEMA, SCHEMA_INIT, STATE_BACKEND, SHM_PATH
+from tag_store import ShmState, TunedSQLiteState
 
 if __name__ == "__main__":
-	SQLiteState._create(PATH, SCHEMA)
-	SQLiteState._init(PATH, SCHEMA_INIT)
+	if STATE_BACKEND == 'sqlite-tuned':
+		TunedSQLiteState._create(PATH, NAME)
+		TunedSQLiteState._init(PATH, NAME, SCHEMA_INIT, SCHEMA)
+	else:
+		SQLiteState._create(PATH, SCHEMA)
+		SQLiteState._init(PATH, SCHEMA_INIT)
+
+	if STATE_BACKEND == 'shm':
+		ShmState._create(SHM_PATH)
+		ShmState._init(SHM_PATH, PATH, NAME)
@@ -1,13 +1,16 @@
-from minicps.devices import PLC
+from enip_session import SessionPLC
+from tag_store import StoreDevice
 from utils import *
 
 import time
 
 SENSOR_ADDR = IP['lit101']
 
+MV101 = ('MV101', 1)
 LIT101 = ('LIT101', 1)
+P101 = ('P101', 1)
 
-class Lit101(PLC):
+class Lit101(StoreDevice, SessionPLC):
 	def pre_loop(self, sleep=0.1):
 		print 'DEBUG: sensor enters pre_loop'
 		time.sleep(sleep)
@@ -17,7 +20,8 @@ class Lit101(PLC):
 		count = 0
 		while count<=PLC_SAMPLES:
 			self.level = float(self.get(LIT101))
-			self.send(LIT101, self.level, SENSOR_ADDR)
+			# The whole loop 1 tick in one request, Ids101 reads it back with receive_group
+			self.send_many([(MV101, self.get(MV101)), (LIT101, self.level), (P101, self.get(P101))], SENSOR_ADDR)
 			time.sleep(PLC_PERIOD_SEC)
 
 
@@ -1,12 +1,11 @@
-from minicps.devices import PLC
+from enip_session import SessionPLC
+from tag_store import StoreDevice
 from utils import *
 
 import time
 from threading import Thread
 
-import socket
-import json
-import select
+import channel
 
 
 PLC101_ADDR = IP['plc101']
@@ -22,28 +21,16 @@ class MVSocket(Thread):
 
     def run(self):
         print "DEBUG entering socket thread run"
-        self.sock = socket.socket()     # Create a socket object    
-        self.sock.bind((IP['mv101'] ,9587 ))
-        self.sock.listen(5)
+        channel.serve(IP['mv101'], 9587, self.handle_message)
 
-        while True:
-            try:
-            	client, addr = self.sock.accept()
-		data = client.recv(4096)                                                # Get data from the client         
-            
-            	message_dict = eval(json.loads(data))
-	        mv101 = int(message_dict['Variable'])
+    def handle_message(self, message):
+        mv101 = int(message.value)
 
-	        print "received from PLC101!", mv101
-		self.plc.set(MV101, mv101)           
+        print "received from PLC101!", mv101
+        self.plc.set(MV101, mv101)
 
-            except KeyboardInterrupt:
- 	        print "\nCtrl+C was hitten, stopping server"
-                client.close()
-        	break
 
-
-class Mv101(PLC):
+class Mv101(StoreDevice, SessionPLC):
 	def pre_loop(self, sleep=0.1):
 		print 'DEBUG: mv101 enters pre_loop'
 		time.sleep(sleep)
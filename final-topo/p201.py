@@ -1,4 +1,5 @@
-from minicps.devices import PLC
+from enip_session import SessionError, SessionPLC
+from tag_store import StoreDevice
 from utils import *
 
 import time
@@ -7,7 +8,7 @@ PLC201_ADDR = IP['plc201']
 
 P201 = ('P201', 2)
 
-class PP201(PLC):
+class PP201(StoreDevice, SessionPLC):
 	def pre_loop(self, sleep=0.1):
 		print 'DEBUG: p201 enters pre_loop'
 		time.sleep(sleep)
@@ -16,7 +17,11 @@ class PP201(PLC):
 		print 'DEBUG: p201 enters main_loop'
 		count = 0
 		while count<=PLC_SAMPLES:
-			p201 = int(self.receive(P201, PLC201_ADDR))
+                        try:
+                                p201 = int(self.receive(P201, PLC201_ADDR))
+                        except SessionError:
+                                time.sleep(PLC_PERIOD_SEC)
+                                continue
 			print "DEBUG: Received p201 command %.5f" % p201
 			self.set(P201, p201)
 
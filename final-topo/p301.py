@@ -1,4 +1,5 @@
-from minicps.devices import PLC
+from enip_session import SessionError, SessionPLC
+from tag_store import StoreDevice
 from utils import *
 
 import time
@@ -7,7 +8,7 @@ PLC301_ADDR = IP['plc301']
 
 P301 = ('P301', 3)
 
-class PP301(PLC):
+class PP301(StoreDevice, SessionPLC):
 	def pre_loop(self, sleep=0.1):
 		print 'DEBUG: p301 enters pre_loop'
 		time.sleep(sleep)
@@ -16,7 +17,11 @@ class PP301(PLC):
 		print 'DEBUG: p301 enters main_loop'
 		count = 0
 		while count<=PLC_SAMPLES:
-			p301 = int(self.receive(P301, PLC301_ADDR))
+                        try:
+                                p301 = int(self.receive(P301, PLC301_ADDR))
+                        except SessionError:
+                                time.sleep(PLC_PERIOD_SEC)
+                                continue
 			print "DEBUG: Received p301 command %.5f" % p301
 			self.set(P301, p301)
 
@@ -1,4 +1,5 @@
-from minicps.devices import PLC
+from enip_session import SessionPLC
+from tag_store import StoreDevice
 from utils import *
 
 import time
@@ -7,7 +8,7 @@ SENSOR_ADDR = IP['ph201']
 
 PH201 = ('PH201', 2)
 
-class Ph201(PLC):
+class Ph201(StoreDevice, SessionPLC):
 	def pre_loop(self, sleep=0.1):
 		print 'DEBUG: sensor enters pre_loop'
 		time.sleep(sleep)
@@ -1,4 +1,5 @@
 from minicps.devices import Tank
+from tag_store import StoreDevice, start_snapshots
 from utils import *
 
 import sys
@@ -15,7 +16,7 @@ P201 = ('P201', 2)
 LIT301 = ('LIT301', 3)
 P301 = ('P301', 3)
 
-class RawWaterTank(Tank):
+class RawWaterTank(StoreDevice, Tank):
 	def pre_loop(self):
 		self.set(MV101, 1)
 		self.set(P101, 0)
@@ -27,6 +28,8 @@ class RawWaterTank(Tank):
 		self.set(P301, 1)
 		self.lit301 = self.set(LIT301, 0.4)
 
+		start_snapshots(self)
+
 	def main_loop(self):
 		count = 0
 		while(count <= PP_SAMPLES):
@@ -52,13 +55,12 @@ class RawWaterTank(Tank):
 				outflow = 0
 				fit_201 = 0
 
-			self.set(FIT201, fit_201)
 			new_lit_101 = water_volume / self.section
 
 			if new_lit_101 <= 0.0:
 				new_lit_101 = 0.0
 			
-			self.lit101 = self.set(LIT101, new_lit_101)
+			self.lit101 = new_lit_101
 
 			# PH Second loop
 			p201 = float(self.get(P201))
@@ -69,7 +71,7 @@ class RawWaterTank(Tank):
 				phdown = PH_PUMP_FLOWRATE_OUT * PH_PERIOD_HOURS
 				self.ph_level -= phdown
 
-			new_ph201 = self.set(PH201, self.ph_level)
+			new_ph201 = self.ph_level
 
 			self.ph_level = new_ph201
 
@@ -98,7 +100,10 @@ class RawWaterTank(Tank):
 			print "DEBUG  Water Tank 1 Level %.5f " % new_lit_101
 			print "DEBUG  PH Level %.5f " % new_ph201
 			print "DEBUG  Water Tank 2 Level %.5f " % new_lit_301
-			self.lit301 = self.set(LIT301, new_lit_301)
+			self.lit301 = new_lit_301
+
+			# All the tags of the tick in one transaction
+			self.set_many([(FIT201, fit_201), (LIT101, new_lit_101), (PH201, new_ph201), (LIT301, new_lit_301)])
 		
 			count += 1
 			time.sleep(PP_PERIOD_SEC)
@@ -2,15 +2,14 @@
 PLC 1
 """
 
-from minicps.devices import PLC
+from enip_session import SessionPLC
+from tag_store import StoreDevice
 from utils import *
 
 import time
 from threading import Thread
 
-import socket
-import json
-import select
+import channel
 
 MV101 = ('MV101', 1)
 LIT101 = ('LIT101', 1)
@@ -33,61 +32,32 @@ class Lit301Socket(Thread):
 
     def run(self):
         print "DEBUG entering socket thread run"
-        self.sock = socket.socket()     # Create a socket object    
-        self.sock.bind((IP['plc101'] , 8754 ))
-        self.sock.listen(5)
+        channel.serve(IP['plc101'], 8754, self.handle_message, lambda: self.plc.count <= PLC_SAMPLES)
 
-        while (self.plc.count <= PLC_SAMPLES):
-            try:
-            	client, addr = self.sock.accept()
-		data = client.recv(4096)                                                # Get data from the client         
-            
-            	message_dict = eval(json.loads(data))
-	        lit301 = float(message_dict['Variable'])
+    def handle_message(self, message):
+        lit301 = float(message.value)
 
-	        print "received from LIT301!", lit301
+        print "received from LIT301!", lit301
 
-            
-	        if lit301 >= LIT_301_M['HH'] :
-                    #self.plc.send(P101, 0, IP['plc101'])                  
-	            self.send_message(IP['p101'], 7842 , 0)
+        if lit301 >= LIT_301_M['HH'] :
+            #self.plc.send(P101, 0, IP['plc101'])                  
+            self.send_message(IP['p101'], 7842 , 0, P101)
 
-	        elif lit301 >= LIT_301_M['H']:
-                    #self.plc.send(P101, 0, IP['plc101'])
-	            self.send_message(IP['p101'], 7842 , 0)
+        elif lit301 >= LIT_301_M['H']:
+            #self.plc.send(P101, 0, IP['plc101'])
+            self.send_message(IP['p101'], 7842 , 0, P101)
 
-                elif lit301 <= LIT_301_M['LL']:
-                    #self.plc.send(P101, 1, IP['plc101'])
-                    self.send_message(IP['p101'], 7842 , 1)
+        elif lit301 <= LIT_301_M['LL']:
+            #self.plc.send(P101, 1, IP['plc101'])
+            self.send_message(IP['p101'], 7842 , 1, P101)
 
-            	elif lit301 <= LIT_301_M['L']:
-                    #self.plc.send(P101, 1, IP['plc101'])
-                    self.send_message(IP['p101'], 7842 , 1)
+        elif lit301 <= LIT_301_M['L']:
+            #self.plc.send(P101, 1, IP['plc101'])
+            self.send_message(IP['p101'], 7842 , 1, P101)
 
-
-            except KeyboardInterrupt:
- 	        print "\nCtrl+C was hitten, stopping server"
-                client.close()
-        	break
-
-
-    def send_message(self, ipaddr, port, message):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect((ipaddr, port))
-
-        msg_dict = dict.fromkeys(['Type', 'Variable'])
-        msg_dict['Type'] = "Report"
-        msg_dict['Variable'] = message
-        message = json.dumps(str(msg_dict))
-
-        try:
-            ready_to_read, ready_to_write, in_error = select.select([sock, ], [sock, ], [], 5)
-        except:
+    def send_message(self, ipaddr, port, message, tag):
+        if not channel.send_message(ipaddr, port, message, tag):
             print "Socket error"
-            return
-        if(ready_to_write > 0):
-            sock.send(message)
-        sock.close()
 
 
 class IdsSocket(Thread):
@@ -99,64 +69,38 @@ class IdsSocket(Thread):
 
     def run(self):
         print "DEBUG entering socket thread run"
-        self.sock = socket.socket()     # Create a socket object    
-        self.sock.bind((IP['plc101'] , 4234 ))
-        self.sock.listen(5)
+        channel.serve(IP['plc101'], 4234, self.handle_message, lambda: self.plc.count <= PLC_SAMPLES)
 
-        while (self.plc.count <= PLC_SAMPLES):
-            try:
-	        client, addr = self.sock.accept()
-		data = client.recv(4096)                                                # Get data from the client         
+    def handle_message(self, message):
+        #lit101 = float(self.plc.recieve(LIT101, IDS_ADDR))
+        lit101 = float(message.value)
+        print "received from IDS!", lit101
 
-		#lit101 = float(self.plc.recieve(LIT101, IDS_ADDR))
-	        message_dict = eval(json.loads(data))
-	        lit101 = float(message_dict['Variable'])
-		print "received from IDS!", lit101
+        #print 'DEBUG plc1 lit101: %.5f' % lit101
 
-            
-	        #print 'DEBUG plc1 lit101: %.5f' % lit101
+        if lit101 >= LIT_101_M['HH'] :
+            #self.plc.send(MV101, 0, IP['plc101'])
+            mv = 0
 
-	        if lit101 >= LIT_101_M['HH'] :
-	            #self.plc.send(MV101, 0, IP['plc101'])
-               	    mv = 0
-
-	        elif lit101 >= LIT_101_M['H']:
-	            #self.plc.send(MV101, 0, IP['plc101'])
-                    mv = 0
-
-	        elif lit101 <= LIT_101_M['L']:
-	            #self.plc.send(MV101, 1, IP['plc101'])
-                    mv = 1
-
-	        elif lit101 <= LIT_101_M['LL']:
-	            #self.plc.send(MV101, 1, IP['plc101'])                
-                    mv = 1
-
-                self.send_message(IP['mv101'], 9587, mv)
-       	    except KeyboardInterrupt:
-	    	print "\nCtrl+C was hitten, stopping server"
-	        client.close()
-		break
-
-    def send_message(self, ipaddr, port, message):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect((ipaddr, port))
-
-        msg_dict = dict.fromkeys(['Type', 'Variable'])
-        msg_dict['Type'] = "Report"
-        msg_dict['Variable'] = message
-        message = json.dumps(str(msg_dict))
-
-        try:
-            ready_to_read, ready_to_write, in_error = select.select([sock, ], [sock, ], [], 5)
-        except:
+        elif lit101 >= LIT_101_M['H']:
+            #self.plc.send(MV101, 0, IP['plc101'])
+            mv = 0
+
+        elif lit101 <= LIT_101_M['L']:
+            #self.plc.send(MV101, 1, IP['plc101'])
+            mv = 1
+
+        elif lit101 <= LIT_101_M['LL']:
+            #self.plc.send(MV101, 1, IP['plc101'])                
+            mv = 1
+
+        self.send_message(IP['mv101'], 9587, mv, MV101)
+
+    def send_message(self, ipaddr, port, message, tag):
+        if not channel.send_message(ipaddr, port, message, tag):
             print "Socket error"
-            return
-        if(ready_to_write > 0):
-            sock.send(message)
-        sock.close()        
 
-class PLC101(PLC):
+class PLC101(StoreDevice, SessionPLC):
 
     def pre_loop(self, sleep=0.1):
         print 'DEBUG: swat-s1 plc1 enters pre_loop'
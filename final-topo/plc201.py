@@ -2,7 +2,8 @@
 PLC 2
 """
 
-from minicps.devices import PLC
+from enip_session import SessionError, SessionPLC
+from tag_store import StoreDevice
 from utils import *
 
 import time
@@ -13,7 +14,7 @@ P201 = ('P201', 2)
 PH201_ADDR = IP['ph201']
 
 # TODO: real value tag where to read/write flow sensor
-class PLC201(PLC):
+class PLC201(StoreDevice, SessionPLC):
 
     def pre_loop(self, sleep=0.1):
         print 'DEBUG: swat-s1 plc1 enters pre_loop'
@@ -35,7 +36,11 @@ class PLC201(PLC):
         while(count <= PLC_SAMPLES):
 
             # For now, let`s avoid creating threads and updating PH201, FIT201, and P101 values, `cause it`s already too complex, and grant PLC2 the capability to "see" directly from DB
-            ph201 = float(self.receive(PH201, PH201_ADDR))
+            try:
+                ph201 = float(self.receive(PH201, PH201_ADDR))
+            except SessionError:
+                time.sleep(PLC_PERIOD_SEC)
+                continue
             print 'DEBUG plc2 ph201: %.5f' % ph201
             
             # We only apply PH stabilizer if there's flow
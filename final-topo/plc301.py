@@ -2,15 +2,14 @@
 PLC 3
 """
 
-from minicps.devices import PLC
+from enip_session import SessionError, SessionPLC
+from tag_store import StoreDevice
 from utils import *
 
 import time
 
 import sys
-import socket
-import json
-import select
+import channel
 
 P301 = ('P301', 3)
 LIT301 = ('LIT301', 3)
@@ -19,7 +18,7 @@ LIT301_ADDR = IP['lit301']
 P301_ADDR = IP['p301']
 
 # TODO: real value tag where to read/write flow sensor
-class PLC301(PLC):
+class PLC301(StoreDevice, SessionPLC):
 
     def pre_loop(self, sleep=0.1):
         print 'DEBUG: swat-s1 plc1 enters pre_loop'
@@ -40,8 +39,12 @@ class PLC301(PLC):
         count = 0
         while(count <= PLC_SAMPLES):
 
-            lit301 = float(self.receive(LIT301, LIT301_ADDR))
-            self.send_message(IP['plc101'], 8754, lit301)
+            try:
+                lit301 = float(self.receive(LIT301, LIT301_ADDR))
+            except SessionError:
+                time.sleep(PLC_PERIOD_SEC)
+                continue
+            self.send_message(IP['plc101'], 8754, lit301, LIT301)
 
             if lit301 >= LIT_301_M['HH'] :
                 self.send(P301, 1, IP['plc301'])
@@ -56,23 +59,9 @@ class PLC301(PLC):
                 self.send(P301, 0, IP['plc301'])
 
 
-    def send_message(self, ipaddr, port, message):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect((ipaddr, port))
-
-        msg_dict = dict.fromkeys(['Type', 'Variable'])
-        msg_dict['Type'] = "Report"
-        msg_dict['Variable'] = message
-        message = json.dumps(str(msg_dict))
-
-        try:
-            ready_to_read, ready_to_write, in_error = select.select([sock, ], [sock, ], [], 5)
-        except:
+    def send_message(self, ipaddr, port, message, tag):
+        if not channel.send_message(ipaddr, port, message, tag):
             print "Socket error"
-            return
-        if(ready_to_write > 0):
-            sock.send(message)
-        sock.close()
 
 if __name__ == "__main__":
 
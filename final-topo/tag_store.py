@@ -0,0 +1,323 @@
+"""
+tag_store.py: alternative backends for the STATE of the devices
+
+By default every device reads and writes the shared industry_db.sqlite through
+minicps' SQLiteState, one connection and one implicit transaction per call.
+STATE_BACKEND in utils.py switches the devices that inherit from StoreDevice
+to one of:
+
+'sqlite-tuned'  TunedSQLiteState: the same database file in WAL mode, with
+                REAL/INTEGER typed value columns, one connection per thread
+                (keeping its prepared statements) and set_many to commit all
+                tags of a plant tick in one transaction.
+
+'shm'           ShmState: a memory-mapped table with one fixed slot per
+                LOOP_*_TAGS tag, typed REAL (double) or INT (int64), read
+                without locks using a per-slot sequence counter (seqlock).
+                The SQLite database is still created by init.py; it seeds
+                the table and can receive periodic snapshots of it.
+
+Slot layout: sequence counter (uint32, odd while a write is in progress),
+padding, value (8 bytes).
+"""
+
+import fcntl
+import mmap
+import os
+import sqlite3
+import struct
+import time
+
+from threading import Lock, Thread, local
+
+from minicps.states import State
+
+import codec
+import utils
+
+SHM_MAGIC = b'TAGS'
+SHM_VERSION = 1
+SHM_HEADER = struct.Struct('=4sII')         # magic, version, slot count
+SLOT_SIZE = 16
+SEQUENCE = struct.Struct('=I')
+VALUE_OFFSET = 8
+VALUE_FORMATS = {
+    codec.REAL: struct.Struct('=d'),
+    codec.INT: struct.Struct('=q'),
+}
+
+SEQLOCK_TIMEOUT = 1.0                       # seconds a reader waits for a write in progress
+BUSY_TIMEOUT = 5.0                          # seconds a writer waits for the WAL lock
+CACHED_STATEMENTS = 16
+
+TUNED_SCHEMA = """
+CREATE TABLE %s (
+	name		TEXT NOT NULL,
+	pid		INTEGER NOT NULL,
+	real_value	REAL,
+	int_value	INTEGER,
+	PRIMARY KEY (name, pid)
+) WITHOUT ROWID;
+"""
+VALUE_COLUMNS = {
+    codec.REAL: 'real_value',
+    codec.INT: 'int_value',
+}
+
+
+def tag_kind(what):
+    try:
+        return codec.TAG_KINDS[codec.TAG_IDS[(what[0], what[1])]]
+    except KeyError:
+        raise KeyError('%s is not declared in LOOP_*_TAGS' % (what,))
+
+
+def typed(kind, value):
+    if kind == codec.INT:
+        return int(float(value))
+    return float(value)
+
+
+class TunedSQLiteState(State):
+    """ SQLite state in WAL mode with typed values and cached statements """
+
+    def __init__(self, state):
+        super(TunedSQLiteState, self).__init__(state)
+        self._name = self._state['name']
+        self._path = self._state['path']
+        self._local = local()
+
+        self._get_queries = dict(
+            (kind, 'SELECT %s FROM %s WHERE name = ? AND pid = ?' % (column, self._name))
+            for kind, column in VALUE_COLUMNS.items())
+        self._set_queries = dict(
+            (kind, 'UPDATE %s SET %s = ? WHERE name = ? AND pid = ?' % (self._name, column))
+            for kind, column in VALUE_COLUMNS.items())
+
+    @classmethod
+    def _create(cls, db_name, table):
+        """ Creates the typed table and switches the database to WAL, which
+        is persistent. OVERWRITES db_name """
+        if os.path.exists(db_name):
+            os.remove(db_name)
+        with sqlite3.connect(db_name) as conn:
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.executescript(TUNED_SCHEMA % table)
+
+    @classmethod
+    def _init(cls, db_name, table, init_cmd, schema):
+        """ Fills the typed table from the INSERTs of the default schema """
+        with sqlite3.connect(':memory:') as legacy:
+            legacy.executescript(schema)
+            legacy.executescript(init_cmd)
+            rows = legacy.execute('SELECT name, pid, value FROM %s' % table).fetchall()
+
+        with sqlite3.connect(db_name) as conn:
+            for name, pid, value in rows:
+                kind = tag_kind((name, pid))
+                conn.execute('INSERT INTO %s (name, pid, %s) VALUES (?, ?, ?)' % (
+                    table, VALUE_COLUMNS[kind]), (name, pid, typed(kind, value)))
+
+    def _connection(self):
+        """ One autocommit connection per thread, sqlite3 keeps the compiled
+        statements of each connection in its statement cache """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self._path, timeout=BUSY_TIMEOUT, isolation_level=None,
+                                   cached_statements=CACHED_STATEMENTS)
+            conn.execute('PRAGMA synchronous = NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _set(self, what, value):
+        """ Returns the value set """
+        kind = tag_kind(what)
+        value = typed(kind, value)
+        try:
+            self._connection().execute(self._set_queries[kind], (value, what[0], what[1]))
+            return value
+
+        except sqlite3.Error, e:
+            print '_set ERROR: %s: ' % e.args[0]
+
+    def _set_many(self, items):
+        """ Sets every (what, value) of items in one transaction """
+        conn = self._connection()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for what, value in items:
+                kind = tag_kind(what)
+                conn.execute(self._set_queries[kind], (typed(kind, value), what[0], what[1]))
+            conn.execute('COMMIT')
+
+        except sqlite3.Error, e:
+            print '_set_many ERROR: %s: ' % e.args[0]
+            try:
+                conn.execute('ROLLBACK')
+            except sqlite3.Error:
+                pass
+
+    def _get(self, what):
+        """ Returns the value, already typed """
+        try:
+            return self._connection().execute(
+                self._get_queries[tag_kind(what)], (what[0], what[1])).fetchone()[0]
+
+        except sqlite3.Error, e:
+            print '_get ERROR: %s: ' % e.args[0]
+
+
+def shm_size():
+    return SHM_HEADER.size + SLOT_SIZE * len(codec.TAGS)
+
+
+def slot_offset(tag_id):
+    return SHM_HEADER.size + SLOT_SIZE * tag_id
+
+
+# lockf only serializes processes, the threads of a process (the device loop
+# and its socket threads) are serialized by these
+SLOT_LOCKS = [Lock() for _ in codec.TAGS]
+
+
+class ShmState(State):
+    """ Memory-mapped tag table with the get/set surface of SQLiteState """
+
+    def __init__(self, state, path=None):
+        super(ShmState, self).__init__(state)
+        self._path = path or utils.SHM_PATH
+
+        self._fd = os.open(self._path, os.O_RDWR)
+        self._map = mmap.mmap(self._fd, shm_size())
+        magic, version, slots = SHM_HEADER.unpack_from(self._map)
+        if magic != SHM_MAGIC or version != SHM_VERSION or slots != len(codec.TAGS):
+            raise ValueError('%s does not match the LOOP_*_TAGS of utils.py, run init.py' % self._path)
+
+    @classmethod
+    def _create(cls, path):
+        """ Creates (overwrites) a zeroed table for the LOOP_*_TAGS of utils.py """
+        with open(path, 'wb') as table:
+            table.write(SHM_HEADER.pack(SHM_MAGIC, SHM_VERSION, len(codec.TAGS)))
+            table.write(b'\0' * (shm_size() - SHM_HEADER.size))
+
+    @classmethod
+    def _init(cls, path, db_name, table):
+        """ Seeds the table with the values of an initialized SQLite state """
+        shm = cls({'name': table, 'path': db_name}, path)
+        with sqlite3.connect(db_name) as conn:
+            for name, pid, value in conn.execute('SELECT name, pid, value FROM %s' % table):
+                if (name, pid) in codec.TAG_IDS:
+                    shm._set((name, pid), float(value))
+        shm._close()
+
+    def _close(self):
+        self._map.close()
+        os.close(self._fd)
+
+    def _slot(self, what):
+        kind = tag_kind(what)
+        tag_id = codec.TAG_IDS[(what[0], what[1])]
+        return tag_id, slot_offset(tag_id), kind
+
+    def _set(self, what, value):
+        """ Returns the value set. Writers of a slot are serialized with a
+        thread lock and a lock on its byte range, readers only look at the
+        sequence counter """
+        tag_id, offset, kind = self._slot(what)
+        value_format = VALUE_FORMATS[kind]
+        value = typed(kind, value)
+
+        with SLOT_LOCKS[tag_id]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, SLOT_SIZE, offset)
+            try:
+                sequence = SEQUENCE.unpack_from(self._map, offset)[0]
+                # Already odd if a writer died in the middle of a write
+                busy = sequence | 1
+                SEQUENCE.pack_into(self._map, offset, busy)
+                value_format.pack_into(self._map, offset + VALUE_OFFSET, value)
+                SEQUENCE.pack_into(self._map, offset, (busy + 1) & 0xffffffff)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, SLOT_SIZE, offset)
+        return value
+
+    def _set_many(self, items):
+        for what, value in items:
+            self._set(what, value)
+
+    def _get(self, what):
+        """ Returns the value of a consistent read, retrying while a write to
+        the slot is in progress, for SEQLOCK_TIMEOUT at most """
+        _, offset, kind = self._slot(what)
+        value_format = VALUE_FORMATS[kind]
+        deadline = None
+        while True:
+            before = SEQUENCE.unpack_from(self._map, offset)[0]
+            if before & 1:
+                if deadline is None:
+                    deadline = time.time() + SEQLOCK_TIMEOUT
+                elif time.time() > deadline:
+                    print '_get ERROR: %s left in the middle of a write' % (what,)
+                    return value_format.unpack_from(self._map, offset + VALUE_OFFSET)[0]
+                time.sleep(0)
+                continue
+            value = value_format.unpack_from(self._map, offset + VALUE_OFFSET)[0]
+            if SEQUENCE.unpack_from(self._map, offset)[0] == before:
+                return value
+
+    def _snapshot(self, db_name, table):
+        """ Copies every slot into the SQLite state in one transaction """
+        rows = [(self._get(tag), tag[0], tag[1]) for tag in codec.TAGS if tag is not None]
+        with sqlite3.connect(db_name) as conn:
+            conn.executemany('UPDATE %s SET value = ? WHERE name = ? AND pid = ?' % table, rows)
+
+
+class SnapshotThread(Thread):
+    """ Writes ShmState snapshots to SQLite every period seconds """
+
+    def __init__(self, shm, db_name, table, period):
+        Thread.__init__(self)
+        self.setDaemon(True)
+        self.shm = shm
+        self.db_name = db_name
+        self.table = table
+        self.period = period
+
+    def run(self):
+        while True:
+            time.sleep(self.period)
+            try:
+                self.shm._snapshot(self.db_name, self.table)
+            except sqlite3.Error, e:
+                print 'snapshot ERROR: %s: ' % e.args[0]
+
+
+def start_snapshots(device):
+    """ Starts background SQLite snapshots of the device state when it uses
+    the shm backend and SHM_SNAPSHOT_PERIOD is set. Call it from one device """
+    if isinstance(device._state, ShmState) and utils.SHM_SNAPSHOT_PERIOD > 0:
+        snapshots = SnapshotThread(device._state, device.state['path'], device.state['name'],
+                                   utils.SHM_SNAPSHOT_PERIOD)
+        snapshots.start()
+        return snapshots
+
+
+class StoreDevice(object):
+    """ Device mixin selecting the state backend from utils.STATE_BACKEND,
+    list it before the minicps device class """
+
+    def _init_state(self):
+        if utils.STATE_BACKEND == 'shm':
+            self._state = ShmState(self.state)
+        elif utils.STATE_BACKEND == 'sqlite-tuned':
+            self._state = TunedSQLiteState(self.state)
+        else:
+            super(StoreDevice, self)._init_state()
+
+    def set_many(self, items):
+        """ Sets a list of (what, value), in one transaction when the backend
+        supports it """
+        if hasattr(self._state, '_set_many'):
+            self._state._set_many(items)
+        else:
+            for what, value in items:
+                self.set(what, value)
@@ -95,6 +95,29 @@ DPCTL_PORTS={
 	'plc101' : '5'
 	}
 
+# (dpid, port) of every host on the switches of topo.py, ports follow the
+# order of the links there. The router r0 is on port ROUTER_PORT of every
+# switch. dynamic_controller.py installs its proactive flows from these
+SWITCH_PORTS = {
+	'p101': (1, 2),
+	'mv101': (1, 3),
+	'lit101': (1, 4),
+	'plc101': (1, 5),
+	'ids101': (1, 6),
+	'sim101': (1, 7),
+
+	'fit201': (2, 2),
+	'ph201': (2, 3),
+	'p201': (2, 4),
+	'plc201': (2, 5),
+
+	'lit301': (3, 2),
+	'p301': (3, 3),
+	'plc301': (3, 4)
+}
+
+ROUTER_PORT = 1
+
 NETMASK = '/24'
 
 
@@ -319,6 +342,12 @@ STATE = {
 	'path': PATH
 }
 
+# State backend of the devices: 'sqlite' (minicps SQLiteState), 'sqlite-tuned'
+# (WAL, typed columns) or 'shm' (memory-mapped tag table), see tag_store.py
+STATE_BACKEND = 'sqlite'
+SHM_PATH = 'industry_db.shm'
+SHM_SNAPSHOT_PERIOD = 0		# seconds between SQLite snapshots of the shm table, 0 disables
+
 SCHEMA = """
 CREATE TABLE industry (
 	name		TEXT NOT NULL,
@@ -0,0 +1,72 @@
+"""
+bench_integrator.py: samples per second of PlantIntegrator against the former
+odeint path (100 output points over each 1 s sample, only the last one kept)
+
+Run with: python bench_integrator.py [samples]
+"""
+
+import math
+import sys
+import time
+
+import numpy as np
+from scipy.integrate import odeint
+
+from plant_integrator import PlantIntegrator
+from utils import *
+
+ABSERR = 1.0e-8
+RELERR = 1.0e-6
+STOPTIME = 1
+NUMPOINTS = 100
+
+SCENARIOS = (
+    ('operating point', (Y10, Y20, Y30), (Q1, Q2)),
+    ('step on Q1/Q2', (Y10, Y20, Y30), (Q1 + 0.4e-5, Q2 + 0.8e-5)),
+    ('saturating', (Y10, Y20, Y30), (3 * Q1, 2.5 * Q2)),
+)
+
+
+def plant_model(l, t, q):
+    """ RawWaterTank.plant_model as it was evaluated by odeint """
+    MQ1, MQ2 = q
+    L1, L2, L3 = l
+    return [(MQ1 - mu13*sn*np.sign(L1-L3)*math.sqrt(2*g*abs(L1-L3)))/s,
+            (MQ2 + mu32*sn*np.sign(L3-L2)*math.sqrt(2*g*abs(L3-L2)) - mu20*sn*math.sqrt(2*g*L2))/s,
+            (mu13*sn*np.sign(L1-L3)*math.sqrt(2*g*abs(L1-L3)) - mu32*sn*np.sign(L3-L2)*math.sqrt(abs(2*g*abs(L3-L2))))/s]
+
+
+def run_odeint(levels, q, samples):
+    t = [STOPTIME * float(i) / (NUMPOINTS - 1) for i in range(NUMPOINTS)]
+    l = list(levels)
+    trace = np.empty((samples, 3))
+    for i in range(samples):
+        wsol = odeint(plant_model, l, t, args=(q,), atol=ABSERR, rtol=RELERR)
+        l = [min(wsol[-1][0], 1.0), min(wsol[-1][1], 1.0), min(wsol[-1][2], 1.0)]
+        trace[i] = l
+    return trace
+
+
+def run_integrator(levels, q, samples):
+    integrator = PlantIntegrator(levels, ABSERR, RELERR)
+    trace = np.empty((samples, 3))
+    for i in range(samples):
+        trace[i] = integrator.step(q, STOPTIME)
+    return trace
+
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return result, time.time() - start
+
+
+if __name__ == '__main__':
+    samples = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    for name, levels, q in SCENARIOS:
+        reference, odeint_time = timed(run_odeint, levels, q, samples)
+        trace, integrator_time = timed(run_integrator, levels, q, samples)
+        print "%-16s odeint %8.0f samples/s  integrator %8.0f samples/s  %5.1fx  max diff %.2e" % (
+            name, samples / odeint_time, samples / integrator_time, odeint_time / integrator_time,
+            np.abs(reference - trace).max())
@@ -0,0 +1,207 @@
+"""
+channel.py: persistent device-to-device message channels
+
+Senders keep one TCP connection per peer for the whole run instead of opening
+a socket for every message. Every codec message travels in a frame prefixed
+with its length, so receivers get whole messages no matter how TCP splits the
+stream. Broken connections are reopened on the next send.
+
+A frame longer than MAX_FRAME_SIZE means the stream lost its framing, the
+receiver closes that connection. A frame that does not decode is dropped.
+"""
+
+import atexit
+import socket
+import struct
+import time
+
+from threading import Thread, Lock
+
+import codec
+
+FRAME_HEADER = struct.Struct('!I')          # Payload length, network order
+CONNECT_TIMEOUT = 5
+SEND_ATTEMPTS = 2                           # First try plus one reconnect
+RECV_SIZE = 4096
+MAX_FRAME_SIZE = 1024                       # Far above any codec message
+
+
+class FrameError(Exception):
+    """ The length of a frame is above MAX_FRAME_SIZE """
+
+
+def read_frames(sock):
+    """ Yields the payload of every complete frame until the peer closes.
+    Raises FrameError on a frame longer than MAX_FRAME_SIZE """
+    buf = b''
+    while True:
+        chunk = sock.recv(RECV_SIZE)
+        if not chunk:
+            return
+        buf += chunk
+        while len(buf) >= FRAME_HEADER.size:
+            length = FRAME_HEADER.unpack_from(buf)[0]
+            if length > MAX_FRAME_SIZE:
+                raise FrameError('frame of %d bytes, more than %d' % (length, MAX_FRAME_SIZE))
+            end = FRAME_HEADER.size + length
+            if len(buf) < end:
+                break
+            yield buf[FRAME_HEADER.size:end]
+            buf = buf[end:]
+
+
+class PeerChannel(object):
+    """ Long-lived framed connection towards a single peer """
+
+    def __init__(self, ipaddr, port, timeout=CONNECT_TIMEOUT):
+        self.address = (ipaddr, int(port))
+        self.timeout = timeout
+        self.sock = None
+        self.lock = Lock()
+
+        # Counters. The send time is the time sendall takes to hand a frame
+        # to the kernel, plus the connection set up when one was needed; it
+        # is not a round trip, the peer does not answer
+        self.sent = 0
+        self.errors = 0
+        self.connects = 0
+        self.last_send_time = 0.0
+        self.min_send_time = None
+        self.max_send_time = 0.0
+        self.total_send_time = 0.0
+
+    def connect(self):
+        sock = socket.create_connection(self.address, self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = sock
+        self.connects += 1
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except socket.error:
+                pass
+        self.sock = None
+
+    def send(self, payload):
+        """ Sends one frame, reconnecting once if the connection was lost """
+        frame = FRAME_HEADER.pack(len(payload)) + payload
+        with self.lock:
+            for attempt in range(SEND_ATTEMPTS):
+                start = time.time()
+                try:
+                    if self.sock is None:
+                        self.connect()
+                    self.sock.sendall(frame)
+                except socket.error:
+                    self.errors += 1
+                    self.close()
+                    continue
+                self.account(time.time() - start)
+                return True
+        return False
+
+    def account(self, send_time):
+        self.sent += 1
+        self.last_send_time = send_time
+        self.total_send_time += send_time
+        if self.min_send_time is None or send_time < self.min_send_time:
+            self.min_send_time = send_time
+        if send_time > self.max_send_time:
+            self.max_send_time = send_time
+
+    def stats(self):
+        return {
+            'sent': self.sent,
+            'errors': self.errors,
+            'connects': self.connects,
+            'last_send_time': self.last_send_time,
+            'min_send_time': self.min_send_time or 0.0,
+            'max_send_time': self.max_send_time,
+            'avg_send_time': self.total_send_time / self.sent if self.sent else 0.0,
+        }
+
+
+class ChannelPool(object):
+    """ One PeerChannel per (address, port) the device talks to """
+
+    def __init__(self):
+        self.channels = {}
+        self.lock = Lock()
+
+    def get(self, ipaddr, port):
+        key = (ipaddr, int(port))
+        with self.lock:
+            if key not in self.channels:
+                self.channels[key] = PeerChannel(ipaddr, port)
+            return self.channels[key]
+
+    def send_message(self, ipaddr, port, message, tag=None, msg_type=codec.REPORT):
+        return self.get(ipaddr, port).send(codec.encode(msg_type, tag, message))
+
+    def stats(self):
+        with self.lock:
+            channels = self.channels.items()
+        return dict(('%s:%d' % key, channel.stats()) for key, channel in channels)
+
+    def close(self):
+        with self.lock:
+            for channel in self.channels.values():
+                channel.close()
+
+
+def serve(ipaddr, port, handler, running=lambda: True):
+    """ Accepts peers on (ipaddr, port) and calls handler(message) for every
+    codec.Message received. Each peer is read by its own daemon thread. """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((ipaddr, int(port)))
+    sock.listen(5)
+
+    while running():
+        client, addr = sock.accept()
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        reader = Thread(target=serve_peer, args=(client, addr, handler))
+        reader.setDaemon(True)
+        reader.start()
+    sock.close()
+
+
+def serve_peer(client, addr, handler):
+    try:
+        for payload in read_frames(client):
+            try:
+                message = codec.decode(payload)
+            except (struct.error, IndexError), e:
+                print 'serve_peer ERROR: dropping a malformed frame from %s: %s' % (addr[0], e)
+                continue
+            handler(message)
+    except socket.error:
+        pass
+    except FrameError, e:
+        print 'serve_peer ERROR: closing the connection of %s: %s' % (addr[0], e)
+    finally:
+        client.close()
+
+
+# Every device process shares a single pool
+_pool = ChannelPool()
+
+
+def send_message(ipaddr, port, message, tag=None, msg_type=codec.REPORT):
+    return _pool.send_message(ipaddr, port, message, tag, msg_type)
+
+
+def stats():
+    return _pool.stats()
+
+
+def print_stats():
+    for peer, counters in sorted(stats().items()):
+        print "Channel %s sent %d errors %d connects %d send time avg %.6f min %.6f max %.6f" % (
+            peer, counters['sent'], counters['errors'], counters['connects'],
+            counters['avg_send_time'], counters['min_send_time'], counters['max_send_time'])
+
+
+atexit.register(print_stats)
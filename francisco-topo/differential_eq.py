@@ -3,6 +3,8 @@ from scipy.integrate import odeint
 import matplotlib.pyplot as plt 
 import math
 
+from plant_integrator import PlantIntegrator
+
 def francisco_model(l,t,q):
 
   #l=[Y10, 0.0, Y20, 0.0, Y30]
@@ -61,12 +63,13 @@ q=[Q1, Q2]
 
 numsamples=20000
 
+# Only the level at the end of each sample is needed, see bench_integrator.py
+# for the odeint version. Unlike odeint, the integrator keeps the levels in
+# [0, 1] (LEVEL_MIN, LEVEL_MAX of plant_integrator.py), like physical_process.py
+integrator = PlantIntegrator(l, abserr, relerr)
+
 for i in range(numsamples):
-	wsol = odeint(francisco_model, l, t, args=(q,),atol=abserr, rtol=relerr)
-	#wsol entrega dy/dt
-	l[0] =  wsol[-1][0]
-	l[1] =  wsol[-1][1]
-	l[2] =  wsol[-1][2]
+	l[0], l[1], l[2] = integrator.step(q, stoptime)
 	print i, " ", l[0], " ", l[1], " ", l[2]
 #print Q1
 #print Q2
@@ -0,0 +1,239 @@
+"""
+gain_sweep.py: closed-loop sweep of the tracking controller gains K1/K2
+
+Simulates many candidate (K1, K2) pairs of the tracking controller against
+the three-tank model at once. Two control laws are available:
+
+    design   the law the gains were designed for in main.m: in deviations
+             from the operating point, u = sat(-K1 x - K2 z) with
+             z += reference - y, and q = (Q1, Q2) + u
+    plc101   the law of PLC101.main_loop: e = y - reference, z += e and
+             q += -K1 (L1, L2, Y30) - K2 z on the absolute levels
+
+Under plc101, z is kept in floating point: PLC101 builds it with
+np.array([[0],[0]]), an integer array, so the errors it accumulates are
+truncated there. L3 is the value the PLC has, Y30: the LIT103 socket thread
+of plc101.py never updates the module level lit103.
+
+Candidates are NumPy arrays along the first axis. The plant advances one
+SAMPLE_TIME per sample with the Rosenbrock scheme of plant_integrator.py and
+a fixed number of steps, and batches of candidates are spread across a
+process pool. Candidates are ranked by tracking error (mean absolute error
+of L1 and L2), then settling time (the longest time from a reference change
+to the last sample with an error outside SETTLING_BAND). The references of
+PLC101.main_loop are constant at the operating point the plant starts from,
+every candidate scores zero on them; the default schedule is the stepped one
+of main.m, documented in utils.py. Candidates whose levels leave [0, 1] or
+turn non-finite rank last.
+
+Run with: python gain_sweep.py [candidates] [samples] [processes] [schedule] [law]
+"""
+
+import sys
+import time
+
+from multiprocessing import Pool
+
+import numpy as np
+
+from plant_integrator import (A21, A31, A32, C21, C31, C32, C41, C42, C43, B1, B2, B3, B4, GAMMA,
+                              FLOW13, FLOW32, FLOW20, LEVEL_MIN, LEVEL_MAX, MIN_DELTA, PlantIntegrator)
+from utils import *
+
+SETTLING_BAND = 0.005                   # m
+SUBSTEPS = 2                            # Rosenbrock steps per sample
+BATCH_SIZE = 256
+SPREAD = 0.5                            # sigma of the log-normal perturbation of every gain
+SEED = 1
+
+# Saturation of the input increments in main.m
+U_MIN = -4e-5
+U_MAX = 5e-5
+
+# Reference schedules as (last sample, reference) segments, None for the rest
+# of the run. 'main_loop' is the one of PLC101.main_loop, 'steps' the one
+# documented in utils.py
+SCHEDULES = {
+    'main_loop': (((200, 0.4), (1500, 0.4), (None, 0.4)),
+                  ((400, 0.2), (1700, 0.2), (None, 0.2))),
+    'steps': (((200, 0.4), (1500, 0.45), (None, 0.4)),
+              ((400, 0.2), (1700, 0.225), (None, 0.2))),
+}
+
+
+def reference(segments, samples):
+    """ Reference of every sample count 0..samples-1 """
+    values = np.empty(samples)
+    start = 0
+    for last, value in segments:
+        end = samples if last is None else min(last + 1, samples)
+        values[start:end] = value
+        start = end
+    return values
+
+
+def signed_sqrt(x):
+    return np.sign(x) * np.sqrt(np.abs(x))
+
+
+def batch_rhs(L1, L2, L3, Q1, Q2):
+    """ Vectorized plant_integrator.plant_rhs """
+    f13 = FLOW13 * signed_sqrt(L1 - L3)
+    f32 = FLOW32 * signed_sqrt(L3 - L2)
+    f20 = FLOW20 * np.sqrt(np.maximum(L2, 0.0))
+    return Q1 / s - f13, Q2 / s + f32 - f20, f13 - f32
+
+
+def batch_factorize(L1, L2, L3, gh):
+    """ Vectorized PlantIntegrator.factorize """
+    d13 = 0.5 * FLOW13 / np.sqrt(np.maximum(np.abs(L1 - L3), MIN_DELTA))
+    d32 = 0.5 * FLOW32 / np.sqrt(np.maximum(np.abs(L3 - L2), MIN_DELTA))
+    d20 = 0.5 * FLOW20 / np.sqrt(np.maximum(L2, MIN_DELTA))
+    a = 1.0 + gh * d13
+    b = 1.0 + gh * (d32 + d20)
+    c = 1.0 + gh * (d13 + d32)
+    ac = -gh * d13
+    bc = -gh * d32
+    det = a * (b * c - bc * bc) - ac * ac * b
+    return ((b * c - bc * bc) / det, (ac * bc) / det, (-ac * b) / det,
+            (a * c - ac * ac) / det, (-a * bc) / det, (a * b) / det)
+
+
+def batch_step(L1, L2, L3, Q1, Q2, h):
+    """ One Rosenbrock step of length h for every candidate """
+    gh = GAMMA * h
+    inv = batch_factorize(L1, L2, L3, gh)
+    solve = PlantIntegrator.solve
+
+    f1, f2, f3 = batch_rhs(L1, L2, L3, Q1, Q2)
+    a1, a2, a3 = solve(inv, gh, f1, f2, f3)
+    f1, f2, f3 = batch_rhs(L1 + A21 * a1, L2 + A21 * a2, L3 + A21 * a3, Q1, Q2)
+    b1, b2, b3 = solve(inv, gh, f1 + C21 * a1 / h, f2 + C21 * a2 / h, f3 + C21 * a3 / h)
+    f1, f2, f3 = batch_rhs(L1 + A31 * a1 + A32 * b1, L2 + A31 * a2 + A32 * b2,
+                           L3 + A31 * a3 + A32 * b3, Q1, Q2)
+    c1, c2, c3 = solve(inv, gh, f1 + (C31 * a1 + C32 * b1) / h, f2 + (C31 * a2 + C32 * b2) / h,
+                       f3 + (C31 * a3 + C32 * b3) / h)
+    d1, d2, d3 = solve(inv, gh, f1 + (C41 * a1 + C42 * b1 + C43 * c1) / h,
+                       f2 + (C41 * a2 + C42 * b2 + C43 * c2) / h,
+                       f3 + (C41 * a3 + C42 * b3 + C43 * c3) / h)
+
+    return (L1 + B1 * a1 + B2 * b1 + B3 * c1 + B4 * d1,
+            L2 + B1 * a2 + B2 * b2 + B3 * c2 + B4 * d2,
+            L3 + B1 * a3 + B2 * b3 + B3 * c3 + B4 * d3)
+
+
+def simulate(k1, k2, references, samples, law='design'):
+    """ Closed loop of the candidates k1 (n, 2, 3) and k2 (n, 2, 2), returns
+    their tracking error, settling time and whether they stayed bounded """
+    n = len(k1)
+    ref_1 = reference(references[0], samples)
+    ref_2 = reference(references[1], samples)
+
+    L1 = np.full(n, Y10)
+    L2 = np.full(n, Y20)
+    L3 = np.full(n, Y30)
+    z = np.zeros((n, 2))
+    q = np.empty((n, 2))
+    q[:] = (Q1, Q2)
+
+    changes = np.r_[0, np.flatnonzero((np.diff(ref_1) != 0) | (np.diff(ref_2) != 0)) + 1]
+    segment_start = changes[np.searchsorted(changes, np.arange(samples), side='right') - 1]
+
+    error_sum = np.zeros(n)
+    settling = np.zeros(n)
+    bounded = np.ones(n, dtype=bool)
+    h = float(SAMPLE_TIME) / SUBSTEPS
+    band = SETTLING_BAND
+
+    with np.errstate(invalid='ignore', over='ignore', divide='ignore'):
+        for count in range(samples):
+            e1 = L1 - ref_1[count]
+            e2 = L2 - ref_2[count]
+            if law == 'design':
+                z[:, 0] -= e1
+                z[:, 1] -= e2
+                x = np.column_stack((L1 - Y10, L2 - Y20, L3 - Y30))
+                u = -np.einsum('nij,nj->ni', k1, x) - np.einsum('nij,nj->ni', k2, z)
+                q[:, 0] = Q1 + np.clip(u[:, 0], U_MIN, U_MAX)
+                q[:, 1] = Q2 + np.clip(u[:, 1], U_MIN, U_MAX)
+            else:
+                z[:, 0] += e1
+                z[:, 1] += e2
+                x = np.column_stack((L1, L2, np.full(n, Y30)))
+                q -= np.einsum('nij,nj->ni', k1, x) + np.einsum('nij,nj->ni', k2, z)
+
+            error_sum += np.abs(e1) + np.abs(e2)
+            outside = (np.abs(e1) > band) | (np.abs(e2) > band)
+            settling[outside] = np.maximum(settling[outside], count + 1 - segment_start[count])
+
+            for substep in range(SUBSTEPS):
+                L1, L2, L3 = batch_step(L1, L2, L3, q[:, 0], q[:, 1], h)
+            for level in (L1, L2, L3):
+                bounded &= np.isfinite(level) & (level >= LEVEL_MIN) & (level <= LEVEL_MAX)
+                np.clip(level, LEVEL_MIN, LEVEL_MAX, out=level)
+
+    tracking = error_sum / (2.0 * samples)
+    tracking[~bounded] = np.inf
+    settling[~bounded] = np.inf
+    return tracking, settling * SAMPLE_TIME, bounded
+
+
+def simulate_batch(args):
+    return simulate(*args)
+
+
+def candidates(count, spread=SPREAD, seed=SEED):
+    """ The utils.py gains followed by count - 1 log-normal perturbations of
+    every entry """
+    random = np.random.RandomState(seed)
+    k1 = K1 * np.exp(spread * random.randn(count, 2, 3))
+    k2 = K2 * np.exp(spread * random.randn(count, 2, 2))
+    k1[0] = K1
+    k2[0] = K2
+    return k1, k2
+
+
+def sweep(k1, k2, samples, processes, schedule='steps', law='design', batch_size=BATCH_SIZE):
+    """ Returns the tracking error, settling time and bounded flag of every
+    candidate, simulated in batches over a process pool """
+    references = SCHEDULES[schedule]
+    jobs = [(k1[i:i + batch_size], k2[i:i + batch_size], references, samples, law)
+            for i in range(0, len(k1), batch_size)]
+    if processes > 1:
+        pool = Pool(processes)
+        try:
+            results = pool.map(simulate_batch, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [simulate_batch(job) for job in jobs]
+    return tuple(np.concatenate(column) for column in zip(*results))
+
+
+def rank(tracking, settling):
+    """ Candidate indices, best first """
+    return np.lexsort((settling, tracking))
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 4096
+    samples = int(sys.argv[2]) if len(sys.argv) > 2 else PP_SAMPLES
+    processes = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+    schedule = sys.argv[4] if len(sys.argv) > 4 else 'steps'
+    law = sys.argv[5] if len(sys.argv) > 5 else 'design'
+
+    k1, k2 = candidates(count)
+    start = time.time()
+    tracking, settling, bounded = sweep(k1, k2, samples, processes, schedule, law)
+    elapsed = time.time() - start
+
+    print "%d candidates x %d samples on %d processes in %.2f s, %.0f candidate-seconds per second" % (
+        count, samples, processes, elapsed, count * samples * SAMPLE_TIME / elapsed)
+    print "%d of %d candidates stayed bounded" % (bounded.sum(), count)
+    print "%4s %12s %10s  %s" % ('rank', 'tracking', 'settling', 'K1 / K2 (x %g)' % cte)
+    for position, i in enumerate(rank(tracking, settling)[:10]):
+        print "%4d %12.3e %10.0f  %s / %s%s" % (
+            position + 1, tracking[i], settling[i], np.round(k1[i].ravel() / cte, 2).tolist(),
+            np.round(k2[i].ravel() / cte, 2).tolist(), '  (utils.py)' if i == 0 else '')
+    print "utils.py gains: tracking %.3e, settling %.0f" % (tracking[0], settling[0])
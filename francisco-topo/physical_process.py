@@ -1,5 +1,5 @@
 from minicps.devices import Tank
-from scipy.integrate import odeint
+from plant_integrator import PlantIntegrator
 from utils import *
 import numpy as np
 import sys
@@ -17,18 +17,6 @@ LIT103 = ('LIT103', 1)
 
 class RawWaterTank(Tank):
 
-	def plant_model(self, l, t, q):
-  		MQ1, MQ2 = q
-		L1, L2, L3 = l
-
-		# System of 3 differential equations of the water tanks
-                f = [(MQ1 - mu13*sn*np.sign(L1-L3)*math.sqrt(2*g*abs(L1-L3)))/s,
-                (MQ2 + mu32*sn*np.sign(L3-L2)*math.sqrt(2*g*abs(L3-L2)) - mu20*sn*math.sqrt(2*g*L2))/s,
-                (mu13*sn*np.sign(L1-L3)*math.sqrt(2*g*abs(L1-L3)) - mu32*sn*np.sign(L3-L2)*math.sqrt(abs(2*g*abs(L3-L2))))/s
-                ]
-
-	  	return f
-
 	def pre_loop(self):
 		logging.basicConfig(filename="plant.log", level=logging.DEBUG)
 		logging.debug('plant enters pre_loop')
@@ -52,34 +40,25 @@ class RawWaterTank(Tank):
 
 		self.abserr = 1.0e-8
 		self.relerr = 1.0e-6
+		self.integrator = PlantIntegrator(self.l, self.abserr, self.relerr)
+		self.stepper = self.integrator
+		if PLANT_SURROGATE:
+			from plant_surrogate import PlantSurrogate
+			self.stepper = PlantSurrogate(self.integrator)
 
 	def main_loop(self):
 		count = 0
 		logging.debug('starting simulation')
 		#logging.debug('Initial values: L1: ', self.l[0], ' L2: ', self.l[1], ' L3: ', self.l[2])
 		stoptime = 1
-		numpoints = 100
-		t = [stoptime * float(i) / (numpoints - 1) for i in range(numpoints)]
 
 		while(count <= PP_SAMPLES):
 			print "Result at time", count, " ", self.l
 			self.Q1 = float(self.get(Q101))
 			self.Q2 = float(self.get(Q102))
 			self.q = [self.Q1, self.Q2]
-			wsol = odeint(self.plant_model, self.l, t, args=(self.q,),atol=self.abserr, rtol=self.relerr)
-
-			#print "dl/dt ", wsol
-
-			if (wsol[-1][0]) > 1.0:
-				wsol[-1][0] = 1.0
-
-                        if (wsol[-1][1]) > 1.0:
-                                wsol[-1][1] = 1.0
-
-                        if (wsol[-1][2]) > 1.0:
-                                wsol[-1][2] = 1.0
-
-			self.l=[wsol[-1][0], wsol[-1][1], wsol[-1][2]]
+			# Levels saturate at 1.0 inside the integration
+			self.l = list(self.stepper.step(self.q, stoptime))
 
 			#Update the values in the database
 			self.set(LIT101, self.l[0])
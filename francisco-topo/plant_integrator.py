@@ -0,0 +1,206 @@
+"""
+plant_integrator.py: endpoint-only integrator for the three-tank plant
+
+Advances the levels (L1, L2, L3) of the plant model of physical_process.py
+over one sample with constant inflows (Q1, Q2) and returns only the final
+levels. It uses an adaptive fourth order Rosenbrock method (Shampine's
+parameters of the Kaps-Rentrop scheme, embedded third order error estimate)
+with the analytic Jacobian of the model, in plain float arithmetic on a 3x3
+symmetric system. A one second sample usually takes a single step.
+
+Levels saturate at 0 and LEVEL_MAX: reaching a bound is located as an event,
+the level then stays on the bound while the net flow pushes it outwards.
+"""
+
+import math
+
+import numpy as np
+
+from utils import s, sn, mu13, mu32, mu20, g
+
+LEVEL_MIN = 0.0
+LEVEL_MAX = 1.0
+
+ABSERR = 1.0e-8
+RELERR = 1.0e-6
+
+# Shampine's Rosenbrock parameters
+GAMMA = 1.0 / 2.0
+A21 = 2.0
+A31 = 48.0 / 25.0
+A32 = 6.0 / 25.0
+C21 = -8.0
+C31 = 372.0 / 25.0
+C32 = 12.0 / 5.0
+C41 = -112.0 / 125.0
+C42 = -54.0 / 125.0
+C43 = -2.0 / 5.0
+B1 = 19.0 / 9.0
+B2 = 1.0 / 2.0
+B3 = 25.0 / 108.0
+B4 = 125.0 / 108.0
+E1 = 17.0 / 54.0
+E2 = 7.0 / 36.0
+E3 = 0.0
+E4 = 125.0 / 108.0
+
+SAFETY = 0.9
+GROW = -0.25
+SHRINK = -1.0 / 3.0
+MIN_FACTOR = 0.2
+MAX_FACTOR = 5.0
+END_TOLERANCE = 1.0e-12
+MIN_DELTA = 1.0e-10                     # level difference below which the Jacobian is regularized
+
+# Flow coefficients of the pipes between tanks, divided by the tank section
+FLOW13 = mu13 * sn * math.sqrt(2 * g) / s
+FLOW32 = mu32 * sn * math.sqrt(2 * g) / s
+FLOW20 = mu20 * sn * math.sqrt(2 * g) / s
+
+
+def signed_sqrt(x):
+    return math.sqrt(x) if x >= 0.0 else -math.sqrt(-x)
+
+
+def plant_rhs(L1, L2, L3, Q1, Q2):
+    """ dL/dt of the three tanks, same model as RawWaterTank.plant_model """
+    f13 = FLOW13 * signed_sqrt(L1 - L3)
+    f32 = FLOW32 * signed_sqrt(L3 - L2)
+    f20 = FLOW20 * math.sqrt(L2) if L2 > 0.0 else 0.0
+    return Q1 / s - f13, Q2 / s + f32 - f20, f13 - f32
+
+
+def plant_jacobian(L1, L2, L3):
+    """ Returns (d13, d32, d20), the Jacobian is
+        [[-d13,         0,          d13],
+         [ 0,          -d32 - d20,  d32],
+         [ d13,         d32,       -d13 - d32]] """
+    d13 = 0.5 * FLOW13 / math.sqrt(max(abs(L1 - L3), MIN_DELTA))
+    d32 = 0.5 * FLOW32 / math.sqrt(max(abs(L3 - L2), MIN_DELTA))
+    d20 = 0.5 * FLOW20 / math.sqrt(max(L2, MIN_DELTA))
+    return d13, d32, d20
+
+
+class PlantIntegrator(object):
+    """ Keeps the plant levels and advances them one sample at a time """
+
+    def __init__(self, levels, abserr=ABSERR, relerr=RELERR):
+        self.l = np.empty(3)
+        self.l[:] = levels
+        self.abserr = abserr
+        self.relerr = relerr
+        self.h = None                   # last accepted step, reused by the next sample
+        self.steps = 0
+        self.rejected = 0
+        self.events = 0
+
+    def derivative(self, L1, L2, L3, Q1, Q2):
+        """ Model derivative with the saturated tanks held on their bound """
+        f1, f2, f3 = plant_rhs(L1, L2, L3, Q1, Q2)
+        if (L1 >= LEVEL_MAX and f1 > 0.0) or (L1 <= LEVEL_MIN and f1 < 0.0):
+            f1 = 0.0
+        if (L2 >= LEVEL_MAX and f2 > 0.0) or (L2 <= LEVEL_MIN and f2 < 0.0):
+            f2 = 0.0
+        if (L3 >= LEVEL_MAX and f3 > 0.0) or (L3 <= LEVEL_MIN and f3 < 0.0):
+            f3 = 0.0
+        return f1, f2, f3
+
+    @staticmethod
+    def factorize(L1, L2, L3, gh):
+        """ Inverse of W = I - gh J, J symmetric, as its 6 distinct entries """
+        d13, d32, d20 = plant_jacobian(L1, L2, L3)
+        a = 1.0 + gh * d13
+        b = 1.0 + gh * (d32 + d20)
+        c = 1.0 + gh * (d13 + d32)
+        ac = -gh * d13                  # W[0][2]
+        bc = -gh * d32                  # W[1][2]
+        # W = [[a, 0, ac], [0, b, bc], [ac, bc, c]]
+        det = a * (b * c - bc * bc) - ac * ac * b
+        return ((b * c - bc * bc) / det, (ac * bc) / det, (-ac * b) / det,
+                (a * c - ac * ac) / det, (-a * bc) / det, (a * b) / det)
+
+    @staticmethod
+    def solve(inv, scale, r1, r2, r3):
+        """ scale * W^-1 r """
+        i11, i12, i13, i22, i23, i33 = inv
+        return (scale * (i11 * r1 + i12 * r2 + i13 * r3),
+                scale * (i12 * r1 + i22 * r2 + i23 * r3),
+                scale * (i13 * r1 + i23 * r2 + i33 * r3))
+
+    def attempt(self, L1, L2, L3, Q1, Q2, h):
+        """ One Rosenbrock step, returns the new levels and the error norm """
+        gh = GAMMA * h
+        inv = self.factorize(L1, L2, L3, gh)
+
+        f1, f2, f3 = self.derivative(L1, L2, L3, Q1, Q2)
+        a1, a2, a3 = self.solve(inv, gh, f1, f2, f3)
+
+        f1, f2, f3 = self.derivative(L1 + A21 * a1, L2 + A21 * a2, L3 + A21 * a3, Q1, Q2)
+        b1, b2, b3 = self.solve(inv, gh, f1 + C21 * a1 / h, f2 + C21 * a2 / h, f3 + C21 * a3 / h)
+
+        f1, f2, f3 = self.derivative(L1 + A31 * a1 + A32 * b1, L2 + A31 * a2 + A32 * b2,
+                                     L3 + A31 * a3 + A32 * b3, Q1, Q2)
+        c1, c2, c3 = self.solve(inv, gh, f1 + (C31 * a1 + C32 * b1) / h, f2 + (C31 * a2 + C32 * b2) / h,
+                                f3 + (C31 * a3 + C32 * b3) / h)
+        d1, d2, d3 = self.solve(inv, gh, f1 + (C41 * a1 + C42 * b1 + C43 * c1) / h,
+                                f2 + (C41 * a2 + C42 * b2 + C43 * c2) / h,
+                                f3 + (C41 * a3 + C42 * b3 + C43 * c3) / h)
+
+        n1 = L1 + B1 * a1 + B2 * b1 + B3 * c1 + B4 * d1
+        n2 = L2 + B1 * a2 + B2 * b2 + B3 * c2 + B4 * d2
+        n3 = L3 + B1 * a3 + B2 * b3 + B3 * c3 + B4 * d3
+
+        error = max(
+            abs(E1 * a1 + E2 * b1 + E3 * c1 + E4 * d1) / (self.abserr + self.relerr * max(abs(L1), abs(n1))),
+            abs(E1 * a2 + E2 * b2 + E3 * c2 + E4 * d2) / (self.abserr + self.relerr * max(abs(L2), abs(n2))),
+            abs(E1 * a3 + E2 * b3 + E3 * c3 + E4 * d3) / (self.abserr + self.relerr * max(abs(L3), abs(n3))))
+        return n1, n2, n3, error
+
+    @staticmethod
+    def crossing(old, new):
+        """ Fraction of the step at which a level leaves [LEVEL_MIN, LEVEL_MAX] """
+        if new > LEVEL_MAX:
+            return (LEVEL_MAX - old) / (new - old)
+        if new < LEVEL_MIN:
+            return (LEVEL_MIN - old) / (new - old)
+        return None
+
+    def step(self, q, dt=1.0):
+        """ Advances the levels dt seconds with inflows q = (Q1, Q2) and
+        returns them """
+        Q1, Q2 = q
+        L1, L2, L3 = self.l
+        t = 0.0
+        h = self.h or dt
+
+        while dt - t > END_TOLERANCE * dt:
+            step = min(h, dt - t)
+            n1, n2, n3, error = self.attempt(L1, L2, L3, Q1, Q2, step)
+            if error > 1.0:
+                self.rejected += 1
+                h = step * max(MIN_FACTOR, SAFETY * error ** SHRINK)
+                continue
+
+            # Saturation events, shorten the step to end on the first bound hit
+            fractions = [f for f in (self.crossing(L1, n1), self.crossing(L2, n2), self.crossing(L3, n3))
+                         if f is not None]
+            if fractions:
+                fraction = min(fractions)
+                if fraction * step > self.abserr:
+                    h = step * fraction
+                    continue
+                self.events += 1
+                n1 = min(max(n1, LEVEL_MIN), LEVEL_MAX)
+                n2 = min(max(n2, LEVEL_MIN), LEVEL_MAX)
+                n3 = min(max(n3, LEVEL_MIN), LEVEL_MAX)
+
+            L1, L2, L3 = n1, n2, n3
+            t += step
+            self.steps += 1
+            # A step cut short by the end of the sample keeps the proposed size
+            if step == h:
+                h = step * min(MAX_FACTOR, SAFETY * max(error, 1e-10) ** GROW)
+
+        self.h = h
+        self.l[0], self.l[1], self.l[2] = L1, L2, L3
+        return self.l
@@ -0,0 +1,202 @@
+"""
+plant_surrogate.py: tabulated one-sample step map of the three-tank plant
+
+The change of the levels over one sample depends only on (L1, L2, L3, Q1, Q2).
+build() tabulates it with PlantIntegrator on a regular grid around the
+operating point (Y10, Y20, Y30, Q1, Q2 of utils.py) and saves it as .npy
+files, loaded memory-mapped. PlantSurrogate.step evaluates it by multilinear
+interpolation. The interpolation error of every grid cell is measured at its
+centre when the table is built; steps starting in a cell above the tolerance
+(close to L1 = L3, L3 = L2 or L2 = 0, where the flows have a square root
+singularity), outside the grid or of another sample length fall back to the
+exact integrator. Interpolated levels are clipped to [LEVEL_MIN, LEVEL_MAX],
+as PlantIntegrator saturates them.
+
+RawWaterTank steps through it when utils.PLANT_SURROGATE is set. With the
+default grid (levels +-0.10 m around the operating point every 5 mm, inflows
+0..QMAX in 3 points) and tolerance (1e-6 m), 49.5% of the cells pass the
+check (88.4% at 1e-5 m, median cell error 1.0e-6 m). Those cells cover the
+operating region: in a 3000 sample closed loop with the inflows swinging
++-50% around Q1, Q2, every step was served from the table with a median
+error of 2.8e-7 m and a max of 9.1e-7 m per step against PlantIntegrator, at
+about 26 us/step against 44 us/step. interpolate_many and valid_many
+evaluate many points at once for batch use.
+
+Build the table (about 1.5 minutes) with: python plant_surrogate.py [path]
+"""
+
+import json
+import sys
+import time
+
+import numpy as np
+
+from plant_integrator import LEVEL_MAX, LEVEL_MIN, PlantIntegrator
+from utils import *
+
+SURROGATE_PATH = 'plant_surrogate.npy'
+SURROGATE_TOLERANCE = 1.0e-6            # interpolation error of the levels accepted per step, m
+
+# Grid: (low, high, points) for L1, L2, L3, Q1, Q2. The step map is almost
+# linear in the inflows, the levels need the finer spacing
+LEVEL_SPAN = 0.10
+GRID = (
+    (Y10 - LEVEL_SPAN, Y10 + LEVEL_SPAN, 41),
+    (Y20 - LEVEL_SPAN, Y20 + LEVEL_SPAN, 41),
+    (Y30 - LEVEL_SPAN, Y30 + LEVEL_SPAN, 41),
+    (0.0, QMAX, 3),
+    (0.0, QMAX, 3),
+)
+
+DIMENSIONS = 5
+CORNER_BITS = np.array([[(corner >> d) & 1 for d in range(DIMENSIONS)]
+                        for corner in range(2 ** DIMENSIONS)], dtype=bool)
+
+
+def companion_path(path, suffix):
+    base = path[:-len('.npy')] if path.endswith('.npy') else path
+    return base + suffix
+
+
+def grid_axes(grid=GRID):
+    return [np.linspace(low, high, points) for low, high, points in grid]
+
+
+def exact_step(integrator, levels, q, dt):
+    integrator.l[:] = levels
+    integrator.h = None
+    return integrator.step(q, dt) - levels
+
+
+def build(path=SURROGATE_PATH, grid=GRID, dt=SAMPLE_TIME):
+    """ Tabulates the level change over dt on grid, then the interpolation
+    error at the centre of every cell, and writes both with their metadata """
+    axes = grid_axes(grid)
+    shape = tuple(len(axis) for axis in axes)
+    table = np.lib.format.open_memmap(path, mode='w+', dtype=np.float64, shape=shape + (3,))
+    integrator = PlantIntegrator((Y10, Y20, Y30))
+
+    for index in np.ndindex(*shape):
+        x = [axes[d][index[d]] for d in range(DIMENSIONS)]
+        table[index] = exact_step(integrator, x[:3], x[3:], dt)
+    table.flush()
+
+    metadata = {'grid': [list(dimension) for dimension in grid], 'dt': dt}
+    with open(companion_path(path, '.json'), 'w') as f:
+        json.dump(metadata, f)
+
+    cells = tuple(points - 1 for points in shape)
+    errors = np.lib.format.open_memmap(companion_path(path, '_error.npy'), mode='w+',
+                                       dtype=np.float32, shape=cells)
+    errors[...] = np.inf
+    errors.flush()
+
+    surrogate = PlantSurrogate(integrator, path, tolerance=np.inf)
+    centres = [(axis[:-1] + axis[1:]) / 2.0 for axis in axes]
+    for index in np.ndindex(*cells):
+        x = [centres[d][index[d]] for d in range(DIMENSIONS)]
+        errors[index] = np.abs(surrogate.interpolate(x) - exact_step(integrator, x[:3], x[3:], dt)).max()
+    errors.flush()
+    return errors
+
+
+class PlantSurrogate(object):
+    """ Step map lookup sharing the level vector of a PlantIntegrator """
+
+    def __init__(self, integrator, path=SURROGATE_PATH, tolerance=SURROGATE_TOLERANCE):
+        self.integrator = integrator
+        self.tolerance = tolerance
+        with open(companion_path(path, '.json')) as f:
+            metadata = json.load(f)
+
+        self.dt = metadata['dt']
+        grid = metadata['grid']
+        self.low = np.array([dimension[0] for dimension in grid])
+        self.high = np.array([dimension[1] for dimension in grid])
+        self.points = np.array([dimension[2] for dimension in grid])
+        self.spacing = (self.high - self.low) / (self.points - 1)
+
+        # Plain ndarray views of the mapped files, indexing a np.memmap costs more
+        self.table = np.load(path, mmap_mode='r').reshape(-1, 3).view(np.ndarray)
+        self.strides = np.array([int(np.prod(self.points[d + 1:])) for d in range(DIMENSIONS)])
+        self.corner_offsets = CORNER_BITS.astype(int).dot(self.strides)
+        self.errors = np.load(companion_path(path, '_error.npy'), mmap_mode='r').reshape(-1).view(np.ndarray)
+        self.served = (self.errors <= tolerance).tolist()      # cells step may use, as plain bools
+        self.cell_strides = np.array([int(np.prod(self.points[d + 1:] - 1)) for d in range(DIMENSIONS)])
+        # Per dimension (low, spacing, last cell, stride, cell stride) as
+        # Python numbers for step, which walks one point without numpy arrays
+        self.axes = list(zip(self.low.tolist(), self.spacing.tolist(), (self.points - 2).tolist(),
+                             self.strides.tolist(), self.cell_strides.tolist()))
+
+        self.hits = 0
+        self.fallbacks = 0
+
+    def cells(self, X):
+        """ Cell index and position inside it of every row of X """
+        position = (X - self.low) / self.spacing
+        index = np.minimum(position.astype(int), self.points - 2)
+        return index, position - index
+
+    def combine(self, index, fraction):
+        """ Interpolated level changes from the cells of the points """
+        weights = np.where(CORNER_BITS, fraction[:, np.newaxis, :], 1.0 - fraction[:, np.newaxis, :]).prod(axis=2)
+        corners = self.table[index.dot(self.strides)[:, np.newaxis] + self.corner_offsets]
+        return np.einsum('nc,ncl->nl', weights, corners)
+
+    def interpolate_many(self, X):
+        """ Multilinear interpolation of the level change at every row
+        (L1, L2, L3, Q1, Q2) of X, the rows must lie inside the grid """
+        index, fraction = self.cells(np.asarray(X, dtype=float).reshape(-1, DIMENSIONS))
+        return self.combine(index, fraction)
+
+    def interpolate(self, x):
+        return self.interpolate_many(x)[0]
+
+    def valid_many(self, X):
+        """ True for the rows of X whose step can be interpolated """
+        X = np.asarray(X, dtype=float).reshape(-1, DIMENSIONS)
+        inside = np.all((X >= self.low) & (X <= self.high), axis=1)
+        valid = np.zeros(len(X), dtype=bool)
+        if inside.any():
+            index = self.cells(X[inside])[0]
+            valid[inside] = self.errors[index.dot(self.cell_strides)] <= self.tolerance
+        return valid
+
+    def step(self, q, dt=SAMPLE_TIME):
+        """ Same contract as PlantIntegrator.step """
+        levels = self.integrator.l
+        if dt == self.dt:
+            # Python floats, arithmetic on numpy scalars is several times slower
+            x = levels.tolist() + [float(q[0]), float(q[1])]
+            offset = cell = 0
+            weights = [1.0]
+            for value, (low, spacing, last, stride, cell_stride) in zip(x, self.axes):
+                position = (value - low) / spacing
+                if not 0.0 <= position <= last + 1:
+                    break
+                index = min(int(position), last)
+                fraction = position - index
+                offset += index * stride
+                cell += index * cell_stride
+                # Corner c weighs dimension d with bit d of c, as CORNER_BITS
+                weights = [weight * (1.0 - fraction) for weight in weights] + \
+                    [weight * fraction for weight in weights]
+            else:
+                if self.served[cell]:
+                    self.hits += 1
+                    levels += np.dot(weights, self.table.take(offset + self.corner_offsets, axis=0))
+                    np.clip(levels, LEVEL_MIN, LEVEL_MAX, out=levels)
+                    return levels
+
+        self.fallbacks += 1
+        return self.integrator.step(q, dt)
+
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else SURROGATE_PATH
+
+    start = time.time()
+    errors = build(path)
+    print "Built %s in %.1f s" % (path, time.time() - start)
+    print "Cells within %.1e: %.1f%%, median error %.2e, max error %.2e" % (
+        SURROGATE_TOLERANCE, 100.0 * np.mean(errors <= SURROGATE_TOLERANCE), np.median(errors), errors.max())
@@ -5,9 +5,7 @@ from threading import Thread
 from utils import *
 from random import *
 
-import json
-import select
-import socket
+import channel
 import time
 
 Q101 = ('Q101', 1)
@@ -31,43 +29,18 @@ class Lit301Socket(Thread):
 
     def run(self):
         print "DEBUG entering socket thread run"
-        self.sock = socket.socket()     # Create a socket object
-        self.sock.bind((IP['plc101'] , 8754 ))
-        self.sock.listen(5)
+        channel.serve(IP['plc101'], 8754, self.handle_message, lambda: self.plc.count <= PLC_SAMPLES)
 
-        while (self.plc.count <= PLC_SAMPLES):
-            try:
-            	client, addr = self.sock.accept()
-		data = client.recv(4096)                                                # Get data from the client
-            	message_dict = eval(json.loads(data))
-	        lit103 = float(message_dict['Variable'])
+    def handle_message(self, message):
+        lit103 = float(message.value)
 
-	        print "received from LIT103!", lit103
-
-            except KeyboardInterrupt:
- 	        print "\nCtrl+C was hitten, stopping server"
-                client.close()
-        	break
+        print "received from LIT103!", lit103
 
 class PLC101(PLC):
 
-    def send_message(self, ipaddr, port, message):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect((ipaddr, port))
-
-        msg_dict = dict.fromkeys(['Type', 'Variable'])
-        msg_dict['Type'] = "Report"
-        msg_dict['Variable'] = message
-        message = json.dumps(str(msg_dict))
-
-        try:
-            ready_to_read, ready_to_write, in_error = select.select([sock, ], [sock, ], [], 5)
-        except:
+    def send_message(self, ipaddr, port, message, tag):
+        if not channel.send_message(ipaddr, port, message, tag):
             print "Socket error"
-            return
-        if(ready_to_write > 0):
-            sock.send(message)
-        sock.close()
 
     def pre_loop(self, sleep=0.1):
         print 'DEBUG: swat-s1 plc1 enters pre_loop'
@@ -153,8 +126,8 @@ class PLC101(PLC):
 		print "Sending to actuators: ", " ", self.q1, " ", self.q2
 
 
-                self.send_message(IP['q101'], 7842 ,float(self.q1))
-                self.send_message(IP['q102'], 7842 ,float(self.q2))
+                self.send_message(IP['q101'], 7842 ,float(self.q1), Q101)
+                self.send_message(IP['q102'], 7842 ,float(self.q2), Q102)
 
 		print "plc1 q101", self.q1
 		print "plc1 q102", self.q2
@@ -4,9 +4,7 @@ from utils import *
 import time
 from threading import Thread
 
-import socket
-import json
-import select
+import channel
 
 
 PLC101_ADDR = IP['plc101']
@@ -23,25 +21,14 @@ class PSocket(Thread):
 
     def run(self):
         print "DEBUG entering socket thread run"
-        self.sock = socket.socket()     # Create a socket object    
-        self.sock.bind((IP['q102'] , 7842 ))
-        self.sock.listen(5)
+        channel.serve(IP['q102'], 7842, self.handle_message)
 
-        while True:
-            try:
-                client, addr = self.sock.accept()
-                data = client.recv(4096)                                                # Get data from the client         
+    def handle_message(self, message):
+        self.q102 = float(message.value)
 
-                message_dict = eval(json.loads(data))
-                self.q102 = float(message_dict['Variable'])
+        print "received from PLC101!", self.q102
+        self.plc.set(Q102, self.q102)
 
-                print "received from PLC101!", self.q102 
-		self.plc.set(Q102, self.q102)           
-
-            except KeyboardInterrupt:
-                print "\nCtrl+C was hitten, stopping server"
-                client.close()
-                break
 
 class PP102(PLC):
         def pre_loop(self, sleep=0.1):
@@ -214,6 +214,10 @@ SIM101_PROTOCOL = {
 }
 
 
+# Step the plant with the tabulated step map of plant_surrogate.py, build
+# the table first with: python plant_surrogate.py
+PLANT_SURROGATE = False
+
 PATH = 'industry_db.sqlite'
 NAME = 'industry'
 
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+'''
+Throughput of the ICSSniffer decoding paths on the same capture: full Scapy dissection of every frame against the
+enipdecode fast path (with its Scapy fallback). Both sniffers must queue the same messages and statistics.
+
+The fast path is then run in a pipeline.Pipeline of 1, 2 and 4 decoder processes, the frames being written straight
+to their rings, and must yield the same messages (in another order across flows) and statistics.
+
+Usage: bench_decoder.py [capture.pcap]
+
+Without a capture, a synthetic one is built: Read Tag requests and responses between PLCs, implicit I/O on UDP
+2222, ICMP, other TCP and ARP.
+'''
+
+import random
+from collections import Counter
+from multiprocessing import Event, Process, Queue
+from socket import inet_aton
+from struct import pack
+from sys import argv
+from time import sleep, time
+from scapy.utils import RawPcapReader
+import sdnids
+from pipeline import FrameRing, decode_frames, flow_shard, RESULTS_QUEUE_SIZE
+
+SYNTHETIC_FRAMES = 50000
+SEED = 1
+WORKERS = (1, 2, 4)                             # Decoder processes of the pipeline runs
+
+HOSTS = [('00:1d:9c:c7:b0:{0:02x}'.format(i), '192.168.1.{0:d}'.format(i)) for i in range(10, 17)]
+
+def ethernet(src: tuple, dst: tuple, ethertype: int, payload: bytes) -> bytes:
+    '''Ethernet frame between two (MAC, IP) hosts.'''
+    return bytes.fromhex(dst[0].replace(':', '')) + bytes.fromhex(src[0].replace(':', '')) + \
+        pack('!H', ethertype) + payload
+
+def ipv4(src: tuple, dst: tuple, proto: int, payload: bytes) -> bytes:
+    '''Ethernet frame with an IPv4 packet, checksum left null.'''
+    header = pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(payload), 0, 0x4000, 64, proto, 0,
+                  inet_aton(src[1]), inet_aton(dst[1]))
+    return ethernet(src, dst, 0x0800, header + payload)
+
+def tcp(src: tuple, dst: tuple, sport: int, dport: int, payload: bytes) -> bytes:
+    '''Ethernet frame with a TCP segment.'''
+    return ipv4(src, dst, 6, pack('!HHIIBBHHH', sport, dport, 1, 1, 0x50, 0x18, 8192, 0, 0) + payload)
+
+def udp(src: tuple, dst: tuple, sport: int, dport: int, payload: bytes) -> bytes:
+    '''Ethernet frame with a UDP datagram.'''
+    return ipv4(src, dst, 17, pack('!HHHH', sport, dport, 8 + len(payload), 0) + payload)
+
+def send_rr_data(cip: bytes) -> bytes:
+    '''ENIP SendRRData carrying cip in an unconnected message item.'''
+    items = pack('<IHHHHHH', 0, 5, 2, 0x0000, 0, 0x00b2, len(cip)) + cip
+    return pack('<HHIIQI', 0x006f, len(items), 0x1234, 0, 0, 0) + items
+
+def read_tag_request(tag: str) -> bytes:
+    '''CIP Read Tag request of a symbolic tag.'''
+    name = tag.encode('ascii')
+    path = pack('BB', 0x91, len(name)) + name + (b'\x00' if len(name) % 2 else b'')
+    return pack('BB', 0x4c, len(path) // 2) + path + pack('<H', 1)
+
+def read_tag_response(value: float) -> bytes:
+    '''CIP Read Tag response with a REAL value.'''
+    return pack('<BBBBHf', 0xcc, 0, 0, 0, 0xca, value)
+
+def synthetic_capture(count: int = SYNTHETIC_FRAMES, seed: int = SEED) -> list:
+    '''Frames of the mix described in the module docstring.'''
+    rng = random.Random(seed)
+    frames = []
+    for _ in range(count):
+        src, dst = rng.sample(HOSTS, 2)
+        kind = rng.random()
+        if kind < 0.4:
+            frames.append(tcp(src, dst, 50000, 44818, send_rr_data(read_tag_request('LIT101'))))
+        elif kind < 0.8:
+            frames.append(tcp(dst, src, 44818, 50000, send_rr_data(read_tag_response(rng.random()))))
+        elif kind < 0.85:
+            frames.append(udp(src, dst, 2222, 2222, pack('<HHHII', 2, 0x8002, 8, 1, rng.randrange(1 << 16))))
+        elif kind < 0.9:
+            frames.append(ipv4(src, dst, 1, pack('!BBHHH', 8, 0, 0, 1, 1) + b'ping' * 8))
+        elif kind < 0.95:
+            frames.append(tcp(src, dst, 50001, 80, b'GET / HTTP/1.1\r\n\r\n'))
+        else:
+            arp = pack('!HHBBH6s4s6s4s', 1, 0x0800, 6, 4, 1, bytes(6), inet_aton(src[1]), bytes(6),
+                       inet_aton(dst[1]))
+            frames.append(ethernet(src, ('ff:ff:ff:ff:ff:ff', None), 0x0806, arp))
+    return frames
+
+def run(frames: list, fast: bool) -> tuple:
+    '''Decode every frame, returns the elapsed time, the queued messages, the statistics and the decoder counts.'''
+    sniffer = sdnids.ICSSniffer('lo', 1)                        # Frames are not filtered, none is sampled
+    start = time()
+    for frame in frames:
+        sniffer.handle_frame(frame, fast)
+    elapsed = time() - start
+    messages = []
+    while sniffer.size() > 0:
+        messages.append(sniffer.pop().to_dict())
+    return elapsed, messages, sniffer.get_stats(), sniffer.get_decoder_stats()
+
+def run_pipeline(frames: list, workers: int) -> tuple:
+    '''Decode every frame in workers decoder processes, returns the elapsed time until all the messages are back,
+    the messages, the statistics and the decoder counts.'''
+    rings = [FrameRing() for _ in range(workers)]
+    results = Queue(RESULTS_QUEUE_SIZE)
+    stop = Event()
+    processes = [Process(target=decode_frames, args=(frame_ring.name, sdnids.ICSSniffer, 1, results, stop))
+                 for frame_ring in rings]
+    for process in processes:
+        process.start()
+
+    messages = []
+    stats = Counter()
+    decoder = Counter()
+    start = time()
+    for frame in frames:
+        frame_ring = rings[flow_shard(frame, workers)]
+        while not frame_ring.put(frame):                            # Wait for the decoder instead of dropping
+            sleep(0.001)
+    while sum(decoder.values()) < len(frames):
+        batch, batch_stats, batch_decoder = results.get()
+        messages.extend(message.to_dict() for message in batch)
+        stats.update(batch_stats)
+        decoder.update(batch_decoder)
+    elapsed = time() - start
+
+    stop.set()
+    for process in processes:
+        process.join()
+    for frame_ring in rings:
+        frame_ring.close(unlink=True)
+    return elapsed, messages, dict(stats), dict(decoder)
+
+def main():
+    '''Run both decoders over the capture and compare them.'''
+    if len(argv) > 1:
+        frames = [data for data, _ in RawPcapReader(argv[1])]
+        source = argv[1]
+    else:
+        frames = synthetic_capture()
+        source = 'synthetic capture'
+
+    scapy_time, scapy_messages, scapy_stats, _ = run(frames, False)
+    fast_time, fast_messages, fast_stats, decoder = run(frames, True)
+
+    mismatches = sum(1 for a, b in zip(scapy_messages, fast_messages) if a != b)
+    mismatches += abs(len(scapy_messages) - len(fast_messages))
+    print('{0:s}: {1:d} frames, {2:d} messages'.format(source, len(frames), len(fast_messages)))
+    print('{0:<10s} {1:10.0f} frames/s'.format('scapy', len(frames) / scapy_time))
+    print('{0:<10s} {1:10.0f} frames/s  {2:5.1f}x  {3:.1f}% on the fast path'.format(
+        'fast path', len(frames) / fast_time, scapy_time / fast_time, 100.0 * decoder['fast'] / len(frames)))
+    print('{0:d} messages differ, statistics {1:s}'.format(
+        mismatches, 'match' if scapy_stats == fast_stats else 'differ'))
+
+    expected = Counter(repr(message) for message in fast_messages)
+    for workers in WORKERS:
+        elapsed, messages, stats, _ = run_pipeline(frames, workers)
+        same = Counter(repr(message) for message in messages) == expected and stats == dict(fast_stats)
+        print('{0:<10s} {1:10.0f} frames/s  {2:5.1f}x  {3:s}'.format(
+            '{0:d} worker{1:s}'.format(workers, 's' if workers > 1 else ''), len(frames) / elapsed,
+            fast_time / elapsed, 'same messages' if same else 'messages differ'))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+'''
+Raw frame capture for the sniffer: an AF_PACKET socket with a classic BPF program attached, so the traffic the IDS
+does not look at is dropped in the kernel instead of crossing into Python.
+
+The filter keeps every IPv4 packet to or from TCP/UDP port 44818 (explicit messaging, ListIdentity) and UDP port
+2222 (implicit I/O), and a random sample of the other IPv4 packets for the traffic statistics. Non-IPv4 frames,
+which the sniffer does not record, are dropped.
+
+PacketCapture receives one frame per recv. RingCapture maps a TPACKET_V3 ring instead: the kernel fills whole
+blocks of frames, which are walked as memoryview slices of the ring without copying them, and handed back to the
+kernel once every frame of the block has been consumed. Both report the kernel counters of PACKET_STATISTICS, the
+drops being the frames lost because the IDS did not keep up.
+'''
+
+import ctypes
+import mmap
+from select import select
+from socket import socket, AF_PACKET, SOCK_RAW, SOL_SOCKET
+from struct import Struct, pack_into, unpack_from
+from enipdecode import ENIP_TCP_PORT, ENIP_UDP_PORT, ETH_P_IP, IPPROTO_TCP, IPPROTO_UDP
+
+ETH_P_ALL = 0x0003
+SO_ATTACH_FILTER = 26
+SNAP_LENGTH = 65535
+DEFAULT_SAMPLE = 0.1                            # Share of the non-ENIP IPv4 packets kept
+
+# linux/if_packet.h
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+
+# Ring geometry: blocks of RING_BLOCK_SIZE bytes, retired to user space when full or after RING_BLOCK_TIMEOUT ms
+RING_BLOCK_SIZE = 1 << 20
+RING_BLOCKS = 64
+RING_FRAME_SIZE = 2048
+RING_BLOCK_TIMEOUT = 100
+
+TPACKET_REQ3 = Struct('IIIIIII')                # block size/count, frame size/count, retire timeout, priv, features
+TPACKET_STATS = Struct('II')                    # packets (drops included), drops; reset by every read
+TPACKET_STATS_V3 = Struct('III')                # ... and times the queue was frozen
+BLOCK_STATUS = 8                                # Offsets in struct tpacket_block_desc
+BLOCK_PACKETS = 12
+BLOCK_FIRST = 16
+FRAME_HEADER = Struct('I8xI8xH')                # struct tpacket3_hdr: next offset, snap length, MAC header offset
+
+# Classic BPF opcodes (linux/filter.h)
+BPF_LDH_ABS = 0x28                              # A = u16 at [k]
+BPF_LDB_ABS = 0x30                              # A = u8 at [k]
+BPF_LD_ABS = 0x20                               # A = u32 at [k]
+BPF_LDH_IND = 0x48                              # A = u16 at [X + k]
+BPF_LDXB_MSH = 0xb1                             # X = 4 * ([k] & 0x0f)
+BPF_JEQ = 0x15
+BPF_JGE = 0x35
+BPF_JSET = 0x45
+BPF_RET = 0x06
+SKF_AD_RANDOM = -0x1000 + 56                    # Ancillary load of a random u32
+
+BPF_INSTRUCTION = Struct('HBBI')
+BPF_PROGRAM = Struct('HL')                      # struct sock_fprog
+
+def assemble(program: list) -> list:
+    '''Resolve the labels of program, a list of label strings and (code, jt, jf, k) tuples whose jt/jf are labels
+    or 0 for the next instruction, into sock_filter tuples.'''
+    labels = {}
+    instructions = []
+    for entry in program:
+        if isinstance(entry, str):
+            labels[entry] = len(instructions)
+        else:
+            instructions.append(entry)
+    resolved = []
+    for pc, (code, jt, jf, k) in enumerate(instructions):
+        jt = labels[jt] - pc - 1 if isinstance(jt, str) else jt
+        jf = labels[jf] - pc - 1 if isinstance(jf, str) else jf
+        resolved.append((code, jt, jf, k & 0xffffffff))
+    return resolved
+
+def compile_filter(sample: float = DEFAULT_SAMPLE) -> list:
+    '''BPF program keeping the ENIP traffic and a share sample of the other IPv4 packets.'''
+    if sample >= 1.0:
+        others = [(BPF_RET, 0, 0, SNAP_LENGTH)]
+    elif sample <= 0.0:
+        others = [(BPF_RET, 0, 0, 0)]
+    else:
+        others = [
+            (BPF_LD_ABS, 0, 0, SKF_AD_RANDOM),
+            (BPF_JGE, 'drop', 'accept', int(sample * 2 ** 32)),
+        ]
+
+    return assemble([
+        (BPF_LDH_ABS, 0, 0, 12),                            # Ethertype
+        (BPF_JEQ, 0, 'drop', ETH_P_IP),
+        (BPF_LDH_ABS, 0, 0, 20),                            # Fragment offset, only the first fragment has ports
+        (BPF_JSET, 'others', 0, 0x1fff),
+        (BPF_LDB_ABS, 0, 0, 23),                            # Protocol
+        (BPF_JEQ, 'tcp', 0, IPPROTO_TCP),
+        (BPF_JEQ, 'udp', 'others', IPPROTO_UDP),
+        'tcp',
+        (BPF_LDXB_MSH, 0, 0, 14),                           # IP header length
+        (BPF_LDH_IND, 0, 0, 14),                            # Source port
+        (BPF_JEQ, 'accept', 0, ENIP_TCP_PORT),
+        (BPF_LDH_IND, 0, 0, 16),                            # Destination port
+        (BPF_JEQ, 'accept', 'others', ENIP_TCP_PORT),
+        'udp',
+        (BPF_LDXB_MSH, 0, 0, 14),
+        (BPF_LDH_IND, 0, 0, 14),
+        (BPF_JEQ, 'accept', 0, ENIP_TCP_PORT),
+        (BPF_JEQ, 'accept', 0, ENIP_UDP_PORT),
+        (BPF_LDH_IND, 0, 0, 16),
+        (BPF_JEQ, 'accept', 0, ENIP_TCP_PORT),
+        (BPF_JEQ, 'accept', 'others', ENIP_UDP_PORT),
+        'others',
+    ] + others + [
+        'accept',
+        (BPF_RET, 0, 0, SNAP_LENGTH),
+        'drop',
+        (BPF_RET, 0, 0, 0),
+    ])
+
+def is_sampled(proto: int, sport: int, dport: int) -> bool:
+    '''Whether compile_filter only keeps a sample of the IPv4 packets of proto between these ports (None unless TCP
+    or UDP).'''
+    if proto == IPPROTO_TCP:
+        return ENIP_TCP_PORT not in (sport, dport)
+    if proto == IPPROTO_UDP:
+        return not {ENIP_TCP_PORT, ENIP_UDP_PORT} & {sport, dport}
+    return True
+
+def open_socket(sample: float) -> socket:
+    '''Unbound AF_PACKET socket with the filter of compile_filter(sample) attached.'''
+    # Protocol 0 receives nothing until bound, so no frame gets in before the filter
+    sock = socket(AF_PACKET, SOCK_RAW, 0)
+    program = compile_filter(sample)
+    instructions = ctypes.create_string_buffer(b''.join(BPF_INSTRUCTION.pack(*i) for i in program))
+    sock.setsockopt(SOL_SOCKET, SO_ATTACH_FILTER, BPF_PROGRAM.pack(len(program), ctypes.addressof(instructions)))
+    return sock
+
+class PacketCapture():
+    '''AF_PACKET socket on an interface, receiving the frames kept by compile_filter(sample).'''
+
+    STATS = TPACKET_STATS
+
+    def __init__(self, iface: str, sample: float = DEFAULT_SAMPLE):
+        self._sock = open_socket(sample)
+        self._setup()
+        self._sock.bind((iface, ETH_P_ALL))
+        self.__stats = {'packets': 0, 'drops': 0, 'freeze_q_cnt': 0}
+
+    def _setup(self):
+        '''Socket options to be set before binding.'''
+        pass
+
+    def fileno(self) -> int:
+        '''File descriptor, for select.'''
+        return self._sock.fileno()
+
+    def frames(self, timeout: float):
+        '''Generator of the frames received within timeout seconds.'''
+        if select([self._sock], [], [], timeout)[0]:
+            yield self._sock.recv(SNAP_LENGTH)
+
+    def stats(self) -> dict:
+        '''Kernel counters since the socket was opened: frames that passed the filter and the ones dropped.'''
+        counters = self.STATS.unpack(self._sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, self.STATS.size))
+        for key, value in zip(('packets', 'drops', 'freeze_q_cnt'), counters):
+            self.__stats[key] += value
+        return dict(self.__stats)
+
+    def close(self):
+        '''Close the socket.'''
+        self._sock.close()
+
+class RingCapture(PacketCapture):
+    '''PacketCapture receiving through a memory-mapped TPACKET_V3 ring. The frames are memoryview slices of the
+    ring, only valid until the next frame is requested.'''
+
+    STATS = TPACKET_STATS_V3
+
+    def __init__(self, iface: str, sample: float = DEFAULT_SAMPLE, block_size: int = RING_BLOCK_SIZE,
+                 blocks: int = RING_BLOCKS):
+        self.__block_size = block_size
+        self.__blocks = blocks
+        self.__block = 0                                            # Next block to be read
+        self.__ring = None
+        self.__view = None
+        PacketCapture.__init__(self, iface, sample)
+
+    def _setup(self):
+        self._sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+        self._sock.setsockopt(SOL_PACKET, PACKET_RX_RING, TPACKET_REQ3.pack(
+            self.__block_size, self.__blocks, RING_FRAME_SIZE, self.__block_size // RING_FRAME_SIZE * self.__blocks,
+            RING_BLOCK_TIMEOUT, 0, 0))
+        self.__ring = mmap.mmap(self._sock.fileno(), self.__block_size * self.__blocks, mmap.MAP_SHARED,
+                                mmap.PROT_READ | mmap.PROT_WRITE)
+        self.__view = memoryview(self.__ring)
+
+    def frames(self, timeout: float):
+        '''Generator of the frames of the next block retired by the kernel within timeout seconds.'''
+        block = self.__block * self.__block_size
+        if not unpack_from('I', self.__ring, block + BLOCK_STATUS)[0] & TP_STATUS_USER:
+            select([self._sock], [], [], timeout)
+            if not unpack_from('I', self.__ring, block + BLOCK_STATUS)[0] & TP_STATUS_USER:
+                return
+
+        try:
+            frame = block + unpack_from('I', self.__ring, block + BLOCK_FIRST)[0]
+            for _ in range(unpack_from('I', self.__ring, block + BLOCK_PACKETS)[0]):
+                next_offset, snap_length, mac = FRAME_HEADER.unpack_from(self.__ring, frame)
+                yield self.__view[frame + mac:frame + mac + snap_length]
+                frame += next_offset
+        finally:
+            pack_into('I', self.__ring, block + BLOCK_STATUS, TP_STATUS_KERNEL)
+            self.__block = (self.__block + 1) % self.__blocks
+
+    def close(self):
+        '''Unmap the ring and close the socket.'''
+        self.__view.release()
+        try:
+            self.__ring.close()
+        except BufferError:                                         # A frame is still referenced, left to the GC
+            pass
+        self._sock.close()
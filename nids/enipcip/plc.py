@@ -84,8 +84,8 @@ class PLCClient(object):
         self.send_rr_cip(cippkt)
 
     def send_rr_mr_cip(self, cippkt):
-        """Encapsulate the CIP packet into a MultipleServicePacket to MessageRouter"""
-        cipcm_msg = [cippkt]
+        """Encapsulate the CIP packet, or a list of them, into a MultipleServicePacket to MessageRouter"""
+        cipcm_msg = cippkt if isinstance(cippkt, list) else [cippkt]
         cippkt = CIP(path=CIP_Path(wordsize=2, path=b'\x20\x02\x24\x01'))
         cippkt /= CIP_MultipleServicePacket(packets=cipcm_msg)
         self.send_rr_cip(cippkt)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+'''
+Fast-path decoder for the frames seen by the sniffer.
+
+Parses Ethernet, IPv4, TCP/UDP, the Ethernet/IP encapsulation header, the CPF items of SendRRData and the CIP
+response status straight from the raw bytes with precompiled structs, reading the same fields the scapy dissectors
+of enipcip would. Frames it can not decode exactly as scapy would (VLAN tags, IPv6, IP fragments, truncated
+headers, CIP services with a response layer of their own, ...) raise Unsupported, so the caller falls back to
+scapy for them.
+'''
+
+from collections import namedtuple
+from struct import Struct
+
+ETHERNET = Struct('!6s6sH')
+IPV4 = Struct('!BxHHHxB2xII')                 # version/IHL, total length, id, flags/fragment, protocol, addresses
+PORTS = Struct('!HH')
+UDP_LENGTH = Struct('!H')
+ENIP_HEADER = Struct('<HH20x')                  # command, length; session, status, context and options skipped
+SEND_RR_DATA = Struct('<6xH')                   # item count; interface handle and timeout skipped
+CPF_ITEM = Struct('<HH')
+
+ETHERNET_LENGTH = ETHERNET.size
+
+ETH_P_IP = 0x0800
+# Ethertypes which never carry IPv4, anything else but IPv4 goes to scapy
+ETH_NO_IP = frozenset((0x0806, 0x8035, 0x88cc))    # ARP, RARP, LLDP
+
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+
+ENIP_TCP_PORT = 44818
+ENIP_UDP_PORT = 2222
+ENIP_SEND_RR_DATA = 0x006f
+CPF_CONNECTED_PACKET = 0x00b1
+CPF_UNCONNECTED_MESSAGE = 0x00b2
+
+# CIP services bound to a response layer in enipcip.cip, their data is not left as Raw
+CIP_RESPONSE_LAYERS = frozenset((0x01, 0x03, 0x0a, 0x0e, 0x54))
+
+Decoded = namedtuple('Decoded', [
+    'src_mac',          # Addresses as integers
+    'dst_mac',
+    'src_ip',
+    'dst_ip',
+    'proto',            # IP protocol number
+    'sport',            # None unless TCP or UDP
+    'dport',
+    'is_enip',          # ENIP_TCP or ENIP_UDP layer present
+    'command',          # Encapsulation command of an ENIP_TCP layer, None for any other packet
+    'cip_data',         # Data after the CIP status of a SendRRData response, None for any other packet
+    'ip_payload',
+])
+
+class Unsupported(Exception):
+    '''The frame needs the full scapy dissection.'''
+    pass
+
+def decode(frame: bytes) -> Decoded:
+    '''Decode a raw Ethernet frame.
+
+    Returns None for frames without IPv4, which the sniffer does not record, and raises Unsupported for the frames
+    to be dissected with scapy instead.'''
+    if len(frame) < ETHERNET_LENGTH + 20:
+        raise Unsupported
+    ethertype = ETHERNET.unpack_from(frame)[2]
+    if ethertype != ETH_P_IP:
+        if ethertype in ETH_NO_IP:
+            return None
+        raise Unsupported
+
+    version_ihl, total_length, _, fragment, proto, src_ip, dst_ip = IPV4.unpack_from(frame, ETHERNET_LENGTH)
+    start = ETHERNET_LENGTH + (version_ihl & 0x0f) * 4
+    end = ETHERNET_LENGTH + total_length
+    if version_ihl >> 4 != 4 or fragment & 0x3fff or start < ETHERNET_LENGTH + 20 or end < start or end > len(frame):
+        raise Unsupported
+
+    sport = dport = command = cip_data = None
+    is_enip = False
+    if proto == IPPROTO_TCP:
+        if end - start < 20:
+            raise Unsupported
+        sport, dport = PORTS.unpack_from(frame, start)
+        data = start + (frame[start + 12] >> 4) * 4
+        if data < start + 20 or data > end:
+            raise Unsupported
+        if data < end and ENIP_TCP_PORT in (sport, dport):
+            is_enip = True
+            cip_data = _send_rr_data_response(frame, data, end)
+            command = ENIP_HEADER.unpack_from(frame, data)[0]        # Complete, or Unsupported was raised
+    elif proto == IPPROTO_UDP:
+        if end - start < 8:
+            raise Unsupported
+        sport, dport = PORTS.unpack_from(frame, start)
+        length = UDP_LENGTH.unpack_from(frame, start + 4)[0]
+        is_enip = sport == dport == ENIP_UDP_PORT and min(start + length, end) > start + 8
+
+    return Decoded(int.from_bytes(frame[6:12], 'big'), int.from_bytes(frame[0:6], 'big'), src_ip, dst_ip, proto,
+                   sport, dport, is_enip, command, cip_data, frame[start:end])
+
+def _send_rr_data_response(frame: bytes, offset: int, end: int) -> bytes:
+    '''CIP response data of the SendRRData in frame[offset:end], None if it is not one.'''
+    if end - offset < ENIP_HEADER.size:
+        raise Unsupported
+    command, length = ENIP_HEADER.unpack_from(frame, offset)
+    offset += ENIP_HEADER.size
+    end = min(offset + length, end)
+    if command != ENIP_SEND_RR_DATA or offset == end:
+        return None
+
+    # The second CPF item carries the CIP message
+    if end - offset < SEND_RR_DATA.size or SEND_RR_DATA.unpack_from(frame, offset)[0] < 2:
+        raise Unsupported
+    offset += SEND_RR_DATA.size
+    for _ in range(2):
+        if end - offset < CPF_ITEM.size:
+            raise Unsupported
+        item_type, length = CPF_ITEM.unpack_from(frame, offset)
+        item = offset + CPF_ITEM.size
+        offset = item + length
+    item_end = min(offset, end)
+
+    if item_type == CPF_CONNECTED_PACKET:
+        item += 2                                   # Sequence count
+    elif item_type != CPF_UNCONNECTED_MESSAGE:
+        raise Unsupported
+    if item >= item_end:
+        raise Unsupported
+    if not frame[item] & 0x80:                      # Request
+        return None
+
+    # Reserved, general status, size of the additional status in words, additional status
+    if item_end - item < 4 or frame[item] & 0x7f in CIP_RESPONSE_LAYERS:
+        raise Unsupported
+    data = item + 4 + 2 * frame[item + 3]
+    if data >= item_end:
+        raise Unsupported
+    return frame[data:item_end]
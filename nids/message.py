@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+'''
+Compact records of the messages queued by the sniffer.
+
+A SniffedMessage keeps the addresses as integers, the ports, the ENIP command, the CIP type code, value and data of
+a SendRRData response, and for any other packet the position of its IP payload in the payload arena of the process,
+a ring of bytes shared by every message. The nested dictionaries the sniffer used to queue are only built by
+to_dict, when a message is displayed.
+
+The arena holds QUEUE_LENGTH payloads of a 1500 byte MTU, as many as a sniffer queues, in an anonymous mapping whose
+pages only take memory once written. It overwrites the oldest payloads once full, so only payloads larger than the
+MTU (captured before segmentation offload) can evict the payload of a message still queued, which then comes back as
+None. Pickled messages carry their payload, which is stored in the arena of the process unpickling them.
+'''
+
+import mmap
+from binascii import hexlify
+from socket import inet_aton, inet_ntoa
+from struct import Struct
+from threading import Lock
+
+QUEUE_LENGTH = 65536                            # Messages queued by a sniffer
+MTU_PAYLOAD = 1480                              # IP payload of a 1500 byte MTU
+ARENA_SIZE = QUEUE_LENGTH * MTU_PAYLOAD         # Bytes of IP payloads kept
+
+IPV4_ADDRESS = Struct('!I')
+MAC_FORMAT = ':'.join(['%02X'] * 6)
+
+# CIP elementary data types, as named by ICSSniffer.read_cip_tag
+CIP_TYPES = {
+    0xc1: 'bool',
+    0xc2: 'sint',
+    0xc3: 'int',
+    0xc4: 'dint',
+    0xc5: 'lint',
+    0xc6: 'usint',
+    0xc7: 'uint',
+    0xc8: 'udint',
+    0xc9: 'ulint',
+    0xca: 'real',
+    0xcb: 'lreal',
+}
+
+def mac_to_int(mac: str) -> int:
+    '''Integer of a colon separated MAC address.'''
+    return int(mac.replace(':', ''), 16)
+
+def ip_to_int(ip: str) -> int:
+    '''Integer of a dotted IPv4 address.'''
+    return IPV4_ADDRESS.unpack(inet_aton(ip))[0]
+
+def int_to_ip(ip: int) -> str:
+    '''Dotted IPv4 address of an integer.'''
+    return inet_ntoa(IPV4_ADDRESS.pack(ip))
+
+class PayloadArena():
+    '''Ring of payload bytes, addressed by the position they were written at since the arena was created.'''
+
+    def __init__(self, size: int = ARENA_SIZE):
+        self.__data = mmap.mmap(-1, size, flags=mmap.MAP_PRIVATE)     # Not shared with forked processes
+        self.__size = size
+        self.__written = 0                                          # Bytes written, skipped ends of the ring included
+        self.__lock = Lock()                                        # Every sniffer thread of the process stores here
+
+    def put(self, data: bytes) -> int:
+        '''Store data, returns its position.'''
+        length = len(data)
+        if length > self.__size:
+            raise ValueError('Payload of {0:d} bytes larger than the arena'.format(length))
+        with self.__lock:
+            offset = self.__written % self.__size
+            if offset + length > self.__size:                       # Does not fit before the end, start over
+                self.__written += self.__size - offset
+                offset = 0
+            self.__data[offset:offset + length] = data
+            position = self.__written
+            self.__written += length
+        return position
+
+    def get(self, position: int, length: int) -> bytes:
+        '''The data stored at position, None once it has been overwritten.'''
+        offset = position % self.__size
+        data = self.__data[offset:offset + length]
+        # Checked after the copy, a payload overwritten meanwhile is not returned half old, half new
+        if position < self.__written - self.__size:
+            return None
+        return data
+
+ARENA = PayloadArena()
+
+class SniffedMessage():
+    '''Message queued by the sniffer for an IPv4 packet. command is the encapsulation command of an ENIP packet over
+    TCP (SendRRData, SendUnitData, ListIdentity, ...), None for any other packet. cip_type is the CIP type code of a
+    SendRRData response,
+    value the value read_cip_tag decoded from it (None if the type is not supported) and cip_data its CIP data, kept
+    in the message; all three are None for any other packet, whose IP payload is in the arena. sport and dport are
+    None unless TCP or UDP.'''
+
+    __slots__ = ('src_mac', 'dst_mac', 'src_ip', 'dst_ip', 'proto', 'sport', 'dport', 'is_enip', 'command',
+                 'cip_type', 'value', 'cip_data', 'position', 'length')
+
+    def __init__(self, src_mac: int, dst_mac: int, src_ip: int, dst_ip: int, proto: int, sport: int, dport: int,
+                 is_enip: bool, command: int, cip_type: int, value, payload: bytes):
+        self.src_mac = src_mac
+        self.dst_mac = dst_mac
+        self.src_ip = src_ip
+        self.dst_ip = dst_ip
+        self.proto = proto
+        self.sport = sport
+        self.dport = dport
+        self.is_enip = is_enip
+        self.command = command
+        self.cip_type = cip_type
+        self.value = value
+        if cip_type is not None:
+            self.cip_data = bytes(payload)
+            self.position = self.length = None
+        else:
+            self.cip_data = None
+            self.position = ARENA.put(payload)
+            self.length = len(payload)
+
+    @property
+    def payload(self) -> bytes:
+        '''CIP data of a SendRRData response, IP payload of any other packet. None once overwritten in the arena.'''
+        if self.cip_type is not None:
+            return self.cip_data
+        return ARENA.get(self.position, self.length)
+
+    def to_dict(self) -> dict:
+        '''The message as the sniffer used to queue it: addresses under 'src' and 'dst', and either the hexlified
+        CIP data and the decoded tag ('rawdata', 'data') of a response or the IP payload bytes ('rawippayload').'''
+        message = {}
+        message['is_enip'] = self.is_enip
+        message['command'] = self.command
+        message['src'] = {'MAC': MAC_FORMAT % tuple(self.src_mac.to_bytes(6, 'big')), 'IP': int_to_ip(self.src_ip)}
+        message['dst'] = {'MAC': MAC_FORMAT % tuple(self.dst_mac.to_bytes(6, 'big')), 'IP': int_to_ip(self.dst_ip)}
+        if self.cip_type is not None:
+            message['rawdata'] = hexlify(self.cip_data).decode('utf-8')
+            message['data'] = {'type': CIP_TYPES[self.cip_type], 'value': self.value} \
+                if self.cip_type in CIP_TYPES else None
+        else:
+            message['rawippayload'] = self.payload
+        return message
+
+    def __getstate__(self):
+        return (self.src_mac, self.dst_mac, self.src_ip, self.dst_ip, self.proto, self.sport, self.dport, self.is_enip,
+                self.command, self.cip_type, self.value, self.payload or b'')
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __repr__(self):
+        return 'SniffedMessage({0!r})'.format(self.to_dict())
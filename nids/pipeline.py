@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+'''
+Multi-process capture and decode pipeline for the sniffer.
+
+One capture process reads the frames kept by the kernel filter (capture.PacketCapture or capture.RingCapture) and
+copies each one into the shared-memory FrameRing of a decoder process, chosen by a hash of its flow that is the same
+in both directions, so the messages of a flow keep their order. Each decoder process runs the decoding of an
+ICSSniffer (enipdecode fast path, Scapy fallback) and sends its messages, traffic statistics and decoder counts back
+in batches through a queue, which the consumer merges. Decoding thus runs on as many cores as there are decoders,
+outside of the GIL of the consumer.
+
+A FrameRing is a single producer, single consumer byte ring: frames are written as a 4 byte length followed by the
+frame, aligned to 8 bytes, with a marker where a frame does not fit before the end of the ring. The producer
+publishes its write position after the frame (x86 keeps stores in order), the consumer its read position after
+decoding it. A frame that does not fit in the free space is dropped and counted, the capture never waits for the
+decoders.
+'''
+
+import signal
+from multiprocessing import Array, Event, Process, Queue
+from multiprocessing.shared_memory import SharedMemory
+from queue import Empty
+from struct import Struct, pack_into, unpack_from
+from time import sleep, time
+from capture import PacketCapture, RingCapture
+from enipdecode import ETH_P_IP, IPPROTO_TCP, IPPROTO_UDP
+
+RING_CAPACITY = 16 << 20                        # Bytes of frames per decoder
+RESULTS_QUEUE_SIZE = 64                         # Batches waiting for the consumer
+BATCH_FRAMES = 512                              # Frames decoded per batch at most ...
+BATCH_INTERVAL = 0.05                           # ... or seconds between batches
+POLL_INTERVAL = 0.001                           # Sleep of an idle decoder
+STATS_INTERVAL = 1.0                            # Seconds between updates of the kernel counters
+
+# FrameRing layout: the positions written by each side on their own cache line, then the frames
+WRITE_POSITION = 0
+DROPPED = 8
+CAPACITY = 16
+READ_POSITION = 64
+DATA = 128
+COUNTER = Struct('Q')
+LENGTH = Struct('I')
+WRAP = 0xffffffff
+
+ETHERTYPE = Struct('!H')
+ADDRESSES = Struct('!II')
+PORTS = Struct('!HH')
+
+def flow_shard(frame: bytes, shards: int) -> int:
+    '''Shard of the flow of frame, the same for both directions. Frames without IPv4 go to the first one.'''
+    if len(frame) < 34 or ETHERTYPE.unpack_from(frame, 12)[0] != ETH_P_IP:
+        return 0
+    src, dst = ADDRESSES.unpack_from(frame, 26)
+    flow = src ^ dst
+    ports = 14 + (frame[14] & 0x0f) * 4
+    if frame[23] in (IPPROTO_TCP, IPPROTO_UDP) and len(frame) >= ports + 4:
+        sport, dport = PORTS.unpack_from(frame, ports)
+        flow ^= sport ^ dport
+    return (((flow * 0x9e3779b1) & 0xffffffff) >> 16) % shards
+
+class FrameRing():
+    '''Shared-memory ring of frames from one process to another. Created with a capacity, or attached by name.'''
+
+    def __init__(self, capacity: int = RING_CAPACITY, name: str = None):
+        if name is None:
+            capacity &= ~7
+            self.__shm = SharedMemory(create=True, size=DATA + capacity)
+            pack_into('QQQ', self.__shm.buf, WRITE_POSITION, 0, 0, capacity)
+            COUNTER.pack_into(self.__shm.buf, READ_POSITION, 0)
+        else:
+            self.__shm = SharedMemory(name=name)
+        self.__buf = self.__shm.buf
+        self.__capacity = COUNTER.unpack_from(self.__buf, CAPACITY)[0]
+        self.__write = COUNTER.unpack_from(self.__buf, WRITE_POSITION)[0]
+        self.__read = COUNTER.unpack_from(self.__buf, READ_POSITION)[0]
+        self.__dropped = COUNTER.unpack_from(self.__buf, DROPPED)[0]
+
+    @property
+    def name(self) -> str:
+        '''Name to attach to the ring from another process.'''
+        return self.__shm.name
+
+    def dropped(self) -> int:
+        '''Frames the producer dropped because the ring was full.'''
+        return COUNTER.unpack_from(self.__buf, DROPPED)[0]
+
+    def put(self, frame: bytes) -> bool:
+        '''Append frame, False if it was dropped. Producer side.'''
+        length = len(frame)
+        need = (LENGTH.size + length + 7) & ~7
+        offset = self.__write % self.__capacity
+        skip = self.__capacity - offset if self.__capacity - offset < need else 0
+        if self.__write + skip + need - COUNTER.unpack_from(self.__buf, READ_POSITION)[0] > self.__capacity:
+            self.__dropped += 1
+            COUNTER.pack_into(self.__buf, DROPPED, self.__dropped)
+            return False
+
+        if skip:
+            LENGTH.pack_into(self.__buf, DATA + offset, WRAP)
+            self.__write += skip
+            offset = 0
+        start = DATA + offset + LENGTH.size
+        LENGTH.pack_into(self.__buf, DATA + offset, length)
+        self.__buf[start:start + length] = frame
+        self.__write += need
+        COUNTER.pack_into(self.__buf, WRITE_POSITION, self.__write)
+        return True
+
+    def frames(self, limit: int):
+        '''Generator of up to limit frames written so far, as memoryview slices released once the next one is
+        requested. Consumer side.'''
+        write = COUNTER.unpack_from(self.__buf, WRITE_POSITION)[0]
+        while self.__read < write and limit > 0:
+            offset = self.__read % self.__capacity
+            length = LENGTH.unpack_from(self.__buf, DATA + offset)[0]
+            if length == WRAP:
+                self.__read += self.__capacity - offset
+                continue
+            start = DATA + offset + LENGTH.size
+            frame = self.__buf[start:start + length]
+            yield frame
+            frame.release()
+            limit -= 1
+            self.__read += (LENGTH.size + length + 7) & ~7
+            COUNTER.pack_into(self.__buf, READ_POSITION, self.__read)
+
+    def close(self, unlink: bool = False):
+        '''Detach from the ring, and remove it with unlink.'''
+        self.__buf = None
+        try:
+            self.__shm.close()
+        except BufferError:                                         # A frame is still referenced, left to the GC
+            pass
+        if unlink:
+            self.__shm.unlink()
+
+def capture_frames(iface: str, sample: float, ring: bool, names: list, kernel: Array, stop: Event):
+    '''Capture process: spreads the captured frames over the rings names by flow, and keeps kernel up to date with
+    the kernel counters of the capture socket.'''
+    signal.signal(signal.SIGINT, signal.SIG_IGN)                    # The consumer stops the pipeline
+    rings = [FrameRing(name=name) for name in names]
+    sock = (RingCapture if ring else PacketCapture)(iface, sample)
+    updated = time()
+    try:
+        while not stop.is_set():
+            for frame in sock.frames(0.1):
+                rings[flow_shard(frame, len(rings))].put(frame)
+            if time() - updated >= STATS_INTERVAL:
+                kernel[:] = [value for _, value in sorted(sock.stats().items())]
+                updated = time()
+    finally:
+        sock.close()
+        for frame_ring in rings:
+            frame_ring.close()
+
+def decode_frames(name: str, decoder: type, sample: float, results: Queue, stop: Event):
+    '''Decoder process: decodes the frames of the ring name with decoder('', sample), an ICSSniffer which is never
+    started, and puts (messages, statistics, decoder counts) batches on results.'''
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    results.cancel_join_thread()                                    # Do not wait on exit for a consumer that is gone
+    frame_ring = FrameRing(name=name)
+    sniffer = decoder('', sample)
+    sent = sniffer.get_decoder_stats()
+    batched = 0
+    flushed = time()
+    try:
+        while not stop.is_set():
+            idle = True
+            for frame in frame_ring.frames(BATCH_FRAMES - batched):
+                sniffer.handle_frame(frame)
+                idle = False
+                batched += 1
+            if batched and (batched >= BATCH_FRAMES or time() - flushed >= BATCH_INTERVAL):
+                messages = [sniffer.pop() for _ in range(sniffer.size())]
+                counts = sniffer.get_decoder_stats()
+                results.put((messages, dict(sniffer.get_stats()),
+                             {key: counts[key] - sent[key] for key in counts}))
+                sent = counts
+                batched = 0
+                flushed = time()
+            elif idle:
+                sleep(POLL_INTERVAL)
+    finally:
+        frame_ring.close()
+
+class Pipeline():
+    '''Capture process and workers decoder processes, see the module documentation. decoder is the ICSSniffer
+    class whose decoding the workers run.'''
+
+    def __init__(self, iface: str, sample: float, ring: bool, workers: int, decoder: type,
+                 capacity: int = RING_CAPACITY):
+        self.__stop = Event()
+        self.__results = Queue(RESULTS_QUEUE_SIZE)
+        self.__kernel = Array('Q', 3)                               # drops, freeze_q_cnt, packets
+        self.__rings = [FrameRing(capacity) for _ in range(workers)]
+        self.__processes = [Process(target=decode_frames, name='decoder{0:d}'.format(i), daemon=True,
+                                    args=(frame_ring.name, decoder, sample, self.__results, self.__stop))
+                            for i, frame_ring in enumerate(self.__rings)]
+        self.__processes.append(Process(target=capture_frames, name='capture', daemon=True, args=(
+            iface, sample, ring, [frame_ring.name for frame_ring in self.__rings], self.__kernel, self.__stop)))
+        for process in self.__processes:
+            process.start()
+
+    def results(self, timeout: float):
+        '''Generator of the (messages, statistics, decoder counts) batches decoded within timeout seconds.'''
+        try:
+            yield self.__results.get(timeout=timeout)
+            while True:
+                yield self.__results.get_nowait()
+        except Empty:
+            pass
+
+    def stats(self) -> dict:
+        '''Kernel counters of the capture socket, as of the last update, and the frames dropped because a ring
+        was full.'''
+        drops, freeze_q_cnt, packets = self.__kernel[:]
+        return {'packets': packets, 'drops': drops, 'freeze_q_cnt': freeze_q_cnt,
+                'ring_drops': sum(frame_ring.dropped() for frame_ring in self.__rings)}
+
+    def close(self):
+        '''Stop the processes and remove the rings.'''
+        self.__stop.set()
+        for process in self.__processes:
+            process.join(2)
+            if process.is_alive():
+                process.terminate()
+        for frame_ring in self.__rings:
+            frame_ring.close(unlink=True)
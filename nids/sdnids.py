@@ -5,14 +5,13 @@ An additional class that provides some basic CLI is also implemented.
 '''
 
 from struct import unpack
-from binascii import hexlify
 from os import geteuid
 from threading import Thread, Event
 from collections import deque, OrderedDict
 from sys import stdout
 from cmd import Cmd
 from json import load, loads
-from scapy.all import sniff, Packet
+from scapy.all import Ether, Packet
 from scapy.data import IP_PROTOS
 from scapy.layers.inet import IP, TCP, UDP
 import requests
@@ -20,6 +19,10 @@ from requests.auth import HTTPBasicAuth
 from enipcip.enip_tcp import ENIP_TCP, ENIP_SendRRData
 from enipcip.enip_udp import ENIP_UDP
 from enipcip.cip import CIP # pylint: disable=W0611
+import enipdecode
+from capture import PacketCapture, RingCapture, DEFAULT_SAMPLE, is_sampled
+from pipeline import Pipeline
+from message import QUEUE_LENGTH, SniffedMessage, int_to_ip, ip_to_int, mac_to_int
 
 CONTROLLER_IP = '192.168.56.50'
 CONTROLLER_PORT = 6633
@@ -35,7 +38,14 @@ class ICSSniffer(Thread):
     '''This class executes as a separate thread and is intended to read up to 65536 Ethernet/IP messages.
 
     Upon execution, this class will start a network sniffer using Scapy and it will capture every 'SendRRData'
-    message, extracting the data being sent and storing the message in a buffer.'''
+    message, extracting the data being sent and storing the message in a buffer, as a message.SniffedMessage.
+    Frames are decoded by the enipdecode fast path, only the ones it does not support are dissected by Scapy.
+
+    Frames are captured by a capture.PacketCapture, or a capture.RingCapture with ring set, whose kernel filter
+    keeps the ENIP traffic and only a share sample of the other IPv4 packets; each of those counts as 1/sample
+    packets in the statistics.
+    With workers, capture and decoding run in a pipeline.Pipeline of that many decoder processes instead, and this
+    thread only merges the messages and statistics they send back.'''
 
     ENIP_COMMANDS = {
         0x0000: 'NOP',
@@ -72,13 +82,19 @@ class ICSSniffer(Thread):
         0x8002: 'Sequenced Address item'
     }
 
-    def __init__(self, interface: str):
+    def __init__(self, interface: str, sample: float = DEFAULT_SAMPLE, ring: bool = False, workers: int = 0):
         Thread.__init__(self)
         self.setName('sniffer')                                 # Thread name
         self.should_stop = Event()                              # Interrupt event
         self.__iface = interface                                # The network interface in which the sniffer will be started
-        self.__messages = deque(iterable=[], maxlen=65536)      # Message queue
+        self.__sample = sample                                  # Share of the non-ENIP IPv4 packets captured
+        self.__weight = 1 / sample if 0 < sample < 1 else 1     # Packets a sampled one stands for
+        self.__ring = ring                                      # Capture through a TPACKET_V3 ring
+        self.__workers = workers                                # Decoder processes, 0 to decode in this thread
+        self.__capture = None                                   # The capture socket, while running
+        self.__messages = deque(iterable=[], maxlen=QUEUE_LENGTH)   # Message queue, of SniffedMessage
         self.__packet_stats = {}                                # IP traffic statistics
+        self.__decoder_stats = {'fast': 0, 'scapy': 0}          # Frames decoded by each path
 
     @staticmethod
     def read_cip_tag(tagtype: int, tagdata: bytes) -> dict:
@@ -146,18 +162,19 @@ class ICSSniffer(Thread):
     def __handle_pkt(self, packet: Packet) -> str:
         '''Callback method to be executed by Scapy for every sniffed packet.'''
         stat_key = None
-        message = {}
-        message['is_enip'] = packet.haslayer(ENIP_TCP) or packet.haslayer(ENIP_UDP)
+        is_enip = bool(packet.haslayer(ENIP_TCP) or packet.haslayer(ENIP_UDP))
+        command = packet['ENIP_TCP'].command_id if packet.haslayer(ENIP_TCP) else None
+        if packet.haslayer(IP):
+            addresses = (mac_to_int(packet['Ethernet'].src), mac_to_int(packet['Ethernet'].dst),
+                         ip_to_int(packet['IP'].src), ip_to_int(packet['IP'].dst), packet['IP'].proto)
+            transport = packet['TCP'] if packet.haslayer(TCP) else packet['UDP'] if packet.haslayer(UDP) else None
+            ports = (transport.sport, transport.dport) if transport is not None else (None, None)
         if packet.haslayer(ENIP_SendRRData) and packet['ENIP_SendRRData'].items[1]['CIP'].direction == 1: # Response
-            message['src'] = {}
-            message['dst'] = {}
-            message['src']['MAC'] = str.upper(packet['Ethernet'].src)
-            message['dst']['MAC'] = str.upper(packet['Ethernet'].dst)
-            message['src']['IP'] = packet['IP'].src
-            message['dst']['IP'] = packet['IP'].dst
-            message['rawdata'] = bytes(packet['ENIP_SendRRData'].items[1]['Raw'])
-            message['data'] = self.read_cip_tag(message['rawdata'][0], message['rawdata'][2:])
-            message['rawdata'] = hexlify(message['rawdata']).decode('utf-8')
+            rawdata = bytes(packet['ENIP_SendRRData'].items[1]['Raw'])
+            data = self.read_cip_tag(rawdata[0], rawdata[2:])
+            message = SniffedMessage(*addresses, *ports, is_enip, command, rawdata[0],
+                                     data['value'] if data is not None else None, rawdata)
+            self.__messages.append(message)
             if packet.haslayer(TCP):
                 stat_key = '{0:s}:{1:d}/{2:s}:{3:d}/TCP'.format(
                     packet['IP'].src,
@@ -172,15 +189,10 @@ class ICSSniffer(Thread):
                     packet['IP'].dst,
                     packet['UDP'].dport
                 )
-            self.__messages.append(message)
         elif packet.haslayer(IP):
-            message['src'] = {}
-            message['dst'] = {}
-            message['src']['MAC'] = str.upper(packet['Ethernet'].src)
-            message['dst']['MAC'] = str.upper(packet['Ethernet'].dst)
-            message['src']['IP'] = packet['IP'].src
-            message['dst']['IP'] = packet['IP'].dst
-            message['rawippayload'] = packet['IP'].payload
+            message = SniffedMessage(*addresses, *ports, is_enip, command, None, None,
+                                     bytes(packet['IP'].payload))
+            self.__messages.append(message)
             if packet.haslayer('TCP'):
                 stat_key = '{0:s}:{1:d}/{2:s}:{3:d}/TCP'.format(
                     packet['IP'].src,
@@ -201,25 +213,85 @@ class ICSSniffer(Thread):
                     packet['IP'].dst,
                     LOCAL_PROTOS[packet['IP'].proto]
                 )
-            self.__messages.append(message)
         if stat_key is not None:
             if stat_key in self.__packet_stats.keys():
-                self.__packet_stats[stat_key] += 1
+                self.__packet_stats[stat_key] += self.weight(message)
             else:
-                self.__packet_stats[stat_key] = 1
+                self.__packet_stats[stat_key] = self.weight(message)
         return None
 
+    def handle_frame(self, frame: bytes, fast: bool = True):
+        '''Decode a raw Ethernet frame (bytes or a memoryview, not kept) with the fast path, or with Scapy when the
+        fast path can not (or fast is False).'''
+        if fast:
+            try:
+                decoded = enipdecode.decode(frame)
+            except enipdecode.Unsupported:
+                pass
+            else:
+                self.__decoder_stats['fast'] += 1
+                if decoded is not None:
+                    self.__handle_decoded(decoded)
+                return
+        self.__decoder_stats['scapy'] += 1
+        self.__handle_pkt(Ether(bytes(frame)))
+
+    def __handle_decoded(self, decoded: enipdecode.Decoded):
+        '''Same as __handle_pkt, for a frame decoded by the fast path.'''
+        if decoded.cip_data is not None: # SendRRData response
+            cip_type = decoded.cip_data[0]
+            data = self.read_cip_tag(cip_type, decoded.cip_data[2:])
+            value = data['value'] if data is not None else None
+            payload = decoded.cip_data
+        else:
+            cip_type, value, payload = None, None, decoded.ip_payload
+        message = SniffedMessage(decoded.src_mac, decoded.dst_mac, decoded.src_ip, decoded.dst_ip, decoded.proto,
+                                 decoded.sport, decoded.dport, decoded.is_enip, decoded.command, cip_type, value,
+                                 payload)
+        self.__messages.append(message)
+        if decoded.sport is not None:
+            stat_key = '{0:s}:{1:d}/{2:s}:{3:d}/{4:s}'.format(
+                int_to_ip(decoded.src_ip),
+                decoded.sport,
+                int_to_ip(decoded.dst_ip),
+                decoded.dport,
+                'TCP' if decoded.proto == enipdecode.IPPROTO_TCP else 'UDP'
+            )
+        else:
+            stat_key = '{0:s}/{1:s}/{2:s}'.format(
+                int_to_ip(decoded.src_ip),
+                int_to_ip(decoded.dst_ip),
+                LOCAL_PROTOS.get(decoded.proto, str(decoded.proto))
+            )
+        self.__packet_stats[stat_key] = self.__packet_stats.get(stat_key, 0) + self.weight(message)
+
+    def weight(self, message: SniffedMessage) -> float:
+        '''Number of packets message stands for: 1/sample if the kernel filter only keeps a sample of its flow.'''
+        return self.__weight if is_sampled(message.proto, message.sport, message.dport) else 1
+
+    def get_decoder_stats(self) -> dict:
+        '''Get the number of frames decoded by the fast path and by Scapy.'''
+        return dict(self.__decoder_stats)
+
+    def get_capture_stats(self) -> dict:
+        '''Get the kernel counters of the capture socket: frames kept by the filter ('packets') and frames lost
+        because the sniffer did not keep up ('drops'), and with workers the frames dropped because a decoder
+        process did not keep up ('ring_drops'). None when not running.'''
+        capture = self.__capture
+        return capture.stats() if capture is not None else None
+
     def get_stats(self) -> OrderedDict:
         '''
         Get a sorted dictionary containing the amount of sniffed packets per second, using the timestamp as the key.
+        Sampled flows are scaled by 1/sample, see weight.
         '''
-        pkts = self.__packet_stats.items()
+        pkts = [(stat_key, round(count)) for stat_key, count in self.__packet_stats.items()]
         self.__packet_stats = {}
         stats = OrderedDict(sorted(pkts, key=lambda x: x[1], reverse=True))
         return stats
 
-    def pop(self):
-        '''Pop the next message in queue'''
+    def pop(self) -> SniffedMessage:
+        '''Pop the next message in queue, to_dict gives it as a dictionary'''
         try:
             value = self.__messages.popleft()
             return value
@@ -232,7 +304,33 @@ class ICSSniffer(Thread):
 
     def run(self):
         '''Override from Thread'''
-        sniff(iface=self.__iface, count=0, store=0, prn=self.__handle_pkt, stop_filter=lambda p: self.should_stop.is_set())
+        if self.__workers > 0:
+            self.__run_pipeline()
+            return
+        capture = RingCapture if self.__ring else PacketCapture
+        self.__capture = capture(self.__iface, self.__sample)  # Raw frames, filtered in the kernel
+        try:
+            while not self.should_stop.is_set():
+                for frame in self.__capture.frames(0.5):
+                    self.handle_frame(frame)
+        finally:
+            sock, self.__capture = self.__capture, None
+            sock.close()
+
+    def __run_pipeline(self):
+        '''Merge the messages, statistics and decoder counts sent back by the decoder processes.'''
+        self.__capture = Pipeline(self.__iface, self.__sample, self.__ring, self.__workers, type(self))
+        try:
+            while not self.should_stop.is_set():
+                for messages, stats, decoded in self.__capture.results(0.5):
+                    self.__messages.extend(messages)
+                    for stat_key, count in stats.items():
+                        self.__packet_stats[stat_key] = self.__packet_stats.get(stat_key, 0) + count
+                    for path, count in decoded.items():
+                        self.__decoder_stats[path] += count
+        finally:
+            pipeline, self.__capture = self.__capture, None
+            pipeline.close()
 
 class IDSPrompt(Cmd):
     '''Crude command line interface for the IDS. Meant as a testbed.'''
@@ -262,6 +360,7 @@ class IDSPrompt(Cmd):
         if self.__backend is not None:
             msg = self.__backend.pop()
             if msg is not None:
+                msg = msg.to_dict()
                 if 'src' in msg.keys() and 'IP' in msg['src'].keys():
                     if msg['src']['IP'] not in self.__locations.keys():             # Insert a new host within the locations cache
                         rsp = requests.get(self.__rest_uri + '/hosts/' + msg['src']['MAC'] + '/None', auth=self.__rest_auth, headers=self.__rest_hdr)
@@ -302,15 +401,35 @@ class IDSPrompt(Cmd):
         else:
             print('No message queue')
 
-    def do_start(self, arg): # pylint: disable=W0613
-        '''Start the network sniffer'''
+    def do_drops(self, line): # pylint: disable=W0613
+        '''Get the kernel capture counters and the frames decoded by each path'''
+        if self.__backend is not None and self.__backend.is_alive():
+            print(self.__backend.get_capture_stats())
+            print(self.__backend.get_decoder_stats())
+        else:
+            print('Sniffer is not running.')
+
+    def do_start(self, arg):
+        '''Start the network sniffer: start [ring] [<workers>]
+        ring -- Capture through a TPACKET_V3 ring
+        workers -- Number of decoder processes, 0 (default) to decode in the sniffer thread'''
+        ring = False
+        workers = 0
+        for option in arg.split():
+            if option == 'ring':
+                ring = True
+            elif option.isdigit():
+                workers = int(option)
+            else:
+                print('Unknown option: {0:s}'.format(option))
+                return
         if self.__backend is not None and self.__backend.is_alive():    # The sniffer is up and running, no need to start it again
             print('Sniffer is already running.')
         else:
             try:                                                        # Attempt to start a new instance of a sniffer class
                 if self.__backend is not None:
                     self.__backend = None
-                self.__backend = ICSSniffer(self.__iface)               # Initialize the sniffer with the interface
+                self.__backend = ICSSniffer(self.__iface, ring=ring, workers=workers)   # Initialize the sniffer with the interface
                 self.__backend.start()
             except RuntimeError:
                 pass
@@ -26,11 +26,11 @@ class SnifferHandler(threading.Thread):
     Receives relevant data from the analyzed traffic.
     '''
 
-    def __init__(self, iface: str, parent):
+    def __init__(self, iface: str, parent, ring: bool = False, workers: int = 0):
         threading.Thread.__init__(self)
         self.__parent = parent
         self.__buffer = collections.deque(iterable=[], maxlen=65536)
-        self.__sniffer = sdnids.ICSSniffer(interface=iface)
+        self.__sniffer = sdnids.ICSSniffer(interface=iface, ring=ring, workers=workers)
         self.should_stop = threading.Event()
         self.__pps = 0
 
@@ -44,15 +44,17 @@ class SnifferHandler(threading.Thread):
         self.__sniffer.start()
         while not self.should_stop.is_set():
             self.__buffer.clear()
-            self.__pps = self.__sniffer.size()
-            i = self.__pps
+            i = self.__sniffer.size()
+            pps = 0
             enip = 0
             while i > 0:
                 curr_msg = self.__sniffer.pop()
-                if curr_msg['is_enip']:
+                pps += self.__sniffer.weight(curr_msg)  # Sampled packets stand for 1/sample packets
+                if curr_msg.is_enip:
                     enip += 1
                 self.__buffer.append(curr_msg)
                 i -= 1
+            self.__pps = round(pps)
             self.__parent.push_hpps([time.time(), self.__pps, enip])
             time.sleep(1)
         cherrypy.log(msg='Handler stopped. Sending stop signal to sniffer ...', context='SNIFFER HANDLER')
@@ -69,7 +71,7 @@ class MainApp():
     '''
 
     def __init__(self, **kwargs):
-        if any(kw not in ['idsconfig', 'onosip', 'onosport', 'onosuser', 'onospass', 'idsiface'] for kw in kwargs.keys()): # pylint: disable=C0201
+        if any(kw not in ['idsconfig', 'onosip', 'onosport', 'onosuser', 'onospass', 'idsiface', 'idsring', 'idsworkers'] for kw in kwargs.keys()): # pylint: disable=C0201
             raise MissingArgumentException
         idsconfig = kwargs.pop('idsconfig')
         onosip = kwargs.pop('onosip')
@@ -77,12 +79,14 @@ class MainApp():
         onosuser = kwargs.pop('onosuser')
         onospass = kwargs.pop('onospass')
         idsiface = kwargs.pop('idsiface')
+        idsring = kwargs.pop('idsring', False)          # Capture through a TPACKET_V3 ring
+        idsworkers = kwargs.pop('idsworkers', 0)        # Decoder processes, 0 to decode in the sniffer thread
         iconf = open(idsconfig, 'r').read()
         self.__i_path = idsconfig
         self.__i_conf = json.loads(iconf)
         self.__h_pps = collections.deque(iterable=[], maxlen=600)
         self.__onos = pyonos.ONOSClient(onosip, onosport, onosuser, onospass)
-        self.__s_handler = SnifferHandler(idsiface, self)
+        self.__s_handler = SnifferHandler(idsiface, self, idsring, idsworkers)
         self.__s_handler.start()
 
     def push_hpps(self, data: list):
@@ -424,6 +428,8 @@ def main():
         application = MainApp(
             idsconfig='sdnconfig.json',
             idsiface='att2',
+            idsring=False,
+            idsworkers=0,
             onosip='192.168.56.50',
             onosport=8181,
             onosuser='onos',
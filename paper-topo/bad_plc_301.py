@@ -9,8 +9,7 @@ from utils import *
 import time
 import sys
 import socket
-import json
-import select
+import channel
 
 P301 = ('P301', 3)
 LIT301 = ('LIT301', 3)
@@ -81,7 +80,7 @@ class PLC301(PLC):
 		        
 
             else:
-	            self.send_message(PLC101_ADDR, 8754, lit301)
+	            self.send_message(PLC101_ADDR, 8754, lit301, LIT301)
 		    print "Regular"
 
 	            if lit301 >= LIT_301_M['HH'] :
@@ -99,23 +98,9 @@ class PLC301(PLC):
             count += 1 
 
 
-    def send_message(self, ipaddr, port, message):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect((ipaddr, port))
-
-        msg_dict = dict.fromkeys(['Type', 'Variable'])
-        msg_dict['Type'] = "Report"
-        msg_dict['Variable'] = message
-        message = json.dumps(str(msg_dict))
-
-        try:
-            ready_to_read, ready_to_write, in_error = select.select([sock, ], [sock, ], [], 5)
-        except:
+    def send_message(self, ipaddr, port, message, tag):
+        if not channel.send_message(ipaddr, port, message, tag):
             print "Socket error"
-            return
-        if(ready_to_write > 0):
-            sock.send(message)
-        sock.close()
 
 if __name__ == "__main__":
 
@@ -0,0 +1,69 @@
+"""
+codec.py: fixed-layout binary encoding of Report/Command messages
+
+Every message is 20 bytes: message type, value kind, tag id, timestamp and the
+value itself. Tag ids index the LOOP_*_TAGS tuples declared in utils.py and the
+value is typed after the tag declaration (REAL or INT). Commands carry no tag,
+their value is the index of the command name in COMMANDS.
+"""
+
+import struct
+import time
+
+from collections import namedtuple
+
+import utils
+
+# Message types
+REPORT = 1
+COMMAND = 2
+
+# Value kinds
+REAL = 1
+INT = 2
+CMD = 3
+
+COMMANDS = (
+    'Switch_flow',
+    'Switch_plc',
+)
+
+HEADER = struct.Struct('!BB')                   # type, kind
+REAL_MESSAGE = struct.Struct('!BBHdd')          # type, kind, tag id, timestamp, value
+INT_MESSAGE = struct.Struct('!BBHdq')
+MESSAGE_SIZE = REAL_MESSAGE.size
+
+Message = namedtuple('Message', ['type', 'tag', 'value', 'timestamp'])
+
+# Tag id 0 means no tag
+TAG_DECLARATIONS = (None,) + tuple(
+    tag for loop in sorted(n for n in dir(utils) if n.startswith('LOOP_') and n.endswith('_TAGS'))
+    for tag in getattr(utils, loop))
+TAGS = tuple(None if tag is None else (tag[0], tag[1]) for tag in TAG_DECLARATIONS)
+TAG_IDS = dict((tag, tag_id) for tag_id, tag in enumerate(TAGS) if tag is not None)
+TAG_KINDS = tuple(None if tag is None else (REAL if tag[2] == 'REAL' else INT) for tag in TAG_DECLARATIONS)
+COMMAND_IDS = dict((name, index) for index, name in enumerate(COMMANDS))
+
+
+def encode(msg_type, tag, value, timestamp=None):
+    """ Packs a message. tag is a (name, pid) tuple or None for commands """
+    if timestamp is None:
+        timestamp = time.time()
+    if tag is None:
+        return INT_MESSAGE.pack(msg_type, CMD, 0, timestamp, COMMAND_IDS[value])
+    tag_id = TAG_IDS[(tag[0], tag[1])]
+    if TAG_KINDS[tag_id] == REAL:
+        return REAL_MESSAGE.pack(msg_type, REAL, tag_id, timestamp, value)
+    return INT_MESSAGE.pack(msg_type, INT, tag_id, timestamp, int(value))
+
+
+def decode(payload):
+    """ Unpacks a message into a Message(type, tag, value, timestamp) """
+    kind = HEADER.unpack_from(payload)[1]
+    if kind == REAL:
+        msg_type, kind, tag_id, timestamp, value = REAL_MESSAGE.unpack_from(payload)
+    else:
+        msg_type, kind, tag_id, timestamp, value = INT_MESSAGE.unpack_from(payload)
+        if kind == CMD:
+            return Message(msg_type, None, COMMANDS[value], timestamp)
+    return Message(msg_type, TAGS[tag_id], value, timestamp)
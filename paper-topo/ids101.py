@@ -6,8 +6,9 @@ from threading import Thread
 import sys
 import time
 import socket
-import json
 import select
+import channel
+import codec
 
 SENSOR_ADDR = IP['lit101']
 PLC101_ADDR = IP['plc101']
@@ -24,24 +25,12 @@ class Ids101(PLC):
 
 	def switch_component(self, controller_ip, controller_port, component):
 	    print "Connecting to ONOS"
-	    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-	    sock.connect((controller_ip, int(controller_port)))
-	    msg_dict = dict.fromkeys(['Type', 'Variable'])
-	    msg_dict['Type'] = "Command"		
-	    msg_dict['Variable'] = component
-	    message = json.dumps(str(msg_dict))
-	    try:
-	        ready_to_read, ready_to_write, in_error = select.select([sock, ], [sock, ], [], 5)
-		self.stop_defense_time = time.time()
-		self.defense_time = self.stop_defense_time - self.start_defense_time
-		print "Defense time: ", self.defense_time
-	    except socket.error, exc:
+	    if not channel.send_message(controller_ip, controller_port, component, None, codec.COMMAND):
 	        print "Socket error"
-	        print exc
 	        return
-            if(ready_to_write > 0):
-	        sock.send(message)
-	    sock.close()
+	    self.stop_defense_time = time.time()
+	    self.defense_time = self.stop_defense_time - self.start_defense_time
+	    print "Defense time: ", self.defense_time
 
 	def calculate_controls(self, variable):
  	    print "calculate action control"
@@ -162,7 +151,7 @@ class Ids101(PLC):
                             print "DEBUG estimated : %.5f" % (self.estimated_level)
                             print "DEBUG received : %.5f" % (self.received_level)
 
-			    self.send_message(IP['plc101'], 4234, self.new_estimated_level)
+			    self.send_message(IP['plc101'], 4234, self.new_estimated_level, LIT101)
 			    self.estimated_level = self.new_estimated_level
 		            #self.received_level = float(self.receive(LIT301, LIT301_ADDR))
 			    self.wait_time = PLC_PERIOD_SEC
@@ -171,23 +160,9 @@ class Ids101(PLC):
 	                count += 1		
 	                time.sleep(self.wait_time)					
 
-    	def send_message(self, ipaddr, port, message):
-	        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-	        sock.connect((ipaddr, port))
-
-	        msg_dict = dict.fromkeys(['Type', 'Variable'])
-	        msg_dict['Type'] = "Report"
-	        msg_dict['Variable'] = message
-	        message = json.dumps(str(msg_dict))
-
-	        try:
-	            ready_to_read, ready_to_write, in_error = select.select([sock, ], [sock, ], [], 5)
-	        except:
-	            print "Socket error"
-	            return
-	        if(ready_to_write > 0):
-	            sock.send(message)
-	        sock.close()
+	def send_message(self, ipaddr, port, message, tag):
+		if not channel.send_message(ipaddr, port, message, tag):
+			print "Socket error"
 
 if __name__ == '__main__':
 	ids101 = Ids101(name='ids101',state=STATE,protocol=IDS101_PROTOCOL,memory=GENERIC_DATA,disk=GENERIC_DATA)
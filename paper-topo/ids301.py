@@ -6,8 +6,9 @@ from threading import Thread
 import sys
 import time
 import socket
-import json
 import select
+import channel
+import codec
 
 SENSOR_ADDR = IP['lit301']
 #PLC101_ADDR = IP['plc101']
@@ -22,21 +23,8 @@ class Ids101(PLC):
 
 	def switch_component(self, controller_ip, controller_port, component):
 		print "Connecting to ONOS"
-	        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-	        sock.connect((controller_ip, int(controller_port)))
-	        msg_dict = dict.fromkeys(['Type', 'Variable'])
-	        msg_dict['Type'] = "Command"		
-	        msg_dict['Variable'] = component
-	        message = json.dumps(str(msg_dict))
-	        try:
-	            ready_to_read, ready_to_write, in_error = select.select([sock, ], [sock, ], [], 5)
-	        except socket.error, exc:
-	            print "Socket error"
-		    print exc
-	            return
-	        if(ready_to_write > 0):
-	            sock.send(message)
-	        sock.close()
+		if not channel.send_message(controller_ip, controller_port, component, None, codec.COMMAND):
+			print "Socket error"
 
 	def calculate_controls(self, variable):
  	    print "calculate action control"
@@ -129,7 +117,7 @@ class Ids101(PLC):
 		    	self.previous_level = self.received_level
 
 		    else:
-			self.send_message(PLC101_ADDR, 8754, self.received_level)
+			self.send_message(PLC101_ADDR, 8754, self.received_level, LIT301)
 			print "Sending level to PLC101", self.received_level
 	            	if self.received_level >= LIT_301_M['HH'] :	            
 	                    p301 = 1
@@ -141,28 +129,14 @@ class Ids101(PLC):
 	            	    p301 = 0
 	                	            
 			print "Sending to P301", p301
-	            	self.send_message(IP['p301'], 6568, p301)
+	            	self.send_message(IP['p301'], 6568, p301, P301)
 
 	            count += 1		
         	    time.sleep(self.wait_time)					
 
-    	def send_message(self, ipaddr, port, message):
-	        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-	        sock.connect((ipaddr, port))
-
-	        msg_dict = dict.fromkeys(['Type', 'Variable'])
-	        msg_dict['Type'] = "Report"
-	        msg_dict['Variable'] = message
-	        message = json.dumps(str(msg_dict))
-
-	        try:
-	            ready_to_read, ready_to_write, in_error = select.select([sock, ], [sock, ], [], 5)
-	        except:
-	            print "Socket error"
-	            return
-	        if(ready_to_write > 0):
-	            sock.send(message)
-	        sock.close()
+	def send_message(self, ipaddr, port, message, tag):
+		if not channel.send_message(ipaddr, port, message, tag):
+			print "Socket error"
 
 if __name__ == '__main__':
 	ids101 = Ids101(name='ids101',state=STATE,protocol=IDS101_PROTOCOL,memory=GENERIC_DATA,disk=GENERIC_DATA)
@@ -4,9 +4,7 @@ from utils import *
 import time
 from threading import Thread
 
-import socket
-import json
-import select
+import channel
 
 
 PLC101_ADDR = IP['plc101']
@@ -22,27 +20,16 @@ class MVSocket(Thread):
 
     def run(self):
         print "DEBUG entering socket thread run"
-        self.sock = socket.socket()     # Create a socket object    
-        self.sock.bind((IP['mv101'] ,9587 ))
-        self.sock.listen(5)
-	self.command_time = 0
-
-        while True:
-            try:
-            	client, addr = self.sock.accept()
-		data = client.recv(4096)                                                # Get data from the client                     		
-            	message_dict = eval(json.loads(data))
-	        mv101 = int(message_dict['Variable'])
-
-	        print "received from PLC101!", mv101
-		self.plc.set(MV101, mv101)          
-		self.command_time = time.time() - self.command_time
-		print "Command time:", self.command_time
- 
-            except KeyboardInterrupt:
- 	        print "\nCtrl+C was hitten, stopping server"
-                client.close()
-        	break
+        self.command_time = 0
+        channel.serve(IP['mv101'], 9587, self.handle_message)
+
+    def handle_message(self, message):
+        mv101 = int(message.value)
+
+        print "received from PLC101!", mv101
+        self.plc.set(MV101, mv101)
+        self.command_time = time.time() - self.command_time
+        print "Command time:", self.command_time
 
 
 class Mv101(PLC):
@@ -4,9 +4,7 @@ from utils import *
 import time
 from threading import Thread
 
-import socket
-import json
-import select
+import channel
 
 
 PLC101_ADDR = IP['plc101']
@@ -22,25 +20,14 @@ class PSocket(Thread):
 
     def run(self):
         print "DEBUG entering socket thread run"
-        self.sock = socket.socket()     # Create a socket object    
-        self.sock.bind((IP['p101'] , 7842 ))
-        self.sock.listen(5)
-
-        while True:
-            try:
-                client, addr = self.sock.accept()
-                data = client.recv(4096)                                                # Get data from the client         
-            
-                message_dict = eval(json.loads(data))
-                p101 = int(message_dict['Variable'])
-
-                print "received from PLC101!", p101
-		self.plc.set(P101, p101)           
-
-            except KeyboardInterrupt:
-                print "\nCtrl+C was hitten, stopping server"
-                client.close()
-                break
+        channel.serve(IP['p101'], 7842, self.handle_message)
+
+    def handle_message(self, message):
+        p101 = int(message.value)
+
+        print "received from PLC101!", p101
+        self.plc.set(P101, p101)
+
 
 class PP101(PLC):
         def pre_loop(self, sleep=0.1):
@@ -4,10 +4,7 @@ from utils import *
 import time
 from threading import Thread
 
-
-import socket
-import json
-import select
+import channel
 
 
 PLC301_ADDR = IP['plc301']
@@ -24,25 +21,14 @@ class PSocket(Thread):
 
     def run(self):
         print "DEBUG entering socket thread run"
-        self.sock = socket.socket()     # Create a socket object    
-        self.sock.bind((IP['p301'] ,6568 ))
-        self.sock.listen(5)
-
-        while True:
-            try:
-            	client, addr = self.sock.accept()
-		data = client.recv(4096)                                                # Get data from the client         
-            
-            	message_dict = eval(json.loads(data))
-	        p301 = int(message_dict['Variable'])
-
-	        print "received from IDS301!", p301
-		self.plc.set(P301, p301)           
-
-            except KeyboardInterrupt:
- 	        print "\nCtrl+C was hitten, stopping server"
-                client.close()
-        	break
+        channel.serve(IP['p301'], 6568, self.handle_message)
+
+    def handle_message(self, message):
+        p301 = int(message.value)
+
+        print "received from IDS301!", p301
+        self.plc.set(P301, p301)
+
 
 class PP301(PLC):
 	def pre_loop(self, sleep=0.1):
@@ -7,8 +7,7 @@ from threading import Thread
 from utils import *
 from random import *
 
-import json
-import select
+import channel
 import socket
 import time
 
@@ -33,62 +32,32 @@ class Lit301Socket(Thread):
 
     def run(self):
         print "DEBUG entering socket thread run"
-        self.sock = socket.socket()     # Create a socket object    
-        self.sock.bind((IP['plc101-HMI'] , 8754 ))
-        self.sock.listen(5)
+        channel.serve(IP['plc101-HMI'], 8754, self.handle_message, lambda: self.plc.count <= PLC_SAMPLES)
 
-        while (self.plc.count <= PLC_SAMPLES):
-            try:
-            	client, addr = self.sock.accept()
-		data = client.recv(4096)                                                # Get data from the client
-            	message_dict = eval(json.loads(data))
-	        lit301 = float(message_dict['Variable'])
+    def handle_message(self, message):
+        lit301 = float(message.value)
 
-	        print "received from LIT301!", lit301
+        print "received from LIT301!", lit301
 
-	        if lit301 >= LIT_301_M['HH'] :
-                    #self.plc.send(P101, 0, IP['plc101'])
-	            self.send_message(IP['p101'], 7842 , 0)
+        if lit301 >= LIT_301_M['HH'] :
+            #self.plc.send(P101, 0, IP['plc101'])                  
+            self.send_message(IP['p101'], 7842 , 0, P101)
 
+        elif lit301 >= LIT_301_M['H']:
+            #self.plc.send(P101, 0, IP['plc101'])
+            self.send_message(IP['p101'], 7842 , 0, P101)
 
-	        elif lit301 >= LIT_301_M['H']:
-                    #self.plc.send(P101, 0, IP['plc101'])
-	            self.send_message(IP['p101'], 7842 , 0)
+        elif lit301 <= LIT_301_M['L']:
+            #self.plc.send(P101, 1, IP['plc101'])
+            self.send_message(IP['p101'], 7842 , 1, P101)
 
+        elif lit301 <= LIT_301_M['LL']:
+            #self.plc.send(P101, 1, IP['plc101'])
+            self.send_message(IP['p101'], 7842 , 1, P101)
 
-            	elif lit301 <= LIT_301_M['L']:
-                    #self.plc.send(P101, 1, IP['plc101'])
-                    self.send_message(IP['p101'], 7842 , 1)
-
-
-            	elif lit301 <= LIT_301_M['LL']:
-                    #self.plc.send(P101, 1, IP['plc101'])
-	            self.send_message(IP['p101'], 7842 , 1)
-
-
-            except KeyboardInterrupt:
- 	        print "\nCtrl+C was hitten, stopping server"
-                client.close()
-        	break
-
-
-    def send_message(self, ipaddr, port, message):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect((ipaddr, port))
-
-        msg_dict = dict.fromkeys(['Type', 'Variable'])
-        msg_dict['Type'] = "Report"
-        msg_dict['Variable'] = message
-        message = json.dumps(str(msg_dict))
-
-        try:
-            ready_to_read, ready_to_write, in_error = select.select([sock, ], [sock, ], [], 5)
-        except:
+    def send_message(self, ipaddr, port, message, tag):
+        if not channel.send_message(ipaddr, port, message, tag):
             print "Socket error"
-            return
-        if(ready_to_write > 0):
-            sock.send(message)
-        sock.close()
 
 class HMISocket(Thread):
     """ Class that responds to the POLL command from HMI """
@@ -121,62 +90,36 @@ class IdsSocket(Thread):
 
     def run(self):
         print "DEBUG entering socket thread run"
-        self.sock = socket.socket()     # Create a socket object    
-        self.sock.bind((IP['plc101'] , 4234 ))
-        self.sock.listen(5)
-
-        while (self.plc.count <= PLC_SAMPLES):
-            try:
-	        client, addr = self.sock.accept()
-		data = client.recv(4096)                                                # Get data from the client         
-
-		#lit101 = float(self.plc.recieve(LIT101, IDS_ADDR))
-	        message_dict = eval(json.loads(data))
-	        lit101 = float(message_dict['Variable'])
-		print "received from IDS!", lit101
-
-            
-	        #print 'DEBUG plc1 lit101: %.5f' % lit101
+        channel.serve(IP['plc101'], 4234, self.handle_message, lambda: self.plc.count <= PLC_SAMPLES)
 
-	        if lit101 >= LIT_101_M['HH'] :
-	            #self.plc.send(MV101, 0, IP['plc101'])
-               	    mv = 0
+    def handle_message(self, message):
+        #lit101 = float(self.plc.recieve(LIT101, IDS_ADDR))
+        lit101 = float(message.value)
+        print "received from IDS!", lit101
 
-	        elif lit101 >= LIT_101_M['H']:
-	            #self.plc.send(MV101, 0, IP['plc101'])
-                    mv = 0
+        #print 'DEBUG plc1 lit101: %.5f' % lit101
 
-	        elif lit101 <= LIT_101_M['L']:
-	            #self.plc.send(MV101, 1, IP['plc101'])
-                    mv = 1
+        if lit101 >= LIT_101_M['HH'] :
+            #self.plc.send(MV101, 0, IP['plc101'])
+            mv = 0
 
-	        elif lit101 <= LIT_101_M['LL']:
-	            #self.plc.send(MV101, 1, IP['plc101'])                
-                    mv = 1
+        elif lit101 >= LIT_101_M['H']:
+            #self.plc.send(MV101, 0, IP['plc101'])
+            mv = 0
 
-                self.send_message(IP['mv101'], 9587, mv)
-       	    except KeyboardInterrupt:
-	    	print "\nCtrl+C was hitten, stopping server"
-	        client.close()
-		break
+        elif lit101 <= LIT_101_M['L']:
+            #self.plc.send(MV101, 1, IP['plc101'])
+            mv = 1
 
-    def send_message(self, ipaddr, port, message):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.connect((ipaddr, port))
+        elif lit101 <= LIT_101_M['LL']:
+            #self.plc.send(MV101, 1, IP['plc101'])                
+            mv = 1
 
-        msg_dict = dict.fromkeys(['Type', 'Variable'])
-        msg_dict['Type'] = "Report"
-        msg_dict['Variable'] = message
-        message = json.dumps(str(msg_dict))
+        self.send_message(IP['mv101'], 9587, mv, MV101)
 
-        try:
-            ready_to_read, ready_to_write, in_error = select.select([sock, ], [sock, ], [], 5)
-        except:
+    def send_message(self, ipaddr, port, message, tag):
+        if not channel.send_message(ipaddr, port, message, tag):
             print "Socket error"
-            return
-        if(ready_to_write > 0):
-            sock.send(message)
-        sock.close()        
 
 class PLC101(PLC):
 